@@ -1,122 +1,163 @@
-import math
-import socket 
+import collections
+import os
+import sys
 
-lastTime =0
-#creating a socket connection to the robot
-UDP_IP = "192.168.11.2"
-UDP_PORT = 2013
-sock = socket.socket(socket.AF_INET, #Internet
-socket.SOCK_DGRAM) #UDP
+#the robotbridge package sits next to this script. SmartBody doesn't always set __file__ when
+#running a script, so fall back to the AndroidProject checkout
+ROBOTBRIDGE_PATH = r"C:\Users\SENRYAKU\Desktop\AndroidProject\Smartbody CharacterScripts"
+if "__file__" in globals():
+	ROBOTBRIDGE_PATH = os.path.dirname(os.path.abspath(__file__))
+if ROBOTBRIDGE_PATH not in sys.path:
+	sys.path.append(ROBOTBRIDGE_PATH)
+from robotbridge import delta, fanout, filters, idle, mapping, predict, protocol, recording, safety, sender, telemetry
+#the python vhmsg layer, for batching the telemetry
+VHMSG_PATH = os.path.join(ROBOTBRIDGE_PATH, "..", "vhmsg", "vhmsg-py")
+if VHMSG_PATH not in sys.path:
+	sys.path.append(VHMSG_PATH)
+from vhmsgclient import batching
 
-class MyController (PythonController):
-	#lastTime = 0
-	
-	def init(self, pawn):
-		# setup
-		print "Setting up controller..."
-		
-	def evaluate(self):
-		global lastTime
-		# run at 30 fps
-		curTime = scene.getSimulationManager().getTime()
+#every frame is sent once to each of these endpoints: robot heads, logging sinks, ...
+#an (ip, port) pair is UDP; "tcp://ip:port" keeps a stream open (reconnected in the background)
+#and "unix:/path/to/socket" reaches a driver on this machine.
+#endpoints that stop answering are backed off so they don't hold up the others. check them with:
+#print robotSender.fanout.health()
+ROBOT_ENDPOINTS = [
+	("192.168.11.2", 2013),
+	#"tcp://192.168.11.2:2013",
+]
+#ask the robot to acknowledge every frame (binary mode only) and track round trip percentiles,
+#loss and reordering per endpoint. the figures go out with the telemetry as acks.<endpoint>.<stat>
+ROBOT_ACKS = False
+#"binary" sends every joint for a tick as one joint frame datagram, "text" falls back to the old
+#set_joint:N:V message per joint for robots that don't understand frames
+FRAME_MODE = "binary"
+#only joints that moved at least their deadband (robot units) are resent, with a full keyframe
+#every KEYFRAME_INTERVAL ticks so the robot can recover from dropped packets
+JOINT_DEADBANDS = {}
+KEYFRAME_INTERVAL = 30
+#channel to robot joint conversion: channel, component, offset, scale, clamp range and joint id
+#per row. edit the table rather than this script to change or add joints
+JOINT_TABLE = os.path.join(ROBOTBRIDGE_PATH, "robotjoints.txt")
+jointTable = mapping.compileJointTable(mapping.loadJointTable(JOINT_TABLE))
+#per-joint smoothing and servo limits in robot units, e.g. to let the mouth follow lip-sync
+#without overshooting:
+#	5: {"filter": "damped", "frequency": 40, "maxVelocity": 1500, "maxAcceleration": 30000},
+#"filter" is "oneeuro" (minCutoff, beta, derivativeCutoff) or "damped" (frequency). joints not
+#listed go to the robot unfiltered
+JOINT_FILTERS = {
+}
+#procedural idle motion so the robot doesn't freeze between utterances: blinks on the eyelid,
+#micro-saccades on the eyes and a breathing-like neck sway, precomputed as looping tables and
+#added to the live joints. saccades and sway fade out while SmartBody moves those joints itself.
+#overrides go in the dict (see robotbridge/idle.py for the keys), None turns idle motion off
+IDLE_MOTION = {
+	#"blinkInterval": (3.0, 8.0),
+	#"sway": {7: -10, 8: -10, 9: 6},
+}
+#seconds of lead for the lip-sync joints: their recent motion is extrapolated this far ahead to
+#make up for queueing, network and servo lag. 0 turns prediction off. SERVO_LAG is the measured
+#servo response time, it only feeds the latency report: print robotSender.latency.summary()
+LIP_SYNC_LEAD = 0.0
+LIP_SYNC_JOINTS = [5]
+SERVO_LAG = 0.0
+#servo limits enforced on everything that goes out: each joint is clamped to SAFETY_RANGE (or its
+#own min/max) and moves at most maxRate units per second. if the converted joints go NaN or more
+#than SAFETY_FAULT_MARGIN outside their range the robot holds its last safe pose until the input
+#has been good for SAFETY_RECOVER_TICKS ticks. print robotSender.envelope.report() for per joint counts
+SAFETY_RANGE = (0, 255)
+SAFETY_LIMITS = {
+	#9: {"min": 40, "max": 215, "maxRate": 400},
+}
+SAFETY_FAULT_MARGIN = 2560
+SAFETY_RECOVER_TICKS = 5
+#frames per second sent to the robot. ticks stay on a fixed grid, check the achieved rate and
+#jitter with: print robotSender.scheduler.summary()
+ROBOT_RATE_HZ = 30
+#snapshots held for the sender thread before the oldest gets overwritten
+SNAPSHOT_BUFFER = 8
+#directory to record every frame sent to the robot into, one .rjr file per session. None turns
+#recording off. play a recording back without SmartBody with: python -m robotbridge.replay <file>
+RECORDING_DIR = None
+#telemetry about the joints sent, as vhmsg messages. at most TELEMETRY_RATE_HZ records a second,
+#and each (message name, decimation, format) subscriber gets every decimation-th record.
+#format is "kv" (seq=12 t=3.210 eyebrow=25 ...) or "binary" (base64 joint frame).
+#with no subscribers nothing is formatted at all
+TELEMETRY_RATE_HZ = 10
+TELEMETRY_SUBSCRIBERS = [
+	("myrobot", 1, "kv"),
+]
+#seconds to hold telemetry messages back and send them together. pending records of the same
+#message name coalesce, so only the newest goes out; 0 sends every record straight away.
+#print robotTelemetryPublisher.summary() for the message rate and bytes saved
+TELEMETRY_BATCH_INTERVAL = 0
+#vhmsgs waiting for evaluate to send them. telemetry comes from the sender and batching threads,
+#and SmartBody's python api may only be called from its own thread. the oldest go first if
+#SmartBody stops evaluating
+VHMSG_QUEUE_LIMIT = 1000
+robotVhmsgQueue = collections.deque(maxlen=VHMSG_QUEUE_LIMIT)
 
-		if curTime - lastTime < .060 :
-			return
-		
-		eyebrow_left = self.getChannelValue("au_1_left")
-		eyebrow_right = self.getChannelValue("au_1_right")
-		eyebrow= math.ceil(((eyebrow_left+eyebrow_right)/2) * 100) / 100 
-
-		eyeball_left = self.getChannelQuat("eyeball_left")
-		eyeball_pan =  math.ceil(eyeball_left.getData(1) *100)/100
-		eyeball_tilt = math.ceil(eyeball_left.getData(2)* 100)/100
-		
-		eyebrow_knit_left= self.getChannelValue("au_4_left")
-		eyebrow_knit_right = self.getChannelValue("au_4_right")
-		eyebrow_knit = math.ceil(((eyebrow_knit_left + eyebrow_knit_right)/2) *100)/100 
+def sendVhmsg(message):
+	#any thread: queued for the next evaluate
+	robotVhmsgQueue.append(message)
 
-		eyelid_left = self.getChannelValue("au_45_left")
-		eyelid_right = self.getChannelValue("au_45_right")
-		eyelid = math.ceil(((eyelid_left + eyelid_right)/2) * 100)/100
+def drainVhmsgs():
+	#SmartBody thread only
+	while robotVhmsgQueue:
+		name, record = robotVhmsgQueue.popleft().split(" ", 1)
+		scene.vhmsg2(name, record)
 
-		mouth = math.ceil(self.getChannelValue("au_26") * 100)/100
-		open_mouth = math.ceil(self.getChannelValue("open")*100)/100
-		mouth_corner_left = self.getChannelValue("au_12_left")
-		mouth_corner_right = self.getChannelValue("au_12_right")
-		mouth_corner = math.ceil(((mouth_corner_left + mouth_corner_right) /2) * 100)/100
+if "robotTelemetryPublisher" in globals() and robotTelemetryPublisher is not None:
+	robotTelemetryPublisher.stop()
+robotTelemetryPublisher = None
+if TELEMETRY_BATCH_INTERVAL:
+	robotTelemetryPublisher = batching.BatchingPublisher(sendVhmsg, stateOps=[name for name, decimation, format in TELEMETRY_SUBSCRIBERS],
+		maxDelay=TELEMETRY_BATCH_INTERVAL).start()
 
-		head = self.getChannelQuat("spine5"); 
-		headturn = math.ceil(head.getData(1) *100)/100
-		necktilt = math.ceil(head.getData(2) *100)/100
-		#headnod = math.ceil(head.getData(3) *100)/100 
+def vhmsgSink(name):
+	# send some data as a VHMSG. Message name will be 'myrobot', data will be data that was gleaned from channels
+	if robotTelemetryPublisher is not None:
+		return lambda record: robotTelemetryPublisher.publish("%s %s" % (name, record))
+	return lambda record: sendVhmsg("%s %s" % (name, record))
 
-		#convert Values to the robot coordinate system
-		eyebrow_robot = eyebrow * 255
-		eyebrow_knit_robot = eyebrow_knit * 255
-		eyelid_robot = eyelid * .5 * 255
-		eyeball_pan_robot = ((eyeball_pan * -1) +.30) * 425 
-		eyeball_tilt_robot = ((eyeball_tilt * -1) +.10) * 1275
-		mout_robot = 0
-		if(open_mouth > mouth):
-			mouth_robot = (open_mouth *255) +40
-		else: 
-			mouth_robot = mouth *255
-		mouth_corner_robot = mouth_corner * 255
-		necklean_left_robot = 255 
-		necklean_right_robot = 255 
-		headturn_robot = (headturn +.15) * 637.5
-		if (necktilt < 0): 
-			necklean_right_robot = 255 - ((necktilt * -1) * 2550)
-		elif (necktilt > 0):
-			necklean_left_robot  = 255 - (necktilt * 2550)
-		else: 
-			necklean_right_robot = 255
-			necklean_left_robot = 255
+robotTelemetry = telemetry.Telemetry(jointTable.names, TELEMETRY_RATE_HZ)
+for name, decimation, format in TELEMETRY_SUBSCRIBERS:
+	robotTelemetry.subscribe(name, vhmsgSink(name), decimation, format)
+robotFanout = fanout.FanoutSender(ROBOT_ENDPOINTS, trackAcks=ROBOT_ACKS and FRAME_MODE == "binary")
+if robotFanout.trackAcks:
+	robotTelemetry.addSource("acks", robotFanout.ackStats)
 
-		
- 		JointZeroMessage ="set_joint:0:%d" % (eyebrow_robot)
- 		JointOneMessage ="set_joint:1:%d" % (eyebrow_knit_robot)
- 		JointTwoMessage = "set_joint:2:%d" % (eyelid_robot)
- 		JointThreeMessage = "set_joint:3:%d" % (eyeball_pan_robot)
- 		JointFourMessage = "set_joint:4:%d" % (eyeball_tilt_robot)
- 		JointFiveMessage = "set_joint:5:%d" % (mouth_robot)
- 		JointSixMessage = "set_joint:6:%d" % (mouth_corner_robot)
- 		JointSevenMessage = "set_joint:7:%d" % (necklean_left_robot)
- 		JointEightMessage = "set_joint:8:%d" % (necklean_right_robot)
- 		JointNineMessage = "set_joint:9:%d" % (headturn_robot)
- 		sock.sendto(JointFiveMessage, (UDP_IP, UDP_PORT))
- 		
- 		#JointTenMessage = "set_joint:10:%d" % (
- 		#JointElevenMessage = "set_joint:11:%d" % (
+#evaluate only snapshots channel values; converting, encoding and sending happen on this thread
+stages = []
+if IDLE_MOTION is not None:
+	stages.append(idle.IdleMotion(IDLE_MOTION, ROBOT_RATE_HZ))
+if LIP_SYNC_LEAD:
+	stages.append(predict.LeadPredictor(LIP_SYNC_LEAD, LIP_SYNC_JOINTS))
+stages.append(filters.MotionFilter(JOINT_FILTERS, 1.0 / ROBOT_RATE_HZ))
+robotEnvelope = safety.SafetyEnvelope(SAFETY_LIMITS, SAFETY_RANGE, SAFETY_FAULT_MARGIN, SAFETY_RECOVER_TICKS,
+	1.0 / ROBOT_RATE_HZ, jointTable.names)
+robotTelemetry.addSource("safety", robotEnvelope.stats)
+recorder = None
+if RECORDING_DIR:
+	recorder = recording.Recorder(recording.recordingPath(RECORDING_DIR))
+if "robotSender" in globals():
+	robotSender.stop()
+robotSender = sender.RobotSender(robotFanout, jointTable.transform, protocol.getEncoder(FRAME_MODE), ROBOT_RATE_HZ,
+	stages, delta.DeltaFilter(JOINT_DEADBANDS, keyframeInterval=KEYFRAME_INTERVAL), robotTelemetry, SNAPSHOT_BUFFER, recorder,
+	robotEnvelope)
+robotSender.latency.setFixed("servo", SERVO_LAG)
+robotSender.latency.setFixed("lead", -LIP_SYNC_LEAD)
+robotSender.start()
 
- 			#values converted to robot's value system 
-		
-		# send some data as a VHMSG. Message name will be 'myrobot', data will be data that was gleaned from channels
-		scene.vhmsg2("myrobot", "eyeball_pan: " + str(eyeball_pan_robot) + " eyeball_tilt: " + str(eyeball_tilt_robot)+ "  necktilt_right: " + str(necklean_right_robot) + 
-		 "necktilt_left: "+str(necklean_left_robot)+ "headturn:" + str(headturn_robot)+" eyebrow: " + str(eyebrow_robot) + "eyebrow knit: " + str(eyebrow_knit_robot) 
-		 + " eyelid:  " + str(eyelid_robot) + " mouth: " + str(mouth_robot) + " mouth corner:" + str(mouth_corner_robot))
-
-		
-		
-		sock.sendto(JointZeroMessage, (UDP_IP, UDP_PORT))
-		sock.sendto(JointOneMessage, (UDP_IP, UDP_PORT))
-		sock.sendto(JointTwoMessage, (UDP_IP, UDP_PORT))
-		sock.sendto(JointThreeMessage, (UDP_IP, UDP_PORT))
-		sock.sendto(JointFourMessage, (UDP_IP, UDP_PORT)) 
-		
-		
-		
-		sock.sendto(JointSixMessage, (UDP_IP, UDP_PORT))
-		sock.sendto(JointSevenMessage, (UDP_IP, UDP_PORT))
-		sock.sendto(JointEightMessage, (UDP_IP, UDP_PORT))
-		sock.sendto(JointNineMessage, (UDP_IP, UDP_PORT)) 
-		
-		
-		
+class MyController (PythonController):
 
-		lastTime = curTime
+	def init(self, pawn):
+		# setup
+		print "Setting up controller..."
 		
-
+	def evaluate(self):
+		curTime = scene.getSimulationManager().getTime()
+		robotSender.submit(curTime, mapping.snapshotChannels(self, jointTable.channels))
+		drainVhmsgs()
 
 
 myc = MyController()
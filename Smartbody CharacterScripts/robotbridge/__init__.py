@@ -0,0 +1 @@
+# helpers used by RobotController.py to get joint values from SmartBody out to the android robot
@@ -0,0 +1,82 @@
+import collections
+
+from robotbridge import protocol
+
+# Round trip measurement for acknowledged joint frames. Frames sent with FLAG_ACK_REQUEST are
+# echoed back by the robot (or robotbridge.receiver --ack) as a small ack datagram carrying the
+# frame's sequence number. AckTracker matches acks to send times and keeps a rolling window of
+# round trip times and delivery outcomes for percentiles, loss rate and reordering.
+
+DEFAULT_WINDOW = 200
+# a frame not acknowledged within this many seconds counts as lost
+DEFAULT_TIMEOUT = 1.0
+
+
+def percentile(ordered, fraction):
+	if not ordered:
+		return 0.0
+	index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+	return ordered[index]
+
+
+class AckTracker(object):
+
+	def __init__(self, window=DEFAULT_WINDOW, timeout=DEFAULT_TIMEOUT):
+		self.timeout = timeout
+		self.pending = collections.OrderedDict()
+		self.rtts = collections.deque(maxlen=window)
+		# True for an acknowledged frame, False for a lost one, newest last
+		self.outcomes = collections.deque(maxlen=window)
+		self.highestAcked = None
+		self.acked = 0
+		self.lost = 0
+		# duplicate acks and acks for frames already counted as lost
+		self.unmatched = 0
+		self.reordered = 0
+
+	def sent(self, seq, now):
+		self.pending[seq] = now
+
+	def received(self, seq, now):
+		# returns the round trip time, or None for an ack that matches nothing outstanding
+		sentAt = self.pending.pop(seq, None)
+		if sentAt is None:
+			self.unmatched += 1
+			return None
+		if self.highestAcked is not None and ((seq - self.highestAcked) & protocol.SEQ_MASK) > protocol.SEQ_MASK / 2:
+			self.reordered += 1
+		else:
+			self.highestAcked = seq
+		rtt = now - sentAt
+		self.rtts.append(rtt)
+		self.outcomes.append(True)
+		self.acked += 1
+		return rtt
+
+	def expire(self, now):
+		# pending is in send order, so stop at the first frame still inside the timeout
+		pending = self.pending
+		while pending:
+			seq, sentAt = next(pending.iteritems())
+			if now - sentAt < self.timeout:
+				break
+			del pending[seq]
+			self.outcomes.append(False)
+			self.lost += 1
+
+	def lossRate(self):
+		if not self.outcomes:
+			return 0.0
+		return float(self.outcomes.count(False)) / len(self.outcomes)
+
+	def stats(self):
+		ordered = sorted(self.rtts)
+		return {
+			"rtt50": percentile(ordered, .50),
+			"rtt90": percentile(ordered, .90),
+			"rtt99": percentile(ordered, .99),
+			"loss": self.lossRate(),
+			"reordered": self.reordered,
+			"acked": self.acked,
+			"lost": self.lost,
+		}
@@ -0,0 +1,227 @@
+# Offline compiler from the utterance .bml files (the <curves> and <lips> written by the
+# VisemeScheduler) straight to joint tracks in robot units, using the same joint table as
+# RobotController. Tracks are written as joint recordings, so robotbridge.replay plays them
+# with no renderer in the loop:
+#
+#   python -m robotbridge.bmltrack C:\Users\SENRYAKU\Documents\SmartBody\data\sounds --out tracks
+#   python -m robotbridge.replay tracks\hello.rjr --host 192.168.11.2
+#
+# SmartBody isn't running here, so channels are rebuilt from the BML curves alone: viseme and
+# action unit curves feed their channels directly, the FaceFX analysis curves (blink, brows,
+# head and eye angles in degrees) go through CURVE_CHANNELS. Channels with no curve stay at
+# their neutral value.
+#
+# Every frame then goes through a safety.SafetyEnvelope as on the live path, so a track never
+# holds more than the servos would have been sent: --range is RobotController's SAFETY_RANGE,
+# per joint limits (SAFETY_LIMITS) can be given to compileFile in an envelope of their own.
+
+import math
+import optparse
+import os
+import xml.etree.ElementTree as ElementTree
+
+from robotbridge import delta, mapping, protocol, recording, safety
+
+DEFAULT_RATE = 30.0
+# seconds of neutral pose appended after the last key
+DEFAULT_TAIL = 0.25
+
+# curve name -> list of (channel, component, kind). kind "value" copies the curve, "degrees"
+# turns a rotation angle into the matching quaternion component
+CURVE_CHANNELS = {
+	"open": [("open", None, "value")],
+	"au_1": [("au_1_left", None, "value"), ("au_1_right", None, "value")],
+	"Eyebrow Raise": [("au_1_left", None, "value"), ("au_1_right", None, "value")],
+	"au_4": [("au_4_left", None, "value"), ("au_4_right", None, "value")],
+	"au_12": [("au_12_left", None, "value"), ("au_12_right", None, "value")],
+	"au_26": [("au_26", None, "value")],
+	"au_45": [("au_45_left", None, "value"), ("au_45_right", None, "value")],
+	"Blink": [("au_45_left", None, "value"), ("au_45_right", None, "value")],
+	"Eye Yaw": [("eyeball_left", 1, "degrees")],
+	"Eye Pitch": [("eyeball_left", 2, "degrees")],
+	"Head Yaw": [("spine5", 1, "degrees")],
+	"Head Roll": [("spine5", 2, "degrees")],
+}
+
+# how far each viseme opens the mouth, used to build the "open" channel from <lips> when the
+# BML carries no open curve
+VISEME_OPEN = {
+	"Aa": 1.0, "Ao": .9, "Aw": .9, "Ah": .8, "Ay": .8, "Ow": .7, "Oy": .7, "Eh": .6, "Ih": .5,
+	"Er": .5, "EE": .4, "Kg": .4, "KG": .4, "H": .4, "L": .4, "R": .4, "oh": .7, "OO": .3,
+	"W": .3, "Sh": .3, "j": .3, "D": .3, "NG": .3, "Th": .3, "Z": .2, "F": .1, "BMP": 0.0, "_": 0.0,
+}
+
+
+class Curve(object):
+	# FaceFX curve: keys of (time, value, slope in, slope out) with hermite interpolation
+
+	def __init__(self, keys):
+		self.keys = sorted(keys)
+		self.index = 0
+
+	def end(self):
+		if not self.keys:
+			return 0.0
+		return self.keys[-1][0]
+
+	def evaluate(self, t):
+		# samples are taken in increasing time, so keep the segment from the last call
+		keys = self.keys
+		if not keys:
+			return 0.0
+		if t <= keys[0][0]:
+			return keys[0][1]
+		if t >= keys[-1][0]:
+			return keys[-1][1]
+		if t < keys[self.index][0]:
+			self.index = 0
+		while keys[self.index + 1][0] <= t:
+			self.index += 1
+		t0, v0, slopeIn0, slopeOut0 = keys[self.index]
+		t1, v1, slopeIn1, slopeOut1 = keys[self.index + 1]
+		h = t1 - t0
+		s = (t - t0) / h
+		s2 = s * s
+		s3 = s2 * s
+		return ((2 * s3 - 3 * s2 + 1) * v0 + (s3 - 2 * s2 + s) * h * slopeOut0
+			+ (-2 * s3 + 3 * s2) * v1 + (s3 - s2) * h * slopeIn1)
+
+
+def parseCurve(text):
+	values = [float(v) for v in text.split()]
+	return Curve([tuple(values[i:i + 4]) for i in range(0, len(values) - 3, 4)])
+
+
+def lipsCurve(lips):
+	# triangle per viseme peaking halfway through it, overlapping visemes keep the larger value
+	keys = []
+	for viseme, start, end in lips:
+		amount = VISEME_OPEN.get(viseme, 0.0)
+		keys.append((start, 0.0, 0.0, 0.0))
+		keys.append(((start + end) / 2, amount, 0.0, 0.0))
+		keys.append((end, 0.0, 0.0, 0.0))
+	keys.sort()
+	merged = []
+	for key in keys:
+		if merged and merged[-1][0] == key[0]:
+			if key[1] > merged[-1][1]:
+				merged[-1] = key
+		else:
+			merged.append(key)
+	return Curve(merged)
+
+
+def readBml(path):
+	# returns ({curve name: Curve}, [(viseme, start, end)])
+	root = ElementTree.parse(path).getroot()
+	curves = {}
+	for element in root.iter("curve"):
+		curves[element.get("name")] = parseCurve(element.text or "")
+	lips = []
+	for element in root.iter("lips"):
+		lips.append((element.get("viseme"), float(element.get("start")), float(element.get("end"))))
+	return curves, lips
+
+
+def compileTrack(curves, lips, table, rate=DEFAULT_RATE, tail=DEFAULT_TAIL, curveChannels=CURVE_CHANNELS):
+	# returns [(time, joints)] sampled at rate, joints in robot units from the joint table
+	if "open" not in curves and lips:
+		curves = dict(curves)
+		curves["open"] = lipsCurve(lips)
+
+	# (snapshot index, curve, kind) for every channel the table reads that a curve drives
+	sources = []
+	for name, curve in curves.items():
+		targets = curveChannels.get(name)
+		if targets is None:
+			targets = [(name, None, "value")]
+		for channel, component, kind in targets:
+			if (channel, component) in table.channels:
+				sources.append((table.channels.index((channel, component)), curve, kind))
+
+	duration = max([curve.end() for curve in curves.values()] + [end for viseme, start, end in lips] + [0.0])
+	count = int(math.ceil((duration + tail) * rate)) + 1
+	neutral = [0.0] * len(table.channels)
+	track = []
+	for i in range(count):
+		t = i / rate
+		values = list(neutral)
+		for index, curve, kind in sources:
+			value = curve.evaluate(t)
+			if kind == "degrees":
+				value = math.sin(math.radians(value) / 2)
+			values[index] = value
+		track.append((t, table.transform(tuple(values))))
+	return track
+
+
+def writeTrack(track, path, keyframeInterval=delta.DEFAULT_KEYFRAME_INTERVAL, envelope=None):
+	# deltas with periodic keyframes after the safety envelope, what the live controller would
+	# have sent without filter stages
+	if envelope is None:
+		envelope = safety.SafetyEnvelope()
+	if os.path.exists(path):
+		os.remove(path)
+	recorder = recording.Recorder(path, flushEvery=1000)
+	deltaFilter = delta.DeltaFilter(keyframeInterval=keyframeInterval)
+	seq = 0
+	for t, joints in track:
+		if envelope.screen(joints):
+			joints = envelope.limit(joints, t)
+		else:
+			joints = envelope.hold()
+		changed, flags = deltaFilter.update(joints)
+		if changed:
+			recorder.write(protocol.JointFrame(seq, t, changed, flags), t)
+			seq += 1
+	recorder.close()
+	return seq
+
+
+def compileFile(bmlPath, trackPath, table, rate=DEFAULT_RATE, envelope=None):
+	curves, lips = readBml(bmlPath)
+	if envelope is None:
+		envelope = safety.SafetyEnvelope(defaultStep=1.0 / rate, names=table.names)
+	return writeTrack(compileTrack(curves, lips, table, rate), trackPath, envelope=envelope)
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options] <sounds directory | file.bml ...>")
+	parser.add_option("--out", default=None, help="directory for the .rjr tracks, default next to each .bml")
+	parser.add_option("--rate", type="float", default=DEFAULT_RATE, help="samples per second")
+	parser.add_option("--table", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "robotjoints.txt"))
+	parser.add_option("--force", action="store_true", default=False, help="rebuild tracks that are up to date")
+	parser.add_option("--range", default="%d,%d" % safety.DEFAULT_RANGE, help="servo range every joint is clamped to, min,max")
+	options, args = parser.parse_args()
+	if not args:
+		parser.error("expected a sounds directory or .bml files")
+
+	paths = []
+	for arg in args:
+		if os.path.isdir(arg):
+			paths.extend(os.path.join(arg, name) for name in sorted(os.listdir(arg)) if name.endswith(".bml"))
+		else:
+			paths.append(arg)
+
+	try:
+		low, high = [float(value) for value in options.range.split(",")]
+	except ValueError:
+		parser.error("--range takes min,max")
+	table = mapping.compileJointTable(mapping.loadJointTable(options.table))
+	built = 0
+	for bmlPath in paths:
+		directory = options.out or os.path.dirname(bmlPath)
+		trackPath = os.path.join(directory, os.path.splitext(os.path.basename(bmlPath))[0] + ".rjr")
+		if not options.force and os.path.exists(trackPath) and os.path.getmtime(trackPath) >= os.path.getmtime(bmlPath):
+			continue
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		envelope = safety.SafetyEnvelope(defaultRange=(low, high), defaultStep=1.0 / options.rate, names=table.names)
+		frames = compileFile(bmlPath, trackPath, table, options.rate, envelope)
+		print "%s: %d frames" % (trackPath, frames)
+		built += 1
+	print "%d of %d tracks rebuilt" % (built, len(paths))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,55 @@
+from robotbridge import protocol
+
+# Change detection for outgoing joints. Only joints that moved by at least their deadband since
+# the value last sent are passed on, and every keyframeInterval ticks a full keyframe goes out
+# so a robot that dropped packets gets back in sync.
+
+DEFAULT_DEADBAND = 1.0
+DEFAULT_KEYFRAME_INTERVAL = 30
+
+
+class DeltaFilter(object):
+
+	def __init__(self, deadbands=None, defaultDeadband=DEFAULT_DEADBAND, keyframeInterval=DEFAULT_KEYFRAME_INTERVAL):
+		# deadbands maps joint id -> minimum change in robot units before the joint is resent
+		self.deadbands = dict(deadbands or {})
+		self.defaultDeadband = defaultDeadband
+		self.keyframeInterval = keyframeInterval
+		self.lastSent = {}
+		self.ticksSinceKeyframe = None
+		self.ticks = 0
+		self.jointsIn = 0
+		self.jointsOut = 0
+		self.keyframes = 0
+
+	def reset(self):
+		# forces a keyframe on the next update, e.g. after the robot reconnects
+		self.lastSent.clear()
+		self.ticksSinceKeyframe = None
+
+	def update(self, joints):
+		# returns (joints to send, frame flags); the joint list is empty when nothing changed
+		self.ticks += 1
+		self.jointsIn += len(joints)
+		if self.ticksSinceKeyframe is None or self.ticksSinceKeyframe + 1 >= self.keyframeInterval:
+			self.ticksSinceKeyframe = 0
+			self.keyframes += 1
+			self.lastSent.update(joints)
+			self.jointsOut += len(joints)
+			return list(joints), protocol.FLAG_KEYFRAME
+
+		self.ticksSinceKeyframe += 1
+		changed = []
+		lastSent = self.lastSent
+		deadbands = self.deadbands
+		for joint, value in joints:
+			last = lastSent.get(joint)
+			if last is None or abs(value - last) >= deadbands.get(joint, self.defaultDeadband):
+				changed.append((joint, value))
+				lastSent[joint] = value
+		self.jointsOut += len(changed)
+		return changed, 0
+
+	def summary(self):
+		return "ticks: %d  keyframes: %d  joints in: %d  joints sent: %d" % (
+			self.ticks, self.keyframes, self.jointsIn, self.jointsOut)
@@ -0,0 +1,167 @@
+import errno
+import socket
+
+from robotbridge import acks, protocol, scheduler, transports
+
+# Sends each encoded frame once to every configured endpoint (robot heads, logging sinks, ...).
+# Every endpoint has its own non-blocking transport (UDP, TCP or Unix socket, see
+# transports.py), so a full send buffer, a refused connection or an ICMP "port unreachable"
+# only affects that endpoint. Once FAILURE_THRESHOLD of the last
+# HEALTH_WINDOW sends to an endpoint have failed it is marked down and skipped, then retried
+# with exponential backoff. A dead UDP endpoint only reports an error on every other send
+# (the ICMP reply arrives after the datagram that caused it), hence a window rather than
+# consecutive failures.
+#
+# With acks enabled each endpoint also tracks round trips: acks come back over the endpoint's
+# own transport and are picked up by pollAcks.
+
+HEALTH_WINDOW = 8
+FAILURE_THRESHOLD = 3
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+
+class Endpoint(object):
+
+	def __init__(self, transport, ackTracker=None):
+		self.transport = transport
+		self.ackTracker = ackTracker
+		self.sent = 0
+		self.failed = 0
+		self.skipped = 0
+		# frames offered while a stream transport was still connecting
+		self.connecting = 0
+		# one bit per recent send, set when it failed
+		self.history = 0
+		self.streak = 0
+		self.down = False
+		self.backoff = 0.0
+		self.retryAt = 0.0
+		self.lastError = None
+
+	def isUp(self):
+		return not self.down
+
+	def ready(self, now):
+		# down endpoints get a retry once their backoff has passed
+		if self.down and now >= self.retryAt:
+			self.down = False
+		return not self.down
+
+	def close(self):
+		self.transport.close()
+
+	def send(self, datagrams):
+		return self.transport.send(datagrams)
+
+	def succeeded(self):
+		self.sent += 1
+		self.history = (self.history << 1) & ((1 << HEALTH_WINDOW) - 1)
+		self.streak += 1
+		# a full window without failures forgets earlier backoff
+		if self.streak >= HEALTH_WINDOW:
+			self.backoff = 0.0
+
+	def failedWith(self, error, now):
+		self.failed += 1
+		self.lastError = error
+		self.streak = 0
+		self.history = ((self.history << 1) | 1) & ((1 << HEALTH_WINDOW) - 1)
+		if bin(self.history).count("1") >= FAILURE_THRESHOLD:
+			self.down = True
+			self.history = 0
+			if self.backoff:
+				self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+			else:
+				self.backoff = MIN_BACKOFF
+			self.retryAt = now + self.backoff
+			# start the retry with a fresh socket in case the old one holds a stale error
+			self.close()
+
+	def receiveAcks(self, now):
+		# returns the round trip times of the acks waiting on the transport
+		rtts = []
+		for data in self.transport.receive():
+			try:
+				seq = protocol.decodeAck(data)
+			except protocol.FrameError:
+				continue
+			rtt = self.ackTracker.received(seq, now)
+			if rtt is not None:
+				rtts.append(rtt)
+		self.ackTracker.expire(now)
+		return rtts
+
+	def health(self):
+		return {
+			"up": self.isUp(),
+			"sent": self.sent,
+			"failed": self.failed,
+			"skipped": self.skipped,
+			"connecting": self.connecting,
+			"backoff": self.backoff,
+			"lastError": self.lastError,
+		}
+
+
+class FanoutSender(object):
+
+	def __init__(self, addresses, clock=scheduler.clock, trackAcks=False, ackWindow=acks.DEFAULT_WINDOW, ackTimeout=acks.DEFAULT_TIMEOUT):
+		self.trackAcks = trackAcks
+		self.endpoints = []
+		for address in addresses:
+			tracker = None
+			if trackAcks:
+				tracker = acks.AckTracker(ackWindow, ackTimeout)
+			self.endpoints.append(Endpoint(transports.makeTransport(address), tracker))
+		self.clock = clock
+
+	def send(self, datagrams, seq=None):
+		# returns the number of endpoints the frame reached. seq is recorded for ack tracking
+		now = self.clock()
+		delivered = 0
+		for endpoint in self.endpoints:
+			if not endpoint.ready(now):
+				endpoint.skipped += 1
+				continue
+			try:
+				if not endpoint.send(datagrams):
+					endpoint.connecting += 1
+					continue
+			except socket.error, e:
+				endpoint.failedWith(errno.errorcode.get(e.errno, str(e)), now)
+				continue
+			endpoint.succeeded()
+			if seq is not None and endpoint.ackTracker is not None:
+				endpoint.ackTracker.sent(seq, now)
+			delivered += 1
+		return delivered
+
+	def pollAcks(self):
+		# returns every round trip time measured since the last poll
+		if not self.trackAcks:
+			return []
+		now = self.clock()
+		rtts = []
+		for endpoint in self.endpoints:
+			try:
+				rtts.extend(endpoint.receiveAcks(now))
+			except socket.error, e:
+				endpoint.failedWith(errno.errorcode.get(e.errno, str(e)), now)
+		return rtts
+
+	def ackStats(self):
+		# flat dict for telemetry: "<endpoint index>.rtt50" etc.
+		stats = {}
+		for index, endpoint in enumerate(self.endpoints):
+			if endpoint.ackTracker is not None:
+				for key, value in endpoint.ackTracker.stats().items():
+					stats["%d.%s" % (index, key)] = value
+		return stats
+
+	def close(self):
+		for endpoint in self.endpoints:
+			endpoint.close()
+
+	def health(self):
+		return dict((endpoint.transport.name, endpoint.health()) for endpoint in self.endpoints)
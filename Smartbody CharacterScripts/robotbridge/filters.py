@@ -0,0 +1,146 @@
+import math
+
+# Per-joint motion filtering between the joint table and the robot. Lip-sync visemes step the
+# channels from one frame to the next faster than the servos can follow, so each configured
+# joint can be smoothed (one-euro or critically damped filter) and then limited in velocity and
+# acceleration. Everything is in robot units and seconds, constant work per joint per tick.
+#
+# joint config, all keys optional:
+#   maxVelocity      - units per second
+#   maxAcceleration  - units per second squared
+#   filter           - "oneeuro" or "damped"
+#   minCutoff, beta, derivativeCutoff - one-euro parameters (Hz, -, Hz)
+#   frequency        - natural frequency of the critically damped filter (rad/s)
+
+# time step used when the simulation clock doesn't move (paused) or jumps
+MAX_STEP = 0.25
+
+
+def _alpha(cutoff, dt):
+	tau = 1.0 / (2 * math.pi * cutoff)
+	return 1.0 / (1.0 + tau / dt)
+
+
+class OneEuroFilter(object):
+	# Casiez et al., "1 Euro Filter": low pass whose cutoff rises with speed, so slow motion is
+	# smoothed heavily while fast motion keeps little lag
+
+	def __init__(self, minCutoff=1.0, beta=0.0, derivativeCutoff=1.0):
+		self.minCutoff = minCutoff
+		self.beta = beta
+		self.derivativeCutoff = derivativeCutoff
+		self.value = None
+		self.derivative = 0.0
+
+	def reset(self, value):
+		self.value = value
+		self.derivative = 0.0
+
+	def update(self, value, dt):
+		if self.value is None:
+			self.reset(value)
+			return value
+		a = _alpha(self.derivativeCutoff, dt)
+		self.derivative += a * ((value - self.value) / dt - self.derivative)
+		a = _alpha(self.minCutoff + self.beta * abs(self.derivative), dt)
+		self.value += a * (value - self.value)
+		return self.value
+
+
+class CriticallyDampedFilter(object):
+	# spring towards the target with critical damping, stepped with the exact solution so it
+	# stays stable at any tick rate
+
+	def __init__(self, frequency=30.0):
+		self.frequency = frequency
+		self.value = None
+		self.velocity = 0.0
+
+	def reset(self, value):
+		self.value = value
+		self.velocity = 0.0
+
+	def update(self, target, dt):
+		if self.value is None:
+			self.reset(target)
+			return target
+		omega = self.frequency
+		offset = self.value - target
+		temp = (self.velocity + omega * offset) * dt
+		decay = math.exp(-omega * dt)
+		self.velocity = (self.velocity - omega * temp) * decay
+		self.value = target + (offset + temp) * decay
+		return self.value
+
+
+FILTERS = {
+	"oneeuro": lambda config: OneEuroFilter(config.get("minCutoff", 1.0), config.get("beta", 0.0), config.get("derivativeCutoff", 1.0)),
+	"damped": lambda config: CriticallyDampedFilter(config.get("frequency", 30.0)),
+}
+
+
+class JointMotion(object):
+	__slots__ = ("filter", "maxVelocity", "maxAcceleration", "position", "velocity")
+
+	def __init__(self, config):
+		kind = config.get("filter")
+		self.filter = None
+		if kind is not None:
+			if kind not in FILTERS:
+				raise ValueError("unknown joint filter %r, expected one of %s" % (kind, ", ".join(sorted(FILTERS))))
+			self.filter = FILTERS[kind](config)
+		self.maxVelocity = config.get("maxVelocity")
+		self.maxAcceleration = config.get("maxAcceleration")
+		self.position = None
+		self.velocity = 0.0
+
+	def update(self, target, dt):
+		if self.filter is not None:
+			target = self.filter.update(target, dt)
+		if self.position is None:
+			self.position = target
+			return target
+
+		velocity = (target - self.position) / dt
+		if self.maxAcceleration is not None:
+			change = self.maxAcceleration * dt
+			velocity = max(self.velocity - change, min(self.velocity + change, velocity))
+		if self.maxVelocity is not None:
+			velocity = max(-self.maxVelocity, min(self.maxVelocity, velocity))
+		self.velocity = velocity
+		self.position += velocity * dt
+		return self.position
+
+
+class MotionFilter(object):
+	# sender stage: smooths and rate limits the configured joints, others pass through untouched
+
+	def __init__(self, jointConfigs, defaultStep=1.0 / 30):
+		self.joints = dict((joint, JointMotion(config)) for joint, config in jointConfigs.items())
+		self.defaultStep = defaultStep
+		self.lastTime = None
+
+	def reset(self):
+		for motion in self.joints.values():
+			motion.position = None
+			motion.velocity = 0.0
+			if motion.filter is not None:
+				motion.filter.value = None
+		self.lastTime = None
+
+	def process(self, joints, simTime):
+		dt = self.defaultStep
+		if self.lastTime is not None and 0 < simTime - self.lastTime <= MAX_STEP:
+			dt = simTime - self.lastTime
+		self.lastTime = simTime
+		if not self.joints:
+			return joints
+
+		motions = self.joints
+		result = []
+		for joint, value in joints:
+			motion = motions.get(joint)
+			if motion is not None:
+				value = motion.update(value, dt)
+			result.append((joint, value))
+		return result
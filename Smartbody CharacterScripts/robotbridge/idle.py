@@ -0,0 +1,178 @@
+import math
+import random
+
+# Procedural idle motion so the robot doesn't freeze between utterances: blinks, small eye
+# saccades and a slow breathing-like neck sway. Everything is generated once into looping
+# tables (one sample per sender tick); per tick the stage only looks up the current sample and
+# adds it to the live joints, so the cost is a few dict lookups and additions.
+#
+# Blinks combine with the live eyelid by taking the larger value, so SmartBody's own blinks
+# still come through. Saccades and sway are offsets that fade out while SmartBody moves the
+# same joints itself (gaze, head nods) and fade back in after `quiet` seconds of stillness.
+#
+# config keys, all optional:
+#   blinkJoint, blinkAmount, blinkInterval (min, max seconds between blinks)
+#   panJoint, tiltJoint, saccadeAmount (pan, tilt), saccadeInterval (min, max seconds of fixation)
+#   sway       - {joint: amount}, negative amounts sway one way only, for joints resting
+#                against a stop (the neck tilt motors sit at 255)
+#   swayPeriod - seconds per breath
+#   loop, quiet, seed
+
+DEFAULT_CONFIG = {
+	"blinkJoint": 2,
+	"blinkAmount": 127.0,
+	"blinkInterval": (2.0, 6.0),
+	"panJoint": 3,
+	"tiltJoint": 4,
+	"saccadeAmount": (4.0, 6.0),
+	"saccadeInterval": (0.4, 1.8),
+	"sway": {7: -10.0, 8: -10.0, 9: 6.0},
+	"swayPeriod": 4.0,
+	# seconds before the tables repeat
+	"loop": 20.0,
+	# seconds of stillness before saccades and sway come back
+	"quiet": 1.0,
+	"seed": 2013,
+}
+
+# seconds to fade a group in or out
+FADE_TIME = 0.5
+# change per tick (robot units) in a live joint that counts as SmartBody moving it
+ACTIVITY_THRESHOLD = 2.0
+# blink shape: seconds closing and opening
+BLINK_CLOSE = 0.08
+BLINK_OPEN = 0.16
+# seconds a saccade takes to land
+SACCADE_TIME = 0.04
+
+BLINK, GAZE, HEAD = range(3)
+
+
+def blinkTable(samples, rate, amount, interval, rng):
+	table = [0.0] * samples
+	t = rng.uniform(*interval) / 2
+	loop = samples / float(rate)
+	# leave room for the last blink to open again before the loop wraps
+	while t + BLINK_CLOSE + BLINK_OPEN < loop:
+		for i in range(int(t * rate), int(math.ceil((t + BLINK_CLOSE + BLINK_OPEN) * rate)) + 1):
+			since = i / float(rate) - t
+			if since < 0:
+				continue
+			if since < BLINK_CLOSE:
+				value = since / BLINK_CLOSE
+			else:
+				value = max(0.0, 1.0 - (since - BLINK_CLOSE) / BLINK_OPEN)
+			table[i % samples] = max(table[i % samples], amount * value)
+		t += rng.uniform(*interval)
+	return table
+
+
+def saccadeTables(samples, rate, amounts, interval, rng):
+	# fixations held for a random time with quick moves in between; the loop starts and ends
+	# looking straight ahead so it wraps without a jump
+	pan = [0.0] * samples
+	tilt = [0.0] * samples
+	fixations = [(0.0, 0.0, 0.0)]
+	t = rng.uniform(*interval)
+	loop = samples / float(rate)
+	while t + interval[0] < loop:
+		fixations.append((t, rng.uniform(-1, 1) * amounts[0], rng.uniform(-1, 1) * amounts[1]))
+		t += rng.uniform(*interval)
+	fixations.append((loop - interval[0] / 2, 0.0, 0.0))
+	current = 0
+	for i in range(samples):
+		now = i / float(rate)
+		while current + 1 < len(fixations) and fixations[current + 1][0] <= now:
+			current += 1
+		start, toPan, toTilt = fixations[current]
+		fromPan, fromTilt = fixations[max(0, current - 1)][1:]
+		blend = min(1.0, (now - start) / SACCADE_TIME)
+		pan[i] = fromPan + (toPan - fromPan) * blend
+		tilt[i] = fromTilt + (toTilt - fromTilt) * blend
+	return pan, tilt
+
+
+def swayTable(samples, amount, cycles, rng):
+	# two harmonics with whole numbers of cycles per loop so the table wraps seamlessly
+	phase = rng.uniform(0, 2 * math.pi)
+	slow = max(1, int(round(cycles / 3.0)))
+	values = []
+	for i in range(samples):
+		a = 2 * math.pi * i / samples
+		values.append(.8 * math.sin(cycles * a + phase) + .2 * math.sin(slow * a + 2 * phase))
+	if amount < 0:
+		return [-amount * (v - 1) / 2 for v in values]
+	return [amount * v for v in values]
+
+
+class IdleMotion(object):
+	# sender stage adding the idle tables to the live joints
+
+	def __init__(self, config=None, rate=30.0):
+		settings = dict(DEFAULT_CONFIG)
+		settings.update(config or {})
+		self.rate = rate
+		self.samples = int(round(settings["loop"] * rate))
+		self.quiet = settings["quiet"]
+		rng = random.Random(settings["seed"])
+
+		# joint -> (group, table)
+		self.tables = {}
+		if settings["blinkJoint"] is not None:
+			self.tables[settings["blinkJoint"]] = (BLINK, blinkTable(self.samples, rate, settings["blinkAmount"],
+				settings["blinkInterval"], rng))
+		pan, tilt = saccadeTables(self.samples, rate, settings["saccadeAmount"], settings["saccadeInterval"], rng)
+		if settings["panJoint"] is not None:
+			self.tables[settings["panJoint"]] = (GAZE, pan)
+		if settings["tiltJoint"] is not None:
+			self.tables[settings["tiltJoint"]] = (GAZE, tilt)
+		cycles = max(1, int(round(settings["loop"] / settings["swayPeriod"])))
+		for joint, amount in sorted(settings["sway"].items()):
+			self.tables[joint] = (HEAD, swayTable(self.samples, amount, cycles, rng))
+
+		# saccade and sway weights fade in from the start; blinks are never faded
+		self.weights = [1.0, 0.0, 0.0]
+		self.lastActive = [None, None, None]
+		self.previous = {}
+		self.lastTime = None
+
+	def process(self, joints, simTime):
+		if not self.samples:
+			return joints
+		index = int(simTime * self.rate) % self.samples
+		tables = self.tables
+		previous = self.previous
+		weights = self.weights
+		active = [False, False, False]
+		result = []
+		for joint, value in joints:
+			entry = tables.get(joint)
+			if entry is None:
+				result.append((joint, value))
+				continue
+			group, table = entry
+			last = previous.get(joint)
+			if last is not None and abs(value - last) >= ACTIVITY_THRESHOLD:
+				active[group] = True
+			previous[joint] = value
+			if group == BLINK:
+				result.append((joint, max(value, table[index])))
+			else:
+				result.append((joint, value + table[index] * weights[group]))
+		self.fade(active, simTime)
+		return result
+
+	def fade(self, active, simTime):
+		dt = 1.0 / self.rate
+		if self.lastTime is not None and 0 < simTime - self.lastTime <= FADE_TIME:
+			dt = simTime - self.lastTime
+		self.lastTime = simTime
+		step = dt / FADE_TIME
+		for group in (GAZE, HEAD):
+			if active[group]:
+				self.lastActive[group] = simTime
+			last = self.lastActive[group]
+			if last is not None and (simTime < last or simTime - last < self.quiet):
+				self.weights[group] = max(0.0, self.weights[group] - step)
+			else:
+				self.weights[group] = min(1.0, self.weights[group] + step)
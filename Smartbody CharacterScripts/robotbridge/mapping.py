@@ -0,0 +1,152 @@
+import math
+
+# Declarative channel -> robot joint mapping. Each row of a joint table reads one SmartBody
+# channel (or the average of several), then
+#
+#   value = clamp((input + offset) * scale + bias, min, max)
+#
+# When several rows drive the same joint, the row with the largest input wins (the mouth
+# follows whichever of au_26 and open is further open). The table is loaded once and compiled
+# into a single generated function, so the per-tick cost doesn't grow with interpretation of
+# the table, only with the arithmetic itself.
+#
+# table file format, one row per line, whitespace separated, '#' starts a comment, '-' for none:
+#   joint  name  channel[+channel...]  component  offset  scale  bias  min  max
+
+# inputs are rounded up to 1/RESOLUTION like the original controller did; 0 turns that off
+DEFAULT_RESOLUTION = 100
+
+
+class TableError(Exception):
+	pass
+
+
+class JointMapping(object):
+	__slots__ = ("joint", "name", "channels", "component", "offset", "scale", "bias", "low", "high")
+
+	def __init__(self, joint, name, channels, component=None, offset=0.0, scale=1.0, bias=0.0, low=None, high=None):
+		self.joint = joint
+		self.name = name
+		self.channels = tuple(channels)
+		# quaternion component to read, None for scalar channels
+		self.component = component
+		self.offset = offset
+		self.scale = scale
+		self.bias = bias
+		self.low = low
+		self.high = high
+
+
+class CompiledTable(object):
+
+	def __init__(self, mappings, channels, transform, source):
+		self.mappings = mappings
+		# (channel, component) pairs in snapshot order
+		self.channels = channels
+		# snapshot values -> [(joint id, value), ...] sorted by joint id
+		self.transform = transform
+		self.source = source
+		self.names = dict((m.joint, m.name) for m in mappings)
+		self.joints = sorted(self.names)
+
+
+def _optionalFloat(text):
+	if text == "-":
+		return None
+	return float(text)
+
+
+def parseJointTable(lines, source="<joint table>"):
+	mappings = []
+	for number, line in enumerate(lines):
+		line = line.split("#", 1)[0].strip()
+		if not line:
+			continue
+		fields = line.split()
+		if len(fields) != 9:
+			raise TableError("%s:%d: expected 9 columns, got %d" % (source, number + 1, len(fields)))
+		try:
+			component = None
+			if fields[3] != "-":
+				component = int(fields[3])
+			mappings.append(JointMapping(int(fields[0]), fields[1], fields[2].split("+"), component,
+				float(fields[4]), float(fields[5]), float(fields[6]), _optionalFloat(fields[7]), _optionalFloat(fields[8])))
+		except ValueError, e:
+			raise TableError("%s:%d: %s" % (source, number + 1, e))
+	if not mappings:
+		raise TableError("%s: no joints defined" % source)
+	return mappings
+
+
+def loadJointTable(path):
+	with open(path) as f:
+		return parseJointTable(f, path)
+
+
+def compileJointTable(mappings, resolution=DEFAULT_RESOLUTION):
+	channels = []
+	for m in mappings:
+		for channel in m.channels:
+			if (channel, m.component) not in channels:
+				channels.append((channel, m.component))
+
+	lines = ["def transform(v):"]
+	inputs = []
+	names = {}
+	for m in mappings:
+		terms = ["v[%d]" % channels.index((channel, m.component)) for channel in m.channels]
+		expr = terms[0]
+		if len(terms) > 1:
+			expr = "((%s) / %d)" % (" + ".join(terms), len(terms))
+		if resolution:
+			expr = "ceil(%s * %r) / %r" % (expr, float(resolution), float(resolution))
+		# rows reading the same input share one local
+		if expr not in names:
+			names[expr] = "i%d" % len(names)
+			lines.append("\t%s = %s" % (names[expr], expr))
+		inputs.append(names[expr])
+
+	outputs = []
+	for joint in sorted(set(m.joint for m in mappings)):
+		rows = [index for index, m in enumerate(mappings) if m.joint == joint]
+		expr = None
+		for position, index in enumerate(rows):
+			m = mappings[index]
+			value = inputs[index]
+			if m.offset:
+				value = "(%s + %r)" % (value, m.offset)
+			if m.scale != 1:
+				value = "%s * %r" % (value, m.scale)
+			if m.bias:
+				value = "%s + %r" % (value, m.bias)
+			if m.low is not None:
+				value = "max(%s, %r)" % (value, m.low)
+			if m.high is not None:
+				value = "min(%s, %r)" % (value, m.high)
+			if expr is None:
+				expr = value
+			else:
+				earlier = [inputs[i] for i in rows[:position]]
+				largest = earlier[0] if len(earlier) == 1 else "max(%s)" % ", ".join(earlier)
+				expr = "(%s if %s > %s else %s)" % (value, inputs[index], largest, expr)
+		outputs.append("(%d, %s)" % (joint, expr))
+	lines.append("\treturn [%s]" % ", ".join(outputs))
+
+	source = "\n".join(lines) + "\n"
+	namespace = {"ceil": math.ceil}
+	exec compile(source, "<joint table>", "exec") in namespace
+	return CompiledTable(mappings, channels, namespace["transform"], source)
+
+
+def snapshotChannels(controller, channels):
+	values = []
+	quats = {}
+	for name, component in channels:
+		if component is None:
+			values.append(controller.getChannelValue(name))
+		else:
+			quat = quats.get(name)
+			if quat is None:
+				quat = quats[name] = controller.getChannelQuat(name)
+			values.append(quat.getData(component))
+	return tuple(values)
@@ -0,0 +1,59 @@
+import collections
+
+# Lip-sync latency compensation. By the time a joint value has gone through the sender queue,
+# the network and the servo, the audio has moved on. LeadPredictor extrapolates the recent
+# history of selected joints forward by a fixed lead so the motor lands on the value the
+# character will have when the command actually takes effect.
+#
+# SmartBody only exposes the current channel values to a controller, so the lead comes from a
+# least squares line through the last few samples rather than from the BML viseme schedule.
+
+DEFAULT_WINDOW = 4
+
+
+class LeadPredictor(object):
+
+	def __init__(self, lead, joints, window=DEFAULT_WINDOW, maxChange=None):
+		# lead in seconds, joints to predict, maxChange caps how far (robot units) a prediction
+		# may move away from the latest value so a step doesn't shoot past the servo range
+		self.lead = lead
+		self.window = window
+		self.maxChange = maxChange
+		self.history = dict((joint, collections.deque(maxlen=window)) for joint in joints)
+
+	def reset(self):
+		for samples in self.history.values():
+			samples.clear()
+
+	def predict(self, samples):
+		n = len(samples)
+		latestTime, latest = samples[-1]
+		if n < 2:
+			return latest
+		meanTime = sum(t for t, v in samples) / n
+		meanValue = sum(v for t, v in samples) / n
+		spread = sum((t - meanTime) ** 2 for t, v in samples)
+		if spread <= 0:
+			return latest
+		slope = sum((t - meanTime) * (v - meanValue) for t, v in samples) / spread
+		change = slope * self.lead
+		if self.maxChange is not None:
+			change = max(-self.maxChange, min(self.maxChange, change))
+		return latest + change
+
+	def process(self, joints, simTime):
+		history = self.history
+		result = []
+		for joint, value in joints:
+			samples = history.get(joint)
+			if samples is not None:
+				if samples and simTime <= samples[-1][0]:
+					if simTime == samples[-1][0]:
+						samples.pop()
+					else:
+						# the clock went backwards, the scene was reset
+						samples.clear()
+				samples.append((simTime, value))
+				value = self.predict(samples)
+			result.append((joint, value))
+		return result
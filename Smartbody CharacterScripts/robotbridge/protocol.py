@@ -0,0 +1,123 @@
+import struct
+import zlib
+
+# A joint frame carries every joint value for one controller tick in a single datagram.
+#
+# binary layout (little endian):
+#   header  - magic "RJ", version, flags, sequence number, simulation time, joint count
+#   joints  - joint count * (joint id, value)
+#   trailer - crc32 of header + joints
+#
+# Frames flagged FLAG_ACK_REQUEST are answered with an ack datagram: magic "RA", version,
+# the frame's sequence number.
+#
+# The old "set_joint:N:V" text messages are still available for robot firmware that
+# does not understand frames, one datagram per joint.
+
+FRAME_MAGIC = "RJ"
+FRAME_VERSION = 1
+ACK_MAGIC = "RA"
+
+HEADER = struct.Struct("<2sBBIdB")
+JOINT = struct.Struct("<Bh")
+TRAILER = struct.Struct("<I")
+ACK = struct.Struct("<2sBI")
+
+MAX_JOINTS = 255
+SEQ_MASK = 0xffffffff
+
+# frame flags
+FLAG_KEYFRAME = 0x01	# frame carries every joint, not just the ones that changed
+FLAG_ACK_REQUEST = 0x02	# receiver should echo the sequence number back in an ack
+
+
+class FrameError(Exception):
+	pass
+
+
+class JointFrame(object):
+	__slots__ = ("seq", "time", "joints", "flags")
+
+	def __init__(self, seq, time, joints, flags=0):
+		self.seq = seq & SEQ_MASK
+		self.time = time
+		# list of (joint id, value) pairs
+		self.joints = joints
+		self.flags = flags
+
+	def __repr__(self):
+		return "JointFrame(seq=%d, time=%.3f, flags=%d, joints=%r)" % (self.seq, self.time, self.flags, self.joints)
+
+	def isKeyframe(self):
+		return bool(self.flags & FLAG_KEYFRAME)
+
+
+def encodeBinary(frame):
+	if len(frame.joints) > MAX_JOINTS:
+		raise FrameError("too many joints in frame: %d" % len(frame.joints))
+	parts = [HEADER.pack(FRAME_MAGIC, FRAME_VERSION, frame.flags, frame.seq, frame.time, len(frame.joints))]
+	for joint, value in frame.joints:
+		parts.append(JOINT.pack(joint, int(round(value))))
+	body = "".join(parts)
+	return body + TRAILER.pack(zlib.crc32(body) & 0xffffffff)
+
+
+def decodeBinary(data):
+	if len(data) < HEADER.size + TRAILER.size:
+		raise FrameError("short frame: %d bytes" % len(data))
+	magic, version, flags, seq, time, count = HEADER.unpack_from(data, 0)
+	if magic != FRAME_MAGIC:
+		raise FrameError("bad magic %r" % magic)
+	if version != FRAME_VERSION:
+		raise FrameError("unsupported frame version %d" % version)
+	expected = HEADER.size + count * JOINT.size + TRAILER.size
+	if len(data) != expected:
+		raise FrameError("frame %d is %d bytes, expected %d for %d joints" % (seq, len(data), expected, count))
+	body = data[:-TRAILER.size]
+	(crc,) = TRAILER.unpack_from(data, len(body))
+	if crc != zlib.crc32(body) & 0xffffffff:
+		raise FrameError("frame %d failed its checksum" % seq)
+	joints = []
+	offset = HEADER.size
+	for i in range(count):
+		joints.append(JOINT.unpack_from(data, offset))
+		offset += JOINT.size
+	return JointFrame(seq, time, joints, flags)
+
+
+def encodeAck(seq):
+	return ACK.pack(ACK_MAGIC, FRAME_VERSION, seq & SEQ_MASK)
+
+
+def decodeAck(data):
+	if len(data) != ACK.size:
+		raise FrameError("ack is %d bytes, expected %d" % (len(data), ACK.size))
+	magic, version, seq = ACK.unpack(data)
+	if magic != ACK_MAGIC or version != FRAME_VERSION:
+		raise FrameError("not an ack: %r" % data)
+	return seq
+
+
+def encodeText(frame):
+	return ["set_joint:%d:%d" % (joint, round(value)) for joint, value in frame.joints]
+
+
+def decodeText(message):
+	name, joint, value = message.split(":")
+	if name != "set_joint":
+		raise FrameError("not a set_joint message: %r" % message)
+	return int(joint), int(value)
+
+
+# frame modes understood by RobotController; each encoder returns the list of datagrams to send
+ENCODERS = {
+	"binary": lambda frame: [encodeBinary(frame)],
+	"text": encodeText,
+}
+
+
+def getEncoder(mode):
+	try:
+		return ENCODERS[mode]
+	except KeyError:
+		raise FrameError("unknown frame mode %r, expected one of %s" % (mode, ", ".join(sorted(ENCODERS))))
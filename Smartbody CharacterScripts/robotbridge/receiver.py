@@ -0,0 +1,165 @@
+# Local stand-in for the robot: listens on a UDP port (or TCP / Unix socket, see
+# transports.py) and checks that every joint frame arrives whole. Run it next to SmartBody and
+# add this machine to RobotController's ROBOT_ENDPOINTS:
+#
+#   python -m robotbridge.receiver --port 2013
+#   python -m robotbridge.receiver --port 2013 --mode text
+#   python -m robotbridge.receiver --transport tcp --port 2013
+#   python -m robotbridge.receiver --transport unix --path /tmp/robot.sock
+#
+# With --ack it behaves like a robot that acknowledges frames, optionally over a simulated bad
+# link (latency, jitter, loss) so RobotController's ROBOT_ACKS can be tried on one machine:
+#
+#   python -m robotbridge.receiver --port 2013 --ack --delay 0.02 --jitter 0.01 --loss 0.05
+
+import heapq
+import optparse
+import random
+import socket
+import time
+
+from robotbridge import protocol, transports
+
+
+class FrameReceiver(object):
+
+	def __init__(self, host="127.0.0.1", port=2013, mode="binary", expectedJoints=None, ack=False, delay=0.0, jitter=0.0, loss=0.0,
+			transport="udp", path=None):
+		self.mode = mode
+		self.expectedJoints = expectedJoints
+		# simulated robot: acknowledge frames that ask for it after delay +- jitter seconds,
+		# losing a `loss` fraction of frames on the way in
+		self.ack = ack
+		self.delay = delay
+		self.jitter = jitter
+		self.loss = loss
+		self.random = random.Random()
+		self.pendingAcks = []
+		self.acksSent = 0
+		self.simulatedLoss = 0
+		# path is the socket file for the unix transport
+		self.listener = transports.makeListener(transport, path or (host, port))
+		self.address = self.listener.address
+		self.frames = 0
+		self.keyframes = 0
+		self.messages = 0
+		self.corrupt = 0
+		self.incomplete = 0
+		self.outOfOrder = 0
+		self.missing = 0
+		self.lastSeq = None
+		# latest value received for each joint, keyframes and delta frames both update it
+		self.pose = {}
+
+	def close(self):
+		self.listener.close()
+
+	def receive(self, timeout=None):
+		self.sendDueAcks()
+		if self.pendingAcks:
+			wait = max(0.0, self.pendingAcks[0][0] - time.time())
+			if timeout is None or wait < timeout:
+				timeout = wait
+		message = self.listener.read(timeout)
+		if message is None:
+			self.sendDueAcks()
+			return None
+		data, sender = message
+		if self.loss and self.random.random() < self.loss:
+			self.simulatedLoss += 1
+			return None
+		frame = self.check(data)
+		if self.ack and isinstance(frame, protocol.JointFrame) and frame.flags & protocol.FLAG_ACK_REQUEST:
+			due = time.time() + max(0.0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+			heapq.heappush(self.pendingAcks, (due, frame.seq, sender))
+		return frame
+
+	def sendDueAcks(self):
+		now = time.time()
+		while self.pendingAcks and self.pendingAcks[0][0] <= now:
+			due, seq, sender = heapq.heappop(self.pendingAcks)
+			try:
+				self.listener.reply(sender, protocol.encodeAck(seq))
+				self.acksSent += 1
+			except socket.error:
+				pass
+
+	def check(self, data):
+		if self.mode == "text":
+			self.messages += 1
+			try:
+				joint, value = protocol.decodeText(data)
+			except (protocol.FrameError, ValueError):
+				self.corrupt += 1
+				return None
+			self.pose[joint] = value
+			return joint, value
+
+		try:
+			frame = protocol.decodeBinary(data)
+		except protocol.FrameError:
+			self.corrupt += 1
+			return None
+		self.frames += 1
+		if frame.isKeyframe():
+			self.keyframes += 1
+			if self.expectedJoints is not None and len(frame.joints) != self.expectedJoints:
+				self.incomplete += 1
+		if self.lastSeq is not None:
+			gap = (frame.seq - self.lastSeq) & protocol.SEQ_MASK
+			if gap == 0 or gap > protocol.SEQ_MASK / 2:
+				# a late delta frame would overwrite newer values, so leave the pose alone
+				self.outOfOrder += 1
+				return frame
+			self.missing += gap - 1
+		self.lastSeq = frame.seq
+		self.pose.update(frame.joints)
+		return frame
+
+	def summary(self):
+		if self.mode == "text":
+			return "messages: %d  corrupt: %d" % (self.messages, self.corrupt)
+		summary = "frames: %d  keyframes: %d  corrupt: %d  incomplete: %d  missing: %d  out of order: %d" % (
+			self.frames, self.keyframes, self.corrupt, self.incomplete, self.missing, self.outOfOrder)
+		if self.ack:
+			summary += "  acks: %d  simulated loss: %d" % (self.acksSent, self.simulatedLoss)
+		return summary
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--host", default="0.0.0.0")
+	parser.add_option("--port", type="int", default=2013)
+	parser.add_option("--transport", default="udp", choices=sorted(transports.TRANSPORTS))
+	parser.add_option("--path", default=None, help="socket file for --transport unix")
+	parser.add_option("--mode", default="binary", choices=sorted(protocol.ENCODERS))
+	parser.add_option("--joints", type="int", default=None, help="number of joints every keyframe must carry")
+	parser.add_option("--ack", action="store_true", default=False, help="acknowledge frames that request it")
+	parser.add_option("--delay", type="float", default=0.0, help="seconds before each ack is sent")
+	parser.add_option("--jitter", type="float", default=0.0, help="random +- seconds added to the ack delay")
+	parser.add_option("--loss", type="float", default=0.0, help="fraction of incoming frames to drop")
+	parser.add_option("--verbose", action="store_true", default=False)
+	options, args = parser.parse_args()
+	if options.transport == "unix" and not options.path:
+		parser.error("--transport unix needs --path")
+
+	receiver = FrameReceiver(options.host, options.port, options.mode, options.joints,
+		options.ack, options.delay, options.jitter, options.loss, options.transport, options.path)
+	print "listening on %s (%s)" % (receiver.listener.name, options.mode)
+	lastReport = time.time()
+	try:
+		while True:
+			result = receiver.receive(1.0)
+			if options.verbose and result is not None:
+				print result
+			if time.time() - lastReport >= 5.0:
+				print receiver.summary()
+				lastReport = time.time()
+	except KeyboardInterrupt:
+		pass
+	print receiver.summary()
+	receiver.close()
+
+
+if __name__ == "__main__":
+	main()
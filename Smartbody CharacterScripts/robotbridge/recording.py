@@ -0,0 +1,118 @@
+import mmap
+import os
+import struct
+import time
+
+from robotbridge import protocol
+
+# Append-only recording of the joint frames sent to the robot.
+#
+# file layout (little endian):
+#   header  - magic "RJRC", version, flags, wall clock time the recording started
+#   records - seconds since the start, simulation time, frame length, binary joint frame
+#
+# Records are only ever appended, so a recording can be extended across sessions and read
+# while it is being written; a record cut short by a crash is ignored by the reader. Readers
+# memory-map the file instead of loading it.
+
+RECORDING_MAGIC = "RJRC"
+RECORDING_VERSION = 1
+
+FILE_HEADER = struct.Struct("<4sHHd")
+RECORD = struct.Struct("<ddH")
+
+DEFAULT_FLUSH_EVERY = 30
+
+
+class RecordingError(Exception):
+	pass
+
+
+class Recorder(object):
+
+	def __init__(self, path, flushEvery=DEFAULT_FLUSH_EVERY, clock=time.time):
+		self.path = path
+		self.flushEvery = flushEvery
+		self.clock = clock
+		# check the size before opening, tell() on a fresh append-mode file is 0 on Windows
+		empty = not os.path.exists(path) or os.path.getsize(path) == 0
+		self.file = open(path, "ab")
+		self.records = 0
+		self.pending = 0
+		if empty:
+			self.start = clock()
+			self.file.write(FILE_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, 0, self.start))
+			self.file.flush()
+		else:
+			self.start = readHeader(path)
+
+	def write(self, frame, wallOffset=None):
+		# wallOffset defaults to the time since the recording started
+		if wallOffset is None:
+			wallOffset = self.clock() - self.start
+		data = protocol.encodeBinary(frame)
+		self.file.write(RECORD.pack(wallOffset, frame.time, len(data)) + data)
+		self.records += 1
+		self.pending += 1
+		if self.pending >= self.flushEvery:
+			self.flush()
+
+	def flush(self):
+		self.file.flush()
+		self.pending = 0
+
+	def close(self):
+		if not self.file.closed:
+			self.file.close()
+
+
+def readHeader(path):
+	with open(path, "rb") as f:
+		data = f.read(FILE_HEADER.size)
+	if len(data) < FILE_HEADER.size:
+		raise RecordingError("%s: too short to be a recording" % path)
+	magic, version, flags, start = FILE_HEADER.unpack(data)
+	if magic != RECORDING_MAGIC:
+		raise RecordingError("%s: not a joint recording" % path)
+	if version != RECORDING_VERSION:
+		raise RecordingError("%s: unsupported recording version %d" % (path, version))
+	return start
+
+
+class RecordingReader(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.start = readHeader(path)
+		self.file = open(path, "rb")
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+	def records(self):
+		# yields (seconds since start, simulation time, encoded frame)
+		data = self.map
+		size = len(data)
+		offset = FILE_HEADER.size
+		while offset + RECORD.size <= size:
+			wallOffset, simTime, length = RECORD.unpack_from(data, offset)
+			offset += RECORD.size
+			if offset + length > size:
+				break
+			yield wallOffset, simTime, data[offset:offset + length]
+			offset += length
+
+	def frames(self):
+		# yields (seconds since start, JointFrame)
+		for wallOffset, simTime, data in self.records():
+			yield wallOffset, protocol.decodeBinary(data)
+
+	def __iter__(self):
+		return self.frames()
+
+
+def recordingPath(directory, prefix="robot"):
+	# one file per session, e.g. robot_20121109_153323.rjr
+	return os.path.join(directory, "%s_%s.rjr" % (prefix, time.strftime("%Y%m%d_%H%M%S")))
@@ -0,0 +1,100 @@
+# Streams a joint recording to the robot without SmartBody running, to reproduce motor issues
+# or load-test the robot firmware. Run from the CharacterScripts directory:
+#
+#   python -m robotbridge.replay robot_20121109_153323.rjr --host 192.168.11.2 --port 2013
+#   python -m robotbridge.replay robot.rjr --speed 4 --loop
+#   python -m robotbridge.replay robot.rjr --speed 0        (as fast as possible)
+#   python -m robotbridge.replay robot.rjr --endpoint tcp://192.168.11.2:2013
+
+import optparse
+import time
+
+from robotbridge import fanout, protocol, recording, scheduler
+
+
+class Replayer(object):
+
+	def __init__(self, reader, fanoutSender, encode, speed=1.0, renumber=True, clock=scheduler.clock, sleep=time.sleep):
+		self.reader = reader
+		self.fanout = fanoutSender
+		self.encode = encode
+		# 1.0 plays at recorded speed, 0 sends as fast as possible
+		self.speed = speed
+		# give frames fresh sequence numbers so looping doesn't look like reordering
+		self.renumber = renumber
+		self.clock = clock
+		self.sleep = sleep
+		self.seq = 0
+		self.frames = 0
+		self.dropped = 0
+		self.maxLate = 0.0
+
+	def play(self):
+		# plays the recording once; counters cover this pass only
+		self.frames = 0
+		self.dropped = 0
+		self.maxLate = 0.0
+		started = self.clock()
+		first = None
+		for wallOffset, frame in self.reader.frames():
+			if first is None:
+				first = wallOffset
+			if self.speed > 0:
+				due = started + (wallOffset - first) / self.speed
+				wait = due - self.clock()
+				if wait > 0:
+					self.sleep(wait)
+				else:
+					self.maxLate = max(self.maxLate, -wait)
+			if self.renumber:
+				frame.seq = self.seq & protocol.SEQ_MASK
+			self.seq += 1
+			if self.fanout.send(self.encode(frame)):
+				self.frames += 1
+			else:
+				self.dropped += 1
+		return self.clock() - started
+
+	def summary(self, elapsed):
+		rate = 0.0
+		if elapsed > 0:
+			rate = self.frames / elapsed
+		return "frames: %d  dropped: %d  elapsed: %.2f s  rate: %.1f frames/s  max late: %.1f ms" % (
+			self.frames, self.dropped, elapsed, rate, self.maxLate * 1000)
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options] recording.rjr")
+	parser.add_option("--host", action="append", default=None, help="robot address, may be given more than once")
+	parser.add_option("--port", type="int", default=2013)
+	parser.add_option("--endpoint", action="append", default=[],
+		help="endpoint spec as in ROBOT_ENDPOINTS (tcp://host:port, unix:path, ...), may be given more than once")
+	parser.add_option("--speed", type="float", default=1.0, help="playback speed, 0 for as fast as possible")
+	parser.add_option("--mode", default="binary", choices=sorted(protocol.ENCODERS))
+	parser.add_option("--loop", action="store_true", default=False)
+	parser.add_option("--keep-seq", dest="renumber", action="store_false", default=True,
+		help="send the recorded sequence numbers instead of renumbering")
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("expected one recording file")
+
+	endpoints = [(host, options.port) for host in options.host or []] + options.endpoint
+	if not endpoints:
+		endpoints = [("127.0.0.1", options.port)]
+	reader = recording.RecordingReader(args[0])
+	sender = fanout.FanoutSender(endpoints)
+	replayer = Replayer(reader, sender, protocol.getEncoder(options.mode), options.speed, options.renumber)
+	try:
+		while True:
+			elapsed = replayer.play()
+			print replayer.summary(elapsed)
+			if not options.loop:
+				break
+	except KeyboardInterrupt:
+		pass
+	sender.close()
+	reader.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,153 @@
+import operator
+
+# Last line of defence before the servos. The joint table's own min/max columns are part of the
+# conversion; the envelope enforces the servo limits on whatever finally goes out, after lead
+# prediction and filtering:
+#
+#   screen - before the sender stages: if any converted joint is NaN/infinite or further than
+#            faultMargin outside its range, the input is rejected and the robot holds the last
+#            safe pose until recoverTicks good ticks in a row have passed. Rejected input never
+#            reaches the filters, so their state isn't poisoned
+#   limit  - after the stages: clamp to [min, max], limit the change per tick to maxRate, and
+#            round to whole robot units (the old "%d" truncated)
+#
+# Both run as a handful of map() calls over the joint vector; the per-joint loops only run to
+# count violations on ticks that have any.
+#
+# joint config, all keys optional: min, max (robot units), maxRate (units per second)
+
+DEFAULT_RANGE = (0, 255)
+# wide enough that no channel inside its normal range (action units 0..1, quaternion components
+# -1..1) trips it with the stock joint table, whose steep scales saturate well past 0..255
+DEFAULT_FAULT_MARGIN = 2560.0
+DEFAULT_RECOVER_TICKS = 5
+
+# time step used when the simulation clock doesn't move (paused) or jumps
+MAX_STEP = 0.25
+
+INFINITY = float("inf")
+
+
+class SafetyEnvelope(object):
+
+	def __init__(self, jointConfigs=None, defaultRange=DEFAULT_RANGE, faultMargin=DEFAULT_FAULT_MARGIN,
+			recoverTicks=DEFAULT_RECOVER_TICKS, defaultStep=1.0 / 30, names=None):
+		self.jointConfigs = dict(jointConfigs or {})
+		self.defaultRange = defaultRange
+		self.faultMargin = faultMargin
+		self.recoverTicks = recoverTicks
+		self.defaultStep = defaultStep
+		self.names = dict(names or {})
+		# per joint vectors, built for the joint ids of the first tick
+		self.ids = None
+		self.lows = self.highs = self.faultLows = self.faultHighs = self.rates = None
+		self.safe = None
+		self.lastTime = None
+		self.holding = False
+		self.goodTicks = 0
+		self.holds = 0
+		self.heldTicks = 0
+		# joint id -> count
+		self.clamped = {}
+		self.rateLimited = {}
+		self.faults = {}
+
+	def prepare(self, ids):
+		self.ids = ids
+		self.lows = []
+		self.highs = []
+		self.rates = []
+		for joint in ids:
+			config = self.jointConfigs.get(joint, {})
+			self.lows.append(float(config.get("min", self.defaultRange[0])))
+			self.highs.append(float(config.get("max", self.defaultRange[1])))
+			self.rates.append(float(config.get("maxRate", INFINITY)))
+		self.faultLows = [low - self.faultMargin for low in self.lows]
+		self.faultHighs = [high + self.faultMargin for high in self.highs]
+		self.clamped = dict.fromkeys(ids, 0)
+		self.rateLimited = dict.fromkeys(ids, 0)
+		self.faults = dict.fromkeys(ids, 0)
+		self.safe = None
+
+	def screen(self, joints):
+		# returns True when the joints may go on to the stages, False to hold the safe pose
+		ids, values = zip(*joints) if joints else ((), ())
+		if ids != self.ids:
+			self.prepare(ids)
+		total = sum(values)
+		bad = (total - total != 0
+			or any(map(operator.lt, values, self.faultLows))
+			or any(map(operator.gt, values, self.faultHighs)))
+		if bad:
+			for joint, value, low, high in zip(ids, values, self.faultLows, self.faultHighs):
+				# NaN fails both comparisons
+				if not low <= value <= high:
+					self.faults[joint] += 1
+			if not self.holding:
+				self.holding = True
+				self.holds += 1
+			self.goodTicks = 0
+		elif self.holding:
+			self.goodTicks += 1
+			if self.goodTicks >= self.recoverTicks:
+				self.holding = False
+		if self.holding:
+			self.heldTicks += 1
+		return not self.holding
+
+	def hold(self):
+		# the last pose sent, or nothing before the first safe tick
+		if self.safe is None:
+			return []
+		return zip(self.ids, [int(round(value)) for value in self.safe])
+
+	def limit(self, joints, simTime):
+		dt = self.defaultStep
+		if self.lastTime is not None and 0 < simTime - self.lastTime <= MAX_STEP:
+			dt = simTime - self.lastTime
+		self.lastTime = simTime
+		ids, values = zip(*joints) if joints else ((), ())
+		if ids != self.ids:
+			self.prepare(ids)
+		values = list(values)
+
+		clamped = map(min, self.highs, map(max, self.lows, values))
+		if clamped != values:
+			for joint, value, result in zip(ids, values, clamped):
+				if value != result:
+					self.clamped[joint] += 1
+
+		limited = clamped
+		if self.safe is not None:
+			steps = [rate * dt for rate in self.rates]
+			limited = map(min, map(operator.add, self.safe, steps), map(max, map(operator.sub, self.safe, steps), clamped))
+			if limited != clamped:
+				for joint, value, result in zip(ids, clamped, limited):
+					if value != result:
+						self.rateLimited[joint] += 1
+
+		self.safe = limited
+		return zip(ids, [int(round(value)) for value in limited])
+
+	def stats(self):
+		# flat totals for telemetry
+		return {
+			"holding": int(self.holding),
+			"holds": self.holds,
+			"clamped": sum(self.clamped.values()),
+			"rateLimited": sum(self.rateLimited.values()),
+			"faults": sum(self.faults.values()),
+		}
+
+	def report(self):
+		# one line per joint that ever left its envelope
+		lines = []
+		for joint in sorted(self.clamped):
+			counts = (self.clamped[joint], self.rateLimited[joint], self.faults[joint])
+			if any(counts):
+				lines.append("%-16s clamped: %d  rate limited: %d  faults: %d" % ((self.names.get(joint, joint),) + counts))
+		return "\n".join(lines)
+
+	def summary(self):
+		return "holds: %d  held ticks: %d  clamped: %d  rate limited: %d  faults: %d" % (
+			self.holds, self.heldTicks, sum(self.clamped.values()), sum(self.rateLimited.values()), sum(self.faults.values()))
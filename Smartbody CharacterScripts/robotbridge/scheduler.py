@@ -0,0 +1,95 @@
+import sys
+import time
+
+from robotbridge.stats import RunningStats
+
+# Fixed-rate tick scheduler for the robot output. Ticks are placed on a fixed grid
+# (start + n * period) instead of "period after the last tick", so sleep overshoot doesn't
+# accumulate into drift. If the sender falls more than a whole period behind, the missed grid
+# slots are skipped and counted rather than sent in a burst.
+
+# time.time only has ~15 ms resolution on Windows, time.clock is the high resolution timer there
+if sys.platform == "win32":
+	clock = time.clock
+else:
+	clock = time.time
+
+
+class FixedRateScheduler(object):
+
+	def __init__(self, hz, clock=clock):
+		if hz <= 0:
+			raise ValueError("scheduler rate must be positive, got %r" % hz)
+		self.hz = float(hz)
+		self.period = 1.0 / self.hz
+		self.clock = clock
+		self.start = None
+		self.tick = 0
+		self.resetStats()
+
+	def resetStats(self):
+		self.ticks = 0
+		self.missed = 0
+		self.statsStart = None
+		self.lastTick = None
+		self.intervals = RunningStats()
+		self.maxLate = 0.0
+
+	def nextDeadline(self):
+		if self.start is None:
+			self.start = self.clock()
+			self.tick = 0
+		return self.start + self.tick * self.period
+
+	def wait(self, stopEvent=None):
+		# sleeps until the next grid tick; returns False if stopEvent was set while waiting
+		deadline = self.nextDeadline()
+		remaining = deadline - self.clock()
+		if remaining > 0:
+			if stopEvent is not None:
+				if stopEvent.wait(remaining):
+					return False
+			else:
+				time.sleep(remaining)
+		now = self.clock()
+		self.record(now, now - deadline)
+
+		self.tick += 1
+		behind = int((now - self.start) / self.period) + 1 - self.tick
+		if behind > 0:
+			self.tick += behind
+			self.missed += behind
+		return True
+
+	def record(self, now, late):
+		self.ticks += 1
+		if self.statsStart is None:
+			self.statsStart = now
+		if self.lastTick is not None:
+			self.intervals.add(now - self.lastTick)
+		self.lastTick = now
+		if late > self.maxLate:
+			self.maxLate = late
+
+	def achievedRate(self):
+		if self.ticks < 2:
+			return 0.0
+		return (self.ticks - 1) / (self.lastTick - self.statsStart)
+
+	def jitter(self):
+		# standard deviation of the tick interval, in seconds
+		return self.intervals.stddev()
+
+	def stats(self):
+		return {
+			"target": self.hz,
+			"rate": self.achievedRate(),
+			"jitter": self.jitter(),
+			"maxLate": self.maxLate,
+			"ticks": self.ticks,
+			"missed": self.missed,
+		}
+
+	def summary(self):
+		return "rate: %.2f Hz (target %.2f)  jitter: %.2f ms  max late: %.2f ms  ticks: %d  missed: %d" % (
+			self.achievedRate(), self.hz, self.jitter() * 1000, self.maxLate * 1000, self.ticks, self.missed)
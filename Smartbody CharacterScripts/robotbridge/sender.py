@@ -0,0 +1,153 @@
+import threading
+import traceback
+
+from robotbridge import protocol, scheduler, stats
+
+# Producer/consumer split between SmartBody and the network. MyController.evaluate only pushes
+# a snapshot of the raw channel values into a RingBuffer; a RobotSender thread picks up the
+# newest snapshot at its own rate, converts, encodes and transmits it, so a slow or dead
+# network never stalls SmartBody's controller evaluation.
+
+DEFAULT_CAPACITY = 8
+
+
+class RingBuffer(object):
+	# fixed-size buffer of snapshots. when the sender falls behind, the oldest unread snapshot
+	# is overwritten and counted rather than the producer blocking
+
+	def __init__(self, capacity=DEFAULT_CAPACITY):
+		self.capacity = capacity
+		self.slots = [None] * capacity
+		self.head = 0
+		self.count = 0
+		self.overwritten = 0
+		self.lock = threading.Lock()
+
+	def push(self, item):
+		with self.lock:
+			self.slots[(self.head + self.count) % self.capacity] = item
+			if self.count == self.capacity:
+				self.head = (self.head + 1) % self.capacity
+				self.overwritten += 1
+			else:
+				self.count += 1
+
+	def drain(self):
+		# returns every unread snapshot, oldest first
+		with self.lock:
+			items = []
+			for i in range(self.count):
+				index = (self.head + i) % self.capacity
+				items.append(self.slots[index])
+				self.slots[index] = None
+			self.head = 0
+			self.count = 0
+		return items
+
+
+class RobotSender(threading.Thread):
+
+	def __init__(self, fanout, convert, encode, hz, stages=(), deltaFilter=None, telemetry=None, capacity=DEFAULT_CAPACITY, recorder=None,
+			envelope=None):
+		threading.Thread.__init__(self, name="RobotSender")
+		self.daemon = True
+		# FanoutSender holding every endpoint frames go to
+		self.fanout = fanout
+		self.convert = convert
+		self.encode = encode
+		self.scheduler = scheduler.FixedRateScheduler(hz)
+		# objects with process(joints, simTime) -> joints, run in order on the converted joints
+		self.stages = list(stages)
+		self.deltaFilter = deltaFilter
+		# telemetry.Telemetry, published with the full joint list every tick
+		self.telemetry = telemetry
+		# recording.Recorder that gets every frame put on the wire
+		self.recorder = recorder
+		# safety.SafetyEnvelope screening the converted joints and limiting what goes out
+		self.envelope = envelope
+		self.ring = RingBuffer(capacity)
+		# "queue" is snapshot -> sender tick, "process" is sender tick -> frame on the wire,
+		# "network" is half the ack round trip when the fanout tracks acks
+		self.latency = stats.LatencyBudget()
+		self.stopped = threading.Event()
+		self.seq = 0
+		self.frames = 0
+		self.skipped = 0
+		self.dropped = 0
+		self.errors = 0
+		self.lastError = None
+
+	def submit(self, simTime, values):
+		# producer side, called from MyController.evaluate
+		self.ring.push((simTime, self.scheduler.clock(), values))
+
+	def stop(self, timeout=1.0):
+		self.stopped.set()
+		if self.is_alive():
+			self.join(timeout)
+		self.fanout.close()
+		if self.recorder is not None:
+			self.recorder.close()
+
+	def run(self):
+		while self.scheduler.wait(self.stopped):
+			self.tick()
+
+	def tick(self):
+		for rtt in self.fanout.pollAcks():
+			self.latency.record("network", rtt / 2)
+		snapshots = self.ring.drain()
+		if not snapshots:
+			return
+		# only the newest snapshot is worth sending
+		self.skipped += len(snapshots) - 1
+		simTime, snapshotTime, values = snapshots[-1]
+		clock = self.scheduler.clock
+		tickTime = clock()
+		self.latency.record("queue", tickTime - snapshotTime)
+		try:
+			joints = self.convert(values)
+			envelope = self.envelope
+			if envelope is not None and not envelope.screen(joints):
+				joints = envelope.hold()
+			else:
+				for stage in self.stages:
+					joints = stage.process(joints, simTime)
+				if envelope is not None:
+					joints = envelope.limit(joints, simTime)
+			changed = joints
+			flags = 0
+			if self.deltaFilter is not None:
+				changed, flags = self.deltaFilter.update(joints)
+			if changed:
+				self.transmit(protocol.JointFrame(self.seq, simTime, changed, flags))
+				self.latency.record("process", clock() - tickTime)
+			if self.telemetry is not None:
+				self.telemetry.publish(self.seq, simTime, joints)
+		except Exception:
+			# keep the thread alive whatever a single frame does
+			self.errors += 1
+			self.lastError = traceback.format_exc()
+
+	def transmit(self, frame):
+		self.seq += 1
+		if self.fanout.trackAcks:
+			frame.flags |= protocol.FLAG_ACK_REQUEST
+		# frames that reached no endpoint at all count as dropped
+		if self.fanout.send(self.encode(frame), frame.seq):
+			self.frames += 1
+		else:
+			self.dropped += 1
+		if self.recorder is not None:
+			self.recorder.write(frame)
+
+	def counters(self):
+		counters = {
+			"frames": self.frames,
+			"skipped": self.skipped,
+			"overwritten": self.ring.overwritten,
+			"dropped": self.dropped,
+			"errors": self.errors,
+		}
+		counters.update(self.scheduler.stats())
+		return counters
@@ -0,0 +1,94 @@
+import math
+
+
+class RunningStats(object):
+	# mean / standard deviation / min / max in constant memory (Welford's algorithm)
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.count = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+		self.min = None
+		self.max = None
+
+	def add(self, value):
+		self.count += 1
+		delta = value - self.mean
+		self.mean += delta / self.count
+		self.m2 += delta * (value - self.mean)
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+
+	def stddev(self):
+		if self.count < 2:
+			return 0.0
+		return math.sqrt(self.m2 / (self.count - 1))
+
+
+class LatencyBudget(object):
+	# end to end latency of the robot output, broken down by stage. stages are recorded in
+	# seconds; fixed stages (servo lag, lip-sync lead) are configured rather than measured, a
+	# negative fixed stage (the lead) is time won back
+
+	def __init__(self):
+		self.stages = []
+		self.measured = {}
+		self.fixed = {}
+
+	def _addStage(self, name):
+		if name not in self.stages:
+			self.stages.append(name)
+
+	def record(self, name, seconds):
+		stats = self.measured.get(name)
+		if stats is None:
+			self._addStage(name)
+			stats = self.measured[name] = RunningStats()
+		stats.add(seconds)
+
+	def setFixed(self, name, seconds):
+		self._addStage(name)
+		self.fixed[name] = seconds
+
+	def reset(self):
+		for stats in self.measured.values():
+			stats.reset()
+
+	def stage(self, name):
+		# mean seconds for a stage
+		if name in self.fixed:
+			return self.fixed[name]
+		stats = self.measured.get(name)
+		if stats is None or not stats.count:
+			return 0.0
+		return stats.mean
+
+	def total(self):
+		return sum(self.stage(name) for name in self.stages)
+
+	def report(self):
+		report = {}
+		for name in self.stages:
+			if name in self.fixed:
+				report[name] = {"fixed": self.fixed[name]}
+			else:
+				stats = self.measured[name]
+				report[name] = {"mean": stats.mean, "max": stats.max, "count": stats.count}
+		report["total"] = self.total()
+		return report
+
+	def summary(self):
+		parts = []
+		for name in self.stages:
+			if name in self.fixed:
+				parts.append("%s: %+.1f ms" % (name, self.fixed[name] * 1000))
+			else:
+				stats = self.measured[name]
+				parts.append("%s: %.1f ms (max %.1f)" % (name, stats.mean * 1000, (stats.max or 0.0) * 1000))
+		parts.append("total: %.1f ms" % (self.total() * 1000))
+		return "  ".join(parts)
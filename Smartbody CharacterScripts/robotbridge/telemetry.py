@@ -0,0 +1,112 @@
+import base64
+
+from robotbridge import protocol, scheduler
+
+# Telemetry about what the sender puts on the wire, throttled and only formatted for listeners
+# that asked for it. The sender publishes every tick; records go out at most `hz` times a
+# second and each subscriber additionally takes only every n-th record (its decimation). With
+# no subscribers publish returns before formatting anything.
+#
+# formats:
+#   "kv"     - "seq=12 t=3.210 eyebrow=25 ... mouth=131"
+#   "binary" - base64 of a binary joint frame (see protocol.py), for message buses that
+#              only carry text
+
+DEFAULT_RATE = 10.0
+
+
+def formatKeyValue(seq, simTime, joints, names, extra):
+	parts = ["seq=%d" % seq, "t=%.3f" % simTime]
+	for joint, value in joints:
+		parts.append("%s=%d" % (names.get(joint, joint), value))
+	for key, value in extra:
+		if isinstance(value, float):
+			parts.append("%s=%.4g" % (key, value))
+		else:
+			parts.append("%s=%s" % (key, value))
+	return " ".join(parts)
+
+
+def formatBinary(seq, simTime, joints, names, extra):
+	return base64.b64encode(protocol.encodeBinary(protocol.JointFrame(seq, simTime, joints, protocol.FLAG_KEYFRAME)))
+
+
+FORMATS = {
+	"kv": formatKeyValue,
+	"binary": formatBinary,
+}
+
+
+class Subscriber(object):
+	__slots__ = ("name", "sink", "decimation", "format", "countdown", "sent")
+
+	def __init__(self, name, sink, decimation, format):
+		self.name = name
+		# called with the formatted record
+		self.sink = sink
+		self.decimation = max(1, int(decimation))
+		self.format = format
+		self.countdown = 0
+		self.sent = 0
+
+
+class Telemetry(object):
+
+	def __init__(self, names=None, hz=DEFAULT_RATE, clock=scheduler.clock):
+		self.names = dict(names or {})
+		self.interval = 0.0
+		if hz:
+			self.interval = 1.0 / hz
+		self.clock = clock
+		self.subscribers = {}
+		# name -> callable returning a dict of extra values for the "kv" format
+		self.sources = {}
+		self.nextPublish = 0.0
+		self.published = 0
+		self.throttled = 0
+
+	def subscribe(self, name, sink, decimation=1, format="kv"):
+		if format not in FORMATS:
+			raise ValueError("unknown telemetry format %r, expected one of %s" % (format, ", ".join(sorted(FORMATS))))
+		# a second subscriber under the same name would silently replace the first
+		if name in self.subscribers:
+			raise ValueError("telemetry subscriber %r already exists, unsubscribe it first" % name)
+		self.subscribers[name] = Subscriber(name, sink, decimation, format)
+
+	def unsubscribe(self, name):
+		self.subscribers.pop(name, None)
+
+	def addSource(self, name, source):
+		self.sources[name] = source
+
+	def publish(self, seq, simTime, joints):
+		if not self.subscribers:
+			return
+		now = self.clock()
+		if now < self.nextPublish:
+			self.throttled += 1
+			return
+		self.nextPublish = now + self.interval
+		self.published += 1
+
+		formatted = {}
+		extra = None
+		for subscriber in self.subscribers.values():
+			if subscriber.countdown > 0:
+				subscriber.countdown -= 1
+				continue
+			subscriber.countdown = subscriber.decimation - 1
+			record = formatted.get(subscriber.format)
+			if record is None:
+				if extra is None:
+					extra = self.extraValues()
+				record = formatted[subscriber.format] = FORMATS[subscriber.format](seq, simTime, joints, self.names, extra)
+			subscriber.sink(record)
+			subscriber.sent += 1
+
+	def extraValues(self):
+		extra = []
+		for name in sorted(self.sources):
+			for key, value in sorted(self.sources[name]().items()):
+				extra.append(("%s.%s" % (name, key), value))
+		return extra
@@ -0,0 +1,133 @@
+# Throughput and latency of the robot transports against a local sink, to help pick between
+# UDP, TCP and a Unix socket for a robot head. Run from the CharacterScripts directory:
+#
+#   python -m robotbridge.transportbench
+#   python -m robotbridge.transportbench --transport tcp --frames 50000 --pings 2000
+#
+# For every transport a FrameReceiver runs on a thread as the sink.
+#   throughput - keyframes sent as fast as the transport takes them, counted at the sink
+#   latency    - one frame at a time with FLAG_ACK_REQUEST, waiting for its ack, so the round
+#                trip covers both socket hops and the sink decoding the frame
+
+import optparse
+import os
+import tempfile
+import threading
+import time
+
+from robotbridge import fanout, protocol, receiver, scheduler, transports
+
+clock = scheduler.clock
+
+# how long the sink may go without new frames before the rest count as lost
+SETTLE_TIME = 0.25
+
+
+def runSink(sink, stopEvent):
+	while not stopEvent.is_set():
+		sink.receive(0.05)
+
+
+def endpointFor(kind, sink):
+	if kind == "unix":
+		return "unix:%s" % sink.address
+	return "%s://%s:%d" % (kind, sink.address[0], sink.address[1])
+
+
+def waitForSink(sender, sink, target, timeout):
+	# returns once the sink has seen target frames or stopped making progress
+	count = sink.frames
+	progressAt = clock()
+	deadline = progressAt + timeout
+	while sink.frames < target and clock() < deadline:
+		# an empty send flushes whatever a stream transport still has queued
+		sender.send([])
+		time.sleep(0.001)
+		if sink.frames != count:
+			count = sink.frames
+			progressAt = clock()
+		elif clock() - progressAt > SETTLE_TIME:
+			break
+
+
+def benchmark(kind, frames=20000, pings=1000, joints=10, timeout=5.0):
+	path = None
+	if kind == "unix":
+		path = os.path.join(tempfile.gettempdir(), "robotbridge_bench_%d.sock" % os.getpid())
+	sink = receiver.FrameReceiver("127.0.0.1", 0, expectedJoints=joints, ack=True, transport=kind, path=path)
+	stopEvent = threading.Event()
+	thread = threading.Thread(target=runSink, args=(sink, stopEvent))
+	thread.daemon = True
+	thread.start()
+	sender = fanout.FanoutSender([endpointFor(kind, sink)], trackAcks=True, ackWindow=max(pings, 1), ackTimeout=timeout)
+	encode = protocol.getEncoder("binary")
+	values = [(joint, 100 + joint) for joint in range(joints)]
+	result = {"transport": kind}
+	try:
+		# first frame also waits out the connect on stream transports
+		deadline = clock() + timeout
+		while not sender.send(encode(protocol.JointFrame(0, 0.0, values, protocol.FLAG_KEYFRAME))):
+			if clock() > deadline:
+				raise RuntimeError("%s: could not reach the sink" % kind)
+			time.sleep(0.001)
+		waitForSink(sender, sink, 1, timeout)
+
+		base = sink.frames
+		sent = 0
+		started = clock()
+		for seq in range(1, frames + 1):
+			if sender.send(encode(protocol.JointFrame(seq, seq / 30.0, values, protocol.FLAG_KEYFRAME))):
+				sent += 1
+		sendTime = clock() - started
+		waitForSink(sender, sink, base + sent, timeout)
+		received = sink.frames - base
+		elapsed = clock() - started
+		result["sendRate"] = sent / max(sendTime, 1e-9)
+		result["receiveRate"] = received / max(elapsed, 1e-9)
+		result["refused"] = frames - sent
+		result["lost"] = sent - received
+
+		flags = protocol.FLAG_KEYFRAME | protocol.FLAG_ACK_REQUEST
+		for i in range(pings):
+			seq = frames + 1 + i
+			sender.send(encode(protocol.JointFrame(seq, 0.0, values, flags)), seq)
+			deadline = clock() + timeout
+			while not sender.pollAcks() and clock() < deadline:
+				# let the sink thread run
+				time.sleep(0)
+		tracker = sender.endpoints[0].ackTracker
+		tracker.expire(clock() + timeout)
+		result.update(tracker.stats())
+		result["corrupt"] = sink.corrupt
+	finally:
+		stopEvent.set()
+		thread.join()
+		sender.close()
+		sink.close()
+	return result
+
+
+def formatResult(result):
+	return "%-5s %10.0f %10.0f %8d %8d %8.3f %8.3f %8.3f %6d" % (
+		result["transport"], result["sendRate"], result["receiveRate"], result["refused"], result["lost"],
+		result["rtt50"] * 1000, result["rtt90"] * 1000, result["rtt99"] * 1000, result["acked"])
+
+
+def main():
+	available = [kind for kind in ("udp", "tcp", "unix") if kind != "unix" or transports.UnixTransport.family is not None]
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--transport", action="append", default=None, choices=sorted(transports.TRANSPORTS),
+		help="transport to measure, may be given more than once, default all available")
+	parser.add_option("--frames", type="int", default=20000, help="frames for the throughput run")
+	parser.add_option("--pings", type="int", default=1000, help="acknowledged frames for the latency run")
+	parser.add_option("--joints", type="int", default=10)
+	options, args = parser.parse_args()
+
+	print "%-5s %10s %10s %8s %8s %8s %8s %8s %6s" % (
+		"", "sent/s", "recv/s", "refused", "lost", "rtt50 ms", "rtt90 ms", "rtt99 ms", "acked")
+	for kind in options.transport or available:
+		print formatResult(benchmark(kind, options.frames, options.pings, options.joints))
+
+
+if __name__ == "__main__":
+	main()
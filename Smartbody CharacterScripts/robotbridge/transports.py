@@ -0,0 +1,347 @@
+import errno
+import os
+import select
+import socket
+import struct
+import time
+
+# Transports carry encoded frames to one endpoint. Every socket is non-blocking, so a slow or
+# dead robot never stalls the sender thread; connecting happens in the background and frames
+# offered before the connection is up are skipped rather than queued (the next keyframe brings
+# the robot up to date).
+#
+# Stream transports (TCP, Unix domain sockets) have no datagram boundaries, so every message is
+# prefixed with its length. Nagle is turned off on TCP so a small frame goes out immediately
+# instead of waiting to be merged with the next one. A stream that errors, closes, or backs up
+# beyond MAX_PENDING bytes is dropped and reconnected on a later send; the error is raised from
+# send or receive so it counts against the endpoint's health (fanout.py).
+#
+# endpoint specs:
+#   ("192.168.11.2", 2013)       - UDP, the original setup
+#   "udp://192.168.11.2:2013"
+#   "tcp://192.168.11.2:2013"
+#   "unix:/tmp/robot.sock"       - a driver process on the same machine (not on Windows)
+
+LENGTH = struct.Struct("<H")
+
+# bytes waiting to go out on a stream before it counts as stalled
+MAX_PENDING = 8192
+CONNECT_TIMEOUT = 2.0
+
+# connect_ex / send results that only mean "not yet" (10035 is WSAEWOULDBLOCK)
+WOULD_BLOCK = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, errno.EALREADY, 10035)
+# what a connected UDP socket gets back from an ICMP "port unreachable" (10054 is WSAECONNRESET)
+REFUSED = (errno.ECONNREFUSED, errno.ECONNRESET, 10054)
+
+
+def frameMessages(messages):
+	return "".join(LENGTH.pack(len(message)) + message for message in messages)
+
+
+def splitMessages(buffer):
+	# returns ([complete messages], leftover bytes)
+	messages = []
+	offset = 0
+	while offset + LENGTH.size <= len(buffer):
+		(length,) = LENGTH.unpack_from(buffer, offset)
+		if offset + LENGTH.size + length > len(buffer):
+			break
+		offset += LENGTH.size
+		messages.append(buffer[offset:offset + length])
+		offset += length
+	return messages, buffer[offset:]
+
+
+class UdpTransport(object):
+
+	def __init__(self, address):
+		self.address = address
+		self.name = "udp://%s:%d" % address
+		self.sock = None
+		# a refusal picked up by receive, raised from the next send so it counts as a failed send
+		self.refused = None
+
+	def open(self):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.setblocking(False)
+		sock.connect(self.address)
+		self.sock = sock
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+		self.refused = None
+
+	def send(self, messages):
+		# returns False while the transport can't take frames yet, UDP always can
+		if self.refused is not None:
+			error, self.refused = self.refused, None
+			raise error
+		if self.sock is None:
+			self.open()
+		for message in messages:
+			self.sock.send(message)
+		return True
+
+	def receive(self):
+		messages = []
+		if self.sock is None:
+			return messages
+		while True:
+			try:
+				messages.append(self.sock.recv(65535))
+			except socket.error, e:
+				if e.args[0] in WOULD_BLOCK:
+					break
+				if e.args[0] in REFUSED:
+					# reading the error clears it from the socket, keep it for the next send
+					self.refused = e
+					break
+				raise
+		return messages
+
+
+class StreamTransport(object):
+	family = None
+
+	def __init__(self, address):
+		self.address = address
+		self.sock = None
+		self.connecting = False
+		self.connectStarted = 0.0
+		self.outgoing = ""
+		self.incoming = ""
+		self.connects = 0
+
+	def createSocket(self):
+		return socket.socket(self.family, socket.SOCK_STREAM)
+
+	def open(self):
+		sock = self.createSocket()
+		sock.setblocking(False)
+		code = sock.connect_ex(self.address)
+		if code and code not in WOULD_BLOCK:
+			sock.close()
+			raise socket.error(code, os.strerror(code))
+		self.sock = sock
+		self.connecting = code != 0
+		self.connectStarted = time.time()
+		self.outgoing = ""
+		self.incoming = ""
+		self.connects += 1
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+		self.connecting = False
+
+	def finishConnect(self):
+		readable, writable, failed = select.select([], [self.sock], [self.sock], 0)
+		if writable or failed:
+			code = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+			if code:
+				self.close()
+				raise socket.error(code, os.strerror(code))
+			self.connecting = False
+			return True
+		if time.time() - self.connectStarted > CONNECT_TIMEOUT:
+			self.close()
+			raise socket.error(errno.ETIMEDOUT, "connect timed out")
+		return False
+
+	def send(self, messages):
+		if self.sock is None:
+			self.open()
+		if self.connecting and not self.finishConnect():
+			return False
+		self.outgoing += frameMessages(messages)
+		self.flush()
+		return True
+
+	def flush(self):
+		try:
+			while self.outgoing:
+				sent = self.sock.send(self.outgoing)
+				self.outgoing = self.outgoing[sent:]
+		except socket.error, e:
+			if e.errno not in WOULD_BLOCK:
+				self.close()
+				raise
+		if len(self.outgoing) > MAX_PENDING:
+			pending = len(self.outgoing)
+			self.close()
+			raise socket.error(errno.ENOBUFS, "stream stalled with %d bytes queued" % pending)
+
+	def receive(self):
+		if self.sock is None or self.connecting:
+			return []
+		while True:
+			try:
+				data = self.sock.recv(4096)
+			except socket.timeout:
+				break
+			except socket.error, e:
+				if e.args[0] in WOULD_BLOCK:
+					break
+				# reset, broken pipe, ...: reconnect on the next send, and count it as a failure
+				self.close()
+				raise
+			if not data:
+				# peer closed: the same, the robot is gone until it accepts again
+				self.close()
+				raise socket.error(errno.ECONNRESET, "connection closed by the peer")
+			self.incoming += data
+		messages, self.incoming = splitMessages(self.incoming)
+		return messages
+
+
+class TcpTransport(StreamTransport):
+	family = socket.AF_INET
+
+	def __init__(self, address):
+		StreamTransport.__init__(self, address)
+		self.name = "tcp://%s:%d" % address
+
+	def createSocket(self):
+		sock = StreamTransport.createSocket(self)
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		return sock
+
+
+class UnixTransport(StreamTransport):
+	family = getattr(socket, "AF_UNIX", None)
+
+	def __init__(self, path):
+		if self.family is None:
+			raise ValueError("unix domain sockets are not available on this platform")
+		StreamTransport.__init__(self, path)
+		self.name = "unix:%s" % path
+
+
+TRANSPORTS = {
+	"udp": UdpTransport,
+	"tcp": TcpTransport,
+	"unix": UnixTransport,
+}
+
+
+def parseEndpoint(spec):
+	# returns (transport name, address)
+	if isinstance(spec, tuple):
+		return "udp", spec
+	scheme, separator, rest = spec.partition(":")
+	if not separator or scheme not in TRANSPORTS:
+		raise ValueError("bad endpoint %r, expected (host, port), udp://host:port, tcp://host:port or unix:path" % (spec,))
+	if scheme == "unix":
+		return scheme, rest
+	host, separator, port = rest.lstrip("/").rpartition(":")
+	if not separator or not port.isdigit():
+		raise ValueError("bad endpoint %r, expected %s://host:port" % (spec, scheme))
+	return scheme, (host, int(port))
+
+
+def makeTransport(spec):
+	kind, address = parseEndpoint(spec)
+	return TRANSPORTS[kind](address)
+
+
+class UdpListener(object):
+	# receiving end of UdpTransport: read returns (message, reply address)
+
+	def __init__(self, address):
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.bind(address)
+		self.address = self.sock.getsockname()
+		self.name = "udp://%s:%d" % self.address
+
+	def read(self, timeout=None):
+		self.sock.settimeout(timeout)
+		try:
+			return self.sock.recvfrom(65535)
+		except socket.error:
+			# timeouts, and ICMP errors from replies sent to a sender that went away
+			return None
+
+	def reply(self, to, message):
+		self.sock.sendto(message, to)
+
+	def close(self):
+		self.sock.close()
+
+
+class StreamListener(object):
+	# receiving end of a stream transport. One sender at a time: a new connection (the sender
+	# reconnecting) replaces the current one
+
+	def __init__(self, kind, address):
+		self.kind = kind
+		family = TRANSPORTS[kind].family
+		if family is None:
+			raise ValueError("unix domain sockets are not available on this platform")
+		if kind == "unix" and os.path.exists(address):
+			os.remove(address)
+		self.sock = socket.socket(family, socket.SOCK_STREAM)
+		if kind == "tcp":
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(address)
+		self.sock.listen(1)
+		self.address = self.sock.getsockname()
+		if kind == "unix":
+			self.name = "unix:%s" % self.address
+		else:
+			self.name = "tcp://%s:%d" % self.address
+		self.conn = None
+		self.messages = []
+		self.incoming = ""
+		self.connections = 0
+
+	def read(self, timeout=None):
+		if not self.messages:
+			waitOn = [self.sock]
+			if self.conn is not None:
+				waitOn.append(self.conn)
+			readable = select.select(waitOn, [], [], timeout)[0]
+			if self.sock in readable:
+				self.dropConnection()
+				self.conn = self.sock.accept()[0]
+				if self.kind == "tcp":
+					self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				self.connections += 1
+			elif self.conn in readable:
+				try:
+					data = self.conn.recv(65536)
+				except socket.error:
+					data = ""
+				if data:
+					self.incoming += data
+					messages, self.incoming = splitMessages(self.incoming)
+					self.messages.extend(messages)
+				else:
+					self.dropConnection()
+		if self.messages:
+			return self.messages.pop(0), self.conn
+		return None
+
+	def reply(self, to, message):
+		if to is not None and to is self.conn:
+			to.sendall(frameMessages([message]))
+
+	def dropConnection(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn = None
+		self.incoming = ""
+
+	def close(self):
+		self.dropConnection()
+		self.sock.close()
+		if self.kind == "unix" and os.path.exists(self.address):
+			os.remove(self.address)
+
+
+def makeListener(kind, address):
+	if kind == "udp":
+		return UdpListener(address)
+	return StreamListener(kind, address)
@@ -0,0 +1,169 @@
+import os
+import sys
+import unittest
+
+# Motion filter tests driven by a recorded joint trace. data/lipsync.rjr is the E1-custom line
+# of tools/VisemeSchedulerFacefx/example.xml, converted with speechpipeline.bml and compiled to
+# joints with robotbridge.bmltrack: ten joints at 30 Hz, the mouth (joint 5) following lip-sync.
+#
+#   cd "Smartbody CharacterScripts"
+#   python -m unittest discover -s tests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from robotbridge import delta, filters, protocol, recording
+
+TRACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lipsync.rjr")
+RATE = 30.0
+MOUTH = 5
+# slack for float rounding when comparing against a limit
+EPSILON = 1e-6
+
+
+def loadTrace(path=TRACE, rate=RATE):
+	# [(time, [(joint, value)])] on a fixed tick grid: the recording only holds the joints that
+	# changed, so every tick carries the last value of each joint, as the live sender sees them
+	reader = recording.RecordingReader(path)
+	try:
+		frames = [frame for wallOffset, frame in reader.frames()]
+	finally:
+		reader.close()
+	state = {}
+	trace = []
+	index = 0
+	tick = 0
+	end = frames[-1].time
+	while tick / rate <= end + EPSILON:
+		now = tick / rate
+		while index < len(frames) and frames[index].time <= now + EPSILON:
+			state.update(frames[index].joints)
+			index += 1
+		trace.append((now, sorted(state.items())))
+		tick += 1
+	return trace
+
+
+def replay(motionFilter, trace):
+	return [(now, motionFilter.process(joints, now)) for now, joints in trace]
+
+
+def series(trace, joint):
+	return [dict(joints)[joint] for now, joints in trace]
+
+
+def velocities(values, rate=RATE):
+	return [(b - a) * rate for a, b in zip(values, values[1:])]
+
+
+class TraceTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.trace = loadTrace()
+
+	def testTraceIsLipSync(self):
+		# the limits below only mean something if the raw mouth moves faster than them
+		self.assertTrue(len(self.trace) > 200)
+		self.assertEqual(len(self.trace[0][1]), 10)
+		mouth = velocities(series(self.trace, MOUTH))
+		self.assertTrue(max(abs(v) for v in mouth) > 1500)
+
+	def testVelocityLimit(self):
+		motion = filters.MotionFilter({MOUTH: {"maxVelocity": 600}}, 1 / RATE)
+		for velocity in velocities(series(replay(motion, self.trace), MOUTH)):
+			self.assertTrue(abs(velocity) <= 600 + EPSILON, velocity)
+
+	def testAccelerationLimit(self):
+		motion = filters.MotionFilter({MOUTH: {"maxVelocity": 1500, "maxAcceleration": 20000}}, 1 / RATE)
+		speeds = velocities(series(replay(motion, self.trace), MOUTH))
+		for velocity in speeds:
+			self.assertTrue(abs(velocity) <= 1500 + EPSILON, velocity)
+		# the first tick starts from rest
+		for acceleration in velocities([0.0] + speeds):
+			self.assertTrue(abs(acceleration) <= 20000 + EPSILON, acceleration)
+
+	def testLimitsPerJoint(self):
+		configs = {MOUTH: {"maxVelocity": 800}, 2: {"maxVelocity": 300, "filter": "damped", "frequency": 40}}
+		output = replay(filters.MotionFilter(configs, 1 / RATE), self.trace)
+		for joint, config in configs.items():
+			for velocity in velocities(series(output, joint)):
+				self.assertTrue(abs(velocity) <= config["maxVelocity"] + EPSILON, (joint, velocity))
+
+	def testUnconfiguredJointsPassThrough(self):
+		output = replay(filters.MotionFilter({MOUTH: {"filter": "oneeuro", "maxVelocity": 600}}, 1 / RATE), self.trace)
+		for joint in (0, 2, 3, 9):
+			self.assertEqual(series(output, joint), series(self.trace, joint))
+
+	def testFiltersFollowTheTrace(self):
+		# smoothed, but never further from the trace than its own range
+		raw = series(self.trace, MOUTH)
+		for config in ({"filter": "oneeuro", "minCutoff": 2.0, "beta": 0.01}, {"filter": "damped", "frequency": 40}):
+			smoothed = series(replay(filters.MotionFilter({MOUTH: config}, 1 / RATE), self.trace), MOUTH)
+			self.assertTrue(min(raw) - EPSILON <= min(smoothed) and max(smoothed) <= max(raw) + EPSILON, config)
+			self.assertTrue(sum(abs(v) for v in velocities(smoothed)) < sum(abs(v) for v in velocities(raw)), config)
+
+	def stepResponse(self, config, seconds=2.0):
+		# plays the trace, then holds the mouth at a step target
+		motion = filters.MotionFilter({MOUTH: config}, 1 / RATE)
+		replay(motion, self.trace)
+		last = self.trace[-1][0]
+		start = series(self.trace, MOUTH)[-1]
+		target = 200.0 if start < 100 else 0.0
+		values = []
+		for tick in range(1, int(seconds * RATE) + 1):
+			joints = [(joint, target if joint == MOUTH else value) for joint, value in self.trace[-1][1]]
+			values.append(dict(motion.process(joints, last + tick / RATE))[MOUTH])
+		return start, target, values
+
+	def testStepConvergence(self):
+		for config in ({"maxVelocity": 600, "maxAcceleration": 20000}, {"filter": "damped", "frequency": 40, "maxVelocity": 1500},
+				{"filter": "oneeuro", "minCutoff": 1.0, "beta": 0.05, "maxVelocity": 1500}):
+			start, target, values = self.stepResponse(config)
+			self.assertTrue(abs(values[-1] - target) < 0.5, (config, values[-1]))
+
+	def testDampedStepDoesNotOvershoot(self):
+		start, target, values = self.stepResponse({"filter": "damped", "frequency": 40})
+		for value in values:
+			self.assertTrue(min(start, target) - EPSILON <= value <= max(start, target) + EPSILON, value)
+
+	def testPauseAndJumpUseDefaultStep(self):
+		# a paused clock or a jump must not divide by zero or let the joint leap
+		motion = filters.MotionFilter({MOUTH: {"maxVelocity": 600}}, 1 / RATE)
+		motion.process([(MOUTH, 0.0)], 10.0)
+		self.assertTrue(dict(motion.process([(MOUTH, 255.0)], 10.0))[MOUTH] <= 600 / RATE + EPSILON)
+		self.assertTrue(dict(motion.process([(MOUTH, 255.0)], 50.0))[MOUTH] <= 2 * 600 / RATE + EPSILON)
+
+
+class DeadbandTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.trace = loadTrace()
+
+	def sent(self, trace, deadbands, keyframeInterval=30):
+		# what the sender would put on the wire after the motion filter: (joints, flags) per tick
+		deltaFilter = delta.DeltaFilter(deadbands, keyframeInterval=keyframeInterval)
+		return [deltaFilter.update([(joint, int(round(value))) for joint, value in joints]) for now, joints in trace]
+
+	def testFilteredTraceRespectsDeadband(self):
+		output = replay(filters.MotionFilter({MOUTH: {"filter": "damped", "frequency": 40, "maxVelocity": 1500}}, 1 / RATE),
+			self.trace)
+		lastSent = {}
+		for changed, flags in self.sent(output, {MOUTH: 4}):
+			for joint, value in changed:
+				if not flags & protocol.FLAG_KEYFRAME and joint == MOUTH:
+					self.assertTrue(abs(value - lastSent[joint]) >= 4, (value, lastSent[joint]))
+				lastSent[joint] = value
+
+	def testJitterBelowDeadbandIsNotResent(self):
+		# a raw wobble of 4 units would be resent every tick with a deadband of 3; smoothed it
+		# stays inside the deadband and goes out with the keyframes only
+		trace = [(tick / RATE, [(MOUTH, 100 + (tick % 2) * 4.0), (0, 0.0)]) for tick in range(90)]
+		self.assertTrue(all(changed for changed, flags in self.sent(trace, {MOUTH: 3})))
+		output = replay(filters.MotionFilter({MOUTH: {"filter": "oneeuro", "minCutoff": 1.0}}, 1 / RATE), trace)
+		for changed, flags in self.sent(output, {MOUTH: 3})[1:]:
+			if not flags & protocol.FLAG_KEYFRAME:
+				self.assertEqual([joint for joint, value in changed if joint == MOUTH], [])
+
+
+if __name__ == "__main__":
+	unittest.main()
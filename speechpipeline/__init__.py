@@ -0,0 +1 @@
+# offline build of the robot's speech assets: utterance text to audio, FaceFX analysis and BML
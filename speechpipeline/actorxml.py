@@ -0,0 +1,117 @@
+import collections
+import os
+import shutil
+import tempfile
+try:
+	import xml.etree.cElementTree as ElementTree
+except ImportError:
+	import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import quoteattr
+
+# Reading FaceFX actorxml exports (robot.xml): an <actor> with the face graph and bones, then
+# <animation_groups> holding one <animation name="..."> per analyzed audio file with its
+# <phonemes>, <words> and <curves>. Animations are handed out one at a time as their element
+# closes and cleared afterwards, so only one is held in memory however big the export.
+
+
+def iterGroupedAnimations(source):
+	# yields (group name, animation name, element) for every <animation>; the element is
+	# cleared once the caller moves on, copy what's needed before that
+	stack = []
+	for event, element in ElementTree.iterparse(source, events=("start", "end")):
+		if event == "start":
+			stack.append(element)
+			continue
+		stack.pop()
+		if any(parent.tag == "animation" for parent in stack):
+			continue
+		if element.tag == "animation":
+			group = None
+			if stack and stack[-1].tag == "animation_group":
+				group = stack[-1].get("name")
+			yield group, element.get("name"), element
+		# done with it (face graph, bones, a finished animation): drop it from the tree so
+		# nothing accumulates under the root
+		element.clear()
+		if stack:
+			stack[-1].remove(element)
+
+
+def iterAnimations(source):
+	# yields (name, element) for every <animation>, as iterGroupedAnimations
+	for group, name, element in iterGroupedAnimations(source):
+		yield name, element
+
+
+def actorHeader(source):
+	# the <actor> attributes and everything in it before <animation_groups> (face graph,
+	# bones, ...) as text; parsing stops there
+	attributes = {}
+	parts = []
+	depth = 0
+	for event, element in ElementTree.iterparse(source, events=("start", "end")):
+		if event == "start":
+			depth += 1
+			if depth == 1:
+				attributes = dict(element.attrib)
+			elif depth == 2 and element.tag == "animation_groups":
+				break
+			continue
+		depth -= 1
+		if depth == 1:
+			element.tail = None
+			parts.append(ElementTree.tostring(element))
+			element.clear()
+	return attributes, parts
+
+
+def mergeExports(paths, output):
+	# merges actorxml exports (one per analysis shard) into output: the first export's actor
+	# and face graph, then every export's animations, kept in their groups. an animation name
+	# seen before is left out. returns how many animations were written
+	attributes, header = actorHeader(paths[0])
+	seen = set()
+	# group name -> spool file collecting that group's animations from every export, so each
+	# group is written once without holding the animations in memory
+	groups = collections.OrderedDict()
+	temporary = output + ".tmp"
+	try:
+		for path in paths:
+			for group, name, element in iterGroupedAnimations(path):
+				if name in seen:
+					continue
+				seen.add(name)
+				group = group or "Default"
+				if group not in groups:
+					groups[group] = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(output)))
+				element.tail = None
+				groups[group].write(ElementTree.tostring(element) + "\n")
+		with open(temporary, "w") as f:
+			f.write("<actor%s>\n" % "".join(" %s=%s" % (key, quoteattr(value)) for key, value in sorted(attributes.items())))
+			for part in header:
+				f.write(part + "\n")
+			f.write("<animation_groups>\n")
+			for group, spool in groups.items():
+				f.write("<animation_group name=%s>\n" % quoteattr(group))
+				spool.seek(0)
+				shutil.copyfileobj(spool, f)
+				f.write("</animation_group>\n")
+			f.write("</animation_groups>\n</actor>\n")
+	finally:
+		for spool in groups.values():
+			spool.close()
+	if os.name == "nt" and os.path.exists(output):
+		os.remove(output)
+	os.rename(temporary, output)
+	return len(seen)
+
+
+def animationXml(element):
+	# the <animation> element as text, for storing it on its own
+	return ElementTree.tostring(element)
+
+
+def actorDocument(fragments, name="robot"):
+	# an actorxml file holding just these <animation> elements
+	return ("<actor name=\"%s\">\n<animation_groups>\n<animation_group name=\"Default\">\n%s\n</animation_group>\n"
+		"</animation_groups>\n</actor>\n") % (name, "\n".join(fragment.strip() for fragment in fragments))
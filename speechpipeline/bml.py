@@ -0,0 +1,339 @@
+import mmap
+import multiprocessing
+import optparse
+import os
+import re
+import sys
+import time
+from xml.sax.saxutils import escape, unescape
+
+from speechpipeline import actorxml, cache
+
+# FaceFX actorxml export to SmartBody BML, a port of tools\VisemeSchedulerFacefx\Program.cs
+# (the VisemeScheduler) writing the same files byte for byte. The scheduler reads every
+# animation of the export into memory before writing anything; this streams the export instead
+# and writes each BML as soon as its <animation> closes, so memory stays flat however many
+# animations there are. As a drop-in for the second step of createbml.bat:
+#
+#   python -m speechpipeline.bml C:\...\SmartBody\data\sounds\robot.xml
+#   python -m speechpipeline.bml robot.xml line2 line2.bml.txt
+#   python -m speechpipeline.bml --mapping sbm --remap robot.xml --extension .bml
+#
+# BMLs go next to the export as <animation>.bml.txt unless --out says otherwise; --extension
+# .bml saves the changefileextentions.py step.
+#
+# Every animation converts on its own, so with --processes the export is first scanned for the
+# byte range of each <animation> element and runs of them go to a pool of processes, each
+# parsing just its ranges and writing the BMLs itself:
+#
+#   python -m speechpipeline.bml robot.xml --processes 0
+#
+# (0 for one per core.) speechpipeline/bmlbench.py times both on a made-up export.
+
+# phoneme -> viseme for the <lips> section. sbm is the SBM column of
+# facefx-phoneme-to-viseme-map.xls, sbm2 comes from example_sbm2_mapping.facefx
+MAPPINGS = {
+	"sbm": {
+		"P": "BMP", "B": "BMP", "T": "D", "D": "D", "K": "KG", "G": "KG", "M": "BMP", "N": "NG", "NG": "NG", "RA": "Er",
+		"RU": "Er", "FLAP": "D", "PH": "F", "F": "F", "V": "F", "TH": "Th", "DH": "Th", "S": "Z", "Z": "Z", "SH": "j",
+		"ZH": "j", "CX": "Ih", "X": "Ih", "GH": "KG", "HH": "Ih", "R": "R", "Y": "OO", "L": "Th", "W": "Ao", "H": "oh",
+		"TS": "D", "CH": "KG", "JH": "KG",
+		"IY": "EE", "E": "Ih", "EN": "Ih", "EH": "Ih", "A": "Ao", "AA": "Ao", "AAN": "Ao", "AO": "Ao", "AON": "Ao",
+		"O": "Ao", "ON": "Ih", "UW": "oh", "UY": "OO", "EU": "OO", "OE": "oh", "OEN": "oh", "AH": "Ih", "IH": "Ih",
+		"UU": "oh", "UH": "oh", "AX": "Ih", "UX": "Ih", "AE": "Ih", "ER": "Er", "AXR": "Er", "EXR": "Er",
+		"EY": "Ih", "AW": "Ih", "AY": "Ih", "OY": "oh", "OW": "oh",
+		"SIL": "_",
+	},
+	"sbm2": {
+		"P": "BMP", "B": "BMP", "T": "D", "D": "D", "M": "BMP", "RA": "L", "RU": "Er", "FLAP": "D", "PH": "F", "F": "F",
+		"V": "F", "TH": "Th", "DH": "Th", "S": "Z", "Z": "Z", "R": "R", "L": "L", "E": "Eh", "EN": "Eh", "EH": "Eh",
+		"A": "Aa", "IH": "Ih", "ER": "Er", "AXR": "Er", "EXR": "Er", "AY": "Ay", "ON": "Ow", "AX": "Ah", "UX": "Ah",
+		"AE": "Ah", "AA": "Aa", "AAN": "Aa", "AO": "Aa", "AON": "Aa", "O": "Ow", "EY": "Eh", "UW": "W", "OW": "Ow",
+		"OY": "Oy", "H": "H", "SH": "Sh", "ZH": "Sh", "N": "D", "NG": "D", "Y": "Sh", "UY": "W", "EU": "W", "IY": "Ih",
+		"K": "Kg", "G": "Kg", "GH": "Kg", "JH": "Sh", "CH": "Sh", "CX": "H", "X": "H", "HH": "H", "W": "W", "TS": "Z",
+		"OE": "W", "OEN": "W", "UU": "W", "AH": "Ah", "UH": "W", "AW": "Aw",
+		"SIL": "_",
+	},
+}
+DEFAULT_MAPPING = "sbm2"
+
+# the FaceFX Maya exporter won't name a pose with one character, so the viseme poses carry
+# doubled names that are put back here
+CURVE_NAMES = {"DD": "D", "FF": "F", "HH": "H", "JJ": "j", "LL": "L", "RR": "R", "WW": "W", "ZZ": "Z"}
+# analysis actor curves with an action unit of their own, renamed with --remap
+ANALYSIS_ACTOR_CURVES = {"Blink": "au_45", "Eyebrow Raise": "au_1", "Squint": "au_7"}
+
+# what the scheduler's XmlWriter writes on Windows
+NEWLINE = "\r\n"
+INDENT = "    "
+SPECIAL = re.compile(r"[&<>\"\t\r\n]")
+
+# <animation ...>, <animation .../> or </animation>; <animation_group> doesn't match. FaceFX
+# writes no comments or CDATA, so a tag in the text is a tag
+ANIMATION_TAG = re.compile(r"<(/?)animation(?=[\s/>])((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>")
+NAME_ATTRIBUTE = re.compile(r"(?:^|\s)name\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+# animations per task handed to a worker
+DEFAULT_CHUNK = 50
+
+
+class BmlError(Exception):
+	pass
+
+
+class Animation(object):
+	__slots__ = ("name", "phonemes", "words", "curves")
+
+	def __init__(self, name):
+		self.name = name
+		# (phoneme, start, end)
+		self.phonemes = []
+		# (word, start, end)
+		self.words = []
+		# (name, num_keys, owner, keys as written)
+		self.curves = []
+
+
+def number(text):
+	# a time as .NET's double.ToString() prints it: "1.200000" -> "1.2", "0.000000" -> "0"
+	return ("%.15g" % float(text)).replace("e", "E")
+
+
+def readAnimation(element, remap=False):
+	# the parts of an <animation> element the BML needs
+	animation = Animation(element.get("name"))
+	for phonemes in element.findall("phonemes"):
+		for phoneme in phonemes.findall("phoneme"):
+			animation.phonemes.append((phoneme.get("phoneme"), number(phoneme.get("start")), number(phoneme.get("end"))))
+	for words in element.findall("words"):
+		for word in words.findall("word"):
+			animation.words.append((word.text or "", number(word.get("start")), number(word.get("end"))))
+	for curves in element.findall("curves"):
+		for curve in curves.findall("curve"):
+			name = curve.get("name")
+			numKeys = int(curve.get("num_keys"))
+			keys = curve.text or ""
+			count = len(keys.split())
+			if numKeys > 0 and count != numKeys * 4:
+				print "Reading curve data, '%s' expected num_keys(%d) elements, but received %d" % (name, numKeys * 4, count)
+			name = CURVE_NAMES.get(name, name)
+			if remap:
+				name = ANALYSIS_ACTOR_CURVES.get(name, name)
+			animation.curves.append((name, numKeys, curve.get("owner"), keys))
+	return animation
+
+
+def attribute(value):
+	# most values are numbers; escaping them all costs more than the rest of the conversion
+	if not SPECIAL.search(value):
+		return value
+	return escape(value, {"\"": "&quot;", "\t": "&#x9;", "\n": "&#xA;", "\r": "&#xD;"})
+
+
+def text(value):
+	if not SPECIAL.search(value):
+		return value
+	return escape(value).replace("\r\n", "\n").replace("\n", NEWLINE)
+
+
+def startTag(depth, tag, attributes, closed=True):
+	return "%s%s<%s%s%s>" % (NEWLINE if depth else "", INDENT * depth, tag,
+		"".join(" %s=\"%s\"" % (key, attribute(value)) for key, value in attributes), " /" if closed else "")
+
+
+def render(animation, mapping=DEFAULT_MAPPING):
+	# the BML file contents, utf-8 with a byte order mark like the scheduler's
+	visemes = MAPPINGS[mapping]
+	parts = ["\xef\xbb\xbf<?xml version=\"1.0\" encoding=\"utf-8\"?>", NEWLINE, "<bml>"]
+	parts.append(startTag(1, "speech", [("id", "sp1"), ("start", "0.0"), ("ready", "0.1"), ("stroke", "0.1"), ("relax", "0.2"),
+		("end", "0.2")], False))
+	if animation.words:
+		# mixed content: the writer stops indenting inside <text>, the scheduler lays the words
+		# out itself
+		parts.append(startTag(2, "text", [], False))
+		for index, (word, start, end) in enumerate(animation.words):
+			parts.append(startTag(3, "sync", [("id", "T%d" % (2 * index)), ("time", start)]) if index == 0 else
+				"<sync id=\"T%d\" time=\"%s\" />" % (2 * index, start))
+			parts.append(text(word))
+			parts.append(NEWLINE + INDENT * 3)
+			parts.append("<sync id=\"T%d\" time=\"%s\" />" % (2 * index + 1, end))
+			parts.append(NEWLINE + INDENT * (2 if index == len(animation.words) - 1 else 3))
+		parts.append("</text>")
+	else:
+		parts.append(startTag(2, "text", []))
+	parts.append(startTag(2, "description", [("level", "1"), ("type", "audio/x-wav")], False))
+	parts.append(startTag(3, "file", [("ref", animation.name)]))
+	parts.append("%s%s</description>%s%s</speech>" % (NEWLINE, INDENT * 2, NEWLINE, INDENT))
+	for phoneme, start, end in animation.phonemes:
+		if phoneme not in visemes:
+			raise BmlError("%s: no viseme for phoneme %s in the %s mapping" % (animation.name, phoneme, mapping))
+		parts.append(startTag(1, "lips", [("viseme", visemes[phoneme]), ("articulation", "1.0"), ("start", start), ("ready", start),
+			("relax", end), ("end", end)]))
+	if animation.curves:
+		parts.append(startTag(1, "curves", [], False))
+		for name, numKeys, owner, keys in animation.curves:
+			parts.append(startTag(2, "curve", [("name", name), ("num_keys", str(numKeys)), ("owner", owner or "")], False))
+			parts.append(text(keys) + "</curve>")
+		parts.append("%s%s</curves>" % (NEWLINE, INDENT))
+	else:
+		parts.append(startTag(1, "curves", []))
+	parts.append(NEWLINE + "</bml>" + NEWLINE)
+	return parts[0] + u"".join(parts[1:]).encode("utf-8")
+
+
+def writeBml(path, animation, mapping=DEFAULT_MAPPING):
+	cache.writeAtomically(path, render(animation, mapping))
+
+
+def convert(source, outputDir=".", mapping=DEFAULT_MAPPING, remap=False, extension=".bml.txt", only=None, outputPath=None,
+		report=None):
+	# writes a BML for every animation in the export (just the one named only, to outputPath if
+	# given), each as soon as it has been read; returns how many were written
+	written = 0
+	for name, element in actorxml.iterAnimations(source):
+		if only is not None and name != only:
+			continue
+		animation = readAnimation(element, remap)
+		path = outputPath if only is not None and outputPath else os.path.join(outputDir, name + extension)
+		writeBml(path, animation, mapping)
+		written += 1
+		if report is not None:
+			report(name, path)
+		if only is not None:
+			break
+	return written
+
+
+def indexAnimations(source):
+	# [(name, start, end)]: the byte range of every <animation> element in the export, found
+	# without parsing it. A name that appears twice keeps its last range, the one a sequential
+	# conversion would leave behind
+	entries = {}
+	order = []
+	with open(source, "rb") as f:
+		if not os.fstat(f.fileno()).st_size:
+			return []
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			depth = 0
+			start = name = None
+			for match in ANIMATION_TAG.finditer(data):
+				if match.group(1):
+					depth -= 1
+					if depth == 0 and start is not None:
+						entries[name] = (name, start, match.end())
+						start = None
+					continue
+				attributes = match.group(2)
+				selfClosing = attributes.endswith("/")
+				if depth == 0:
+					found = NAME_ATTRIBUTE.search(attributes)
+					name = unescape(found.group(1) if found.group(1) is not None else found.group(2), {"&quot;": "\"", "&apos;": "'"}) \
+						if found else ""
+					if name not in entries:
+						order.append(name)
+					if selfClosing:
+						entries[name] = (name, match.start(), match.end())
+					else:
+						start = match.start()
+				if not selfClosing:
+					depth += 1
+		finally:
+			data.close()
+	return [entries[name] for name in order]
+
+
+def writeRange(task):
+	# worker side of convertParallel: parses each (name, start, end) range of the export on its
+	# own and writes its BML; returns (written, [error])
+	source, entries, outputDir, mapping, remap, extension = task
+	written = 0
+	errors = []
+	with open(source, "rb") as f:
+		for name, start, end in entries:
+			f.seek(start)
+			try:
+				animation = readAnimation(actorxml.ElementTree.fromstring(f.read(end - start)), remap)
+				writeBml(os.path.join(outputDir, name + extension), animation, mapping)
+				written += 1
+			except (BmlError, EnvironmentError, SyntaxError, ValueError), e:
+				errors.append("%s: %s" % (name, e))
+	return written, errors
+
+
+def convertParallel(source, outputDir=".", mapping=DEFAULT_MAPPING, remap=False, extension=".bml.txt", processes=None,
+		chunk=DEFAULT_CHUNK, report=None):
+	# convert with the animations split over a pool of processes (default one per core);
+	# returns (written, [error]). report(written so far, total) follows the progress
+	entries = indexAnimations(source)
+	tasks = [(source, entries[i:i + chunk], outputDir, mapping, remap, extension) for i in range(0, len(entries), chunk)]
+	written = 0
+	errors = []
+	if not tasks:
+		return written, errors
+	pool = multiprocessing.Pool(processes or None)
+	try:
+		for count, failed in pool.imap_unordered(writeRange, tasks):
+			written += count
+			errors.extend(failed)
+			if report is not None:
+				report(written, len(entries))
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+	return written, errors
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options] <facefx .xml> [<animation> [<.bml.txt file>]]")
+	parser.add_option("--mapping", default=DEFAULT_MAPPING, choices=sorted(MAPPINGS), help="phoneme to viseme map for <lips>, sbm or sbm2")
+	parser.add_option("--remap", action="store_true", help="rename the Blink, Eyebrow Raise and Squint curves to action units")
+	parser.add_option("--out", default=None, help="directory for the BMLs, default the export's")
+	parser.add_option("--extension", default=".bml.txt")
+	parser.add_option("--processes", type="int", default=1, help="index the export and convert with this many processes, 0 for one per core")
+	parser.add_option("--chunk", type="int", default=DEFAULT_CHUNK, help="animations per task with --processes")
+	parser.add_option("--quiet", action="store_true")
+	options, args = parser.parse_args()
+	if not 1 <= len(args) <= 3:
+		parser.error("expected the FaceFX .xml, optionally an animation and the file to write it to")
+	if options.processes != 1 and len(args) > 1:
+		parser.error("--processes converts the whole export")
+	source = args[0]
+	only = args[1] if len(args) > 1 else None
+	outputPath = args[2] if len(args) > 2 else None
+	outputDir = options.out or os.path.dirname(os.path.abspath(source))
+	if not os.path.isdir(outputDir):
+		os.makedirs(outputDir)
+
+	def report(name, path):
+		if not options.quiet:
+			print path
+
+	started = time.time()
+	errors = []
+	try:
+		if options.processes == 1:
+			written = convert(source, outputDir, options.mapping, options.remap, options.extension, only, outputPath, report)
+		else:
+			# through the package so the workers get speechpipeline.bml.writeRange, not __main__'s
+			from speechpipeline import bml
+			written, errors = bml.convertParallel(source, outputDir, options.mapping, options.remap, options.extension,
+				options.processes, options.chunk)
+	except (BmlError, EnvironmentError, SyntaxError, ValueError), e:
+		# SyntaxError covers ElementTree's ParseError
+		print >>sys.stderr, "%s: %s" % (source, e)
+		sys.exit(1)
+	for error in errors:
+		print >>sys.stderr, error
+	print "%d BMLs from %s in %.1f s" % (written, source, time.time() - started)
+	if errors:
+		sys.exit(1)
+	if only is not None and not written:
+		print >>sys.stderr, "no animation %s in %s" % (only, source)
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
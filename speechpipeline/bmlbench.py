@@ -0,0 +1,139 @@
+# Benchmark for speechpipeline.bml on a made-up FaceFX export: writes an actorxml file with
+# --animations animations (phonemes, words and curves sized like real lines), converts it once
+# streaming in this process and once per --processes count through the byte-range index and
+# the process pool, checks every run wrote the same files, and prints the times.
+#
+#   python -m speechpipeline.bmlbench
+#   python -m speechpipeline.bmlbench --animations 10000 --processes 1,2,4,8 --keep
+
+import filecmp
+import multiprocessing
+import optparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from speechpipeline import bml
+
+WORDS = ("hello", "my", "name", "is", "robot", "it", "takes", "a", "lot", "of", "courage", "to", "be", "here", "and",
+	"remember", "that", "anything", "you", "say", "stays", "between", "us", "what", "would", "like", "talk", "about")
+CURVES = ("open", "W", "ShCh", "PBM", "wide", "tBack", "tTeeth", "FF", "LL", "Blink", "Eye Pitch", "Eye Yaw",
+	"Eyebrow Raise", "Head Pitch", "Head Roll", "Head Yaw", "Squint")
+
+
+def animationXml(generator, name, words):
+	phonemes = sorted(bml.MAPPINGS[bml.DEFAULT_MAPPING])
+	lines = ["<animation name=\"%s\" language=\"USEnglish\" analysis_actor=\"default\" audio_path=\"%s.wav\">" % (name, name),
+		"<phonemes>"]
+	wordTimes = []
+	lines.append("<phoneme phoneme=\"SIL\" start=\"0.000000\" end=\"0.300000\" />")
+	now = 0.3
+	for word in words:
+		start = now
+		for i in range(len(word)):
+			length = generator.uniform(0.04, 0.12)
+			lines.append("<phoneme phoneme=\"%s\" start=\"%f\" end=\"%f\" />" % (generator.choice(phonemes), now, now + length))
+			now += length
+		wordTimes.append((word, start, now))
+	lines.append("<phoneme phoneme=\"SIL\" start=\"%f\" end=\"%f\" />" % (now, now + 0.3))
+	lines.append("</phonemes>")
+	lines.append("<words>")
+	for word, start, end in wordTimes:
+		lines.append("<word start=\"%f\" end=\"%f\">%s</word>" % (start, end, word))
+	lines.append("</words>")
+	lines.append("<curves>")
+	for curve in CURVES:
+		keys = generator.randint(3, 40)
+		values = " ".join("%f %f %f %f" % (now * i / keys, generator.random(), generator.uniform(-1, 1), generator.uniform(-1, 1))
+			for i in range(keys))
+		lines.append("<curve name=\"%s\" num_keys=\"%d\" owner=\"analysis\">%s</curve>" % (curve, keys, values))
+	lines.append("</curves>")
+	lines.append("</animation>")
+	return "\n".join(lines)
+
+
+def writeExport(path, animations, seed=1):
+	# an actorxml export with that many animations, the same for the same seed
+	generator = random.Random(seed)
+	with open(path, "w") as f:
+		f.write("<actor name=\"robot\" version=\"2121\" path=\"robot.facefx\">\n<face_graph>\n<bones>\n")
+		for bone in ("spine5", "skullbase", "face_top_parent", "brow_parent_left", "brow_parent_right"):
+			f.write("<bone name=\"%s\" weight=\"1\">0 %f %f -1 0 0 0 1 1 1</bone>\n" % (bone, generator.random(), generator.random()))
+		f.write("</bones>\n</face_graph>\n<animation_groups>\n<animation_group name=\"Default\" />\n"
+			"<animation_group name=\"robot\">\n")
+		for index in range(animations):
+			words = [generator.choice(WORDS) for i in range(generator.randint(3, 20))]
+			f.write(animationXml(generator, "line%05d" % index, words) + "\n")
+		f.write("</animation_group>\n</animation_groups>\n</actor>\n")
+
+
+def sameFiles(first, second):
+	names = sorted(os.listdir(first))
+	if names != sorted(os.listdir(second)):
+		return False
+	match, mismatch, errors = filecmp.cmpfiles(first, second, names, shallow=False)
+	return not mismatch and not errors
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--animations", type="int", default=10000)
+	parser.add_option("--processes", default=None, help="comma separated process counts to try, default 1,2,4,... up to the cores")
+	parser.add_option("--chunk", type="int", default=bml.DEFAULT_CHUNK)
+	parser.add_option("--export", default=None, help="convert this export instead of a made-up one")
+	parser.add_option("--keep", action="store_true", help="keep the export and the BMLs")
+	options, args = parser.parse_args()
+	cores = multiprocessing.cpu_count()
+	if options.processes:
+		counts = [int(count) for count in options.processes.split(",")]
+	else:
+		counts = [1]
+		while counts[-1] * 2 <= cores:
+			counts.append(counts[-1] * 2)
+		if counts[-1] != cores:
+			counts.append(cores)
+
+	workDir = tempfile.mkdtemp(prefix="bmlbench-")
+	try:
+		source = options.export
+		if source is None:
+			source = os.path.join(workDir, "robot.xml")
+			started = time.time()
+			writeExport(source, options.animations)
+			print "wrote %d animations (%.1f MB) in %.1f s" % (options.animations, os.path.getsize(source) / 1e6,
+				time.time() - started)
+
+		streamed = os.path.join(workDir, "streaming")
+		os.makedirs(streamed)
+		started = time.time()
+		written = bml.convert(source, streamed)
+		baseline = time.time() - started
+		print "%-22s %6d BMLs %7.2f s %8.0f/s" % ("streaming", written, baseline, written / baseline)
+
+		started = time.time()
+		entries = bml.indexAnimations(source)
+		print "%-22s %6d ranges %5.2f s" % ("index", len(entries), time.time() - started)
+
+		for count in counts:
+			output = os.path.join(workDir, "processes-%d" % count)
+			os.makedirs(output)
+			started = time.time()
+			written, errors = bml.convertParallel(source, output, processes=count, chunk=options.chunk)
+			seconds = time.time() - started
+			print "%-22s %6d BMLs %7.2f s %8.0f/s  x%.2f%s%s" % ("%d processes" % count, written, seconds, written / seconds,
+				baseline / seconds, "" if sameFiles(streamed, output) else "  OUTPUT DIFFERS",
+				"  %d errors" % len(errors) if errors else "")
+			if not options.keep:
+				shutil.rmtree(output)
+		print "%d cores" % cores
+	finally:
+		if options.keep:
+			print "kept %s" % workDir
+		else:
+			shutil.rmtree(workDir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+	main()
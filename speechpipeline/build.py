@@ -0,0 +1,524 @@
+import hashlib
+import json
+import optparse
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+
+from speechpipeline import actorxml, bml, cache, facefx
+
+# Incremental build of the speech assets, replacing createbml.bat's run-everything steps. Each
+# utterance is a chain of nodes
+#
+#   text -> wav (TtsRelay) -> facefx (phoneme analysis) -> xml (actor file) -> bml
+#
+# and a node only runs when the content hash of its inputs differs from the last build, or its
+# outputs have changed or gone since. A node whose rebuild produces the same bytes as before
+# stops the rebuild there. Utterances are independent, so their nodes run in parallel on a pool
+# of workers; FaceFX analysis is batched, one run over every utterance that needs it.
+#
+#   python -m speechpipeline.build --dry-run        # what would rebuild, and why
+#   python -m speechpipeline.build --workers 8
+#   python -m speechpipeline.build --no-tts         # prerecorded audio: the wavs are sources
+#
+# Hashes and signatures are kept in <build dir>\buildstate.json; file hashes are only
+# recomputed when a file's size or mtime changes.
+
+STATE_NAME = "buildstate.json"
+DEFAULT_WORKERS = 4
+
+
+class BuildError(Exception):
+	pass
+
+
+class Node(object):
+	# a source node has neither action nor batch: a value (hashed as it is) or existing files
+
+	def __init__(self, name, kind, inputs=(), outputs=(), action=None, batch=None, value=None, version="1"):
+		self.name = name
+		self.kind = kind
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		# action(node) builds the outputs; batch(nodes) builds several nodes of a kind in one go
+		# and returns {node name: error} for the ones it couldn't
+		self.action = action
+		self.batch = batch
+		self.value = value
+		# bump to rebuild every node of the kind
+		self.version = version
+		self.signature = None
+
+	def isSource(self):
+		return self.action is None and self.batch is None
+
+
+def hashFile(path):
+	digest = hashlib.sha1()
+	with open(path, "rb") as f:
+		while True:
+			block = f.read(1 << 16)
+			if not block:
+				break
+			digest.update(block)
+	return digest.hexdigest()
+
+
+class BuildState(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		# node name -> {"signature": ..., "outputs": {path: hash}}
+		self.nodes = {}
+		# path -> [size, mtime, hash]
+		self.files = {}
+		if os.path.exists(path):
+			with open(path) as f:
+				data = json.load(f)
+			self.nodes = data.get("nodes", {})
+			self.files = data.get("files", {})
+
+	def fileHash(self, path):
+		# None for a missing file
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		with self.lock:
+			known = self.files.get(path)
+		if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime:
+			return known[2]
+		digest = hashFile(path)
+		with self.lock:
+			self.files[path] = [stat.st_size, stat.st_mtime, digest]
+		return digest
+
+	def outputHash(self, node):
+		# what downstream nodes see of node: its value or its output files, None if one is missing
+		digest = hashlib.sha1()
+		if node.value is not None:
+			digest.update(node.value)
+		for path in node.outputs:
+			fileHash = self.fileHash(path)
+			if fileHash is None:
+				return None
+			digest.update(fileHash)
+		return digest.hexdigest()
+
+	def signature(self, node):
+		digest = hashlib.sha1("%s\0%s\0%s" % (node.kind, node.version, node.name))
+		for input in node.inputs:
+			digest.update(self.outputHash(input) or "missing")
+		return digest.hexdigest()
+
+	def check(self, node, signature):
+		# None when node is up to date, otherwise why it needs building
+		with self.lock:
+			record = self.nodes.get(node.name)
+		if record is None:
+			return "never built"
+		if record["signature"] != signature:
+			return "inputs changed"
+		for path in node.outputs:
+			recorded = record["outputs"].get(path)
+			current = self.fileHash(path)
+			if current is None:
+				return "%s is missing" % os.path.basename(path)
+			if recorded != current:
+				return "%s changed" % os.path.basename(path)
+		return None
+
+	def record(self, node, signature):
+		outputs = dict((path, self.fileHash(path)) for path in node.outputs)
+		with self.lock:
+			self.nodes[node.name] = {"signature": signature, "outputs": outputs}
+
+	def forget(self, node):
+		with self.lock:
+			self.nodes.pop(node.name, None)
+
+	def save(self):
+		with self.lock:
+			data = json.dumps({"nodes": self.nodes, "files": self.files}, indent=1, sort_keys=True)
+		cache.writeAtomically(self.path, data)
+
+
+def topological(nodes):
+	order = []
+	state = {}
+	for root in nodes:
+		stack = [(root, False)]
+		while stack:
+			node, expanded = stack.pop()
+			if expanded:
+				state[node] = "done"
+				order.append(node)
+				continue
+			if state.get(node) == "done":
+				continue
+			if state.get(node) == "open":
+				raise BuildError("dependency cycle through %s" % node.name)
+			state[node] = "open"
+			stack.append((node, True))
+			for input in node.inputs:
+				if state.get(input) != "done":
+					if state.get(input) == "open":
+						raise BuildError("dependency cycle through %s" % input.name)
+					stack.append((input, False))
+	return order
+
+
+class Builder(object):
+
+	def __init__(self, nodes, state, workers=DEFAULT_WORKERS, force=False, report=None):
+		self.nodes = topological(nodes)
+		self.state = state
+		self.workers = workers
+		self.force = force
+		# report(node, status, detail) as nodes finish
+		self.report = report
+		# node -> "source", "current", "built", "failed" or "skipped"
+		self.status = {}
+		self.errors = {}
+
+	def plan(self):
+		# dry run: [(node, reason)] for every node a build would run. nodes downstream of one
+		# that rebuilds are listed too, though a rebuild giving identical output would stop there
+		rebuilding = {}
+		plan = []
+		for node in self.nodes:
+			if node.isSource():
+				continue
+			changed = [input for input in node.inputs if input in rebuilding]
+			if changed:
+				reason = "after %s" % changed[0].name
+			elif self.force:
+				reason = "forced"
+			else:
+				reason = self.state.check(node, self.state.signature(node))
+			if reason is not None:
+				rebuilding[node] = reason
+				plan.append((node, reason))
+		return plan
+
+	def run(self):
+		dependents = dict((node, []) for node in self.nodes)
+		waiting = {}
+		ready = deque()
+		for node in self.nodes:
+			waiting[node] = len(node.inputs)
+			for input in node.inputs:
+				dependents[input].append(node)
+			if not node.inputs:
+				ready.append(node)
+		# batch -> nodes queued for it, and how many of its nodes haven't got that far yet
+		batches = {}
+		outstanding = {}
+		for node in self.nodes:
+			if node.batch is not None:
+				outstanding[node.batch] = outstanding.get(node.batch, 0) + 1
+		tasks = Queue.Queue()
+		results = Queue.Queue()
+		running = [0]
+
+		def work():
+			while True:
+				task = tasks.get()
+				if task is None:
+					return
+				nodes, function, argument = task
+				started = time.time()
+				try:
+					errors = function(argument) or {}
+				except Exception, e:
+					errors = dict((node.name, str(e) or e.__class__.__name__) for node in nodes)
+				results.put((nodes, errors, time.time() - started))
+
+		def submit(nodes, function, argument):
+			running[0] += 1
+			tasks.put((nodes, function, argument))
+
+		def finish(node, status, detail=None):
+			self.status[node] = status
+			if status == "failed":
+				self.errors[node] = detail
+			if self.report is not None:
+				self.report(node, status, detail)
+			for dependent in dependents[node]:
+				waiting[dependent] -= 1
+				if waiting[dependent] == 0:
+					ready.append(dependent)
+
+		def consider(node):
+			if node.batch is not None:
+				outstanding[node.batch] -= 1
+			blocked = [input for input in node.inputs if self.status[input] in ("failed", "skipped")]
+			if blocked:
+				finish(node, "skipped", "%s did not build" % blocked[0].name)
+				return
+			if node.isSource():
+				if node.value is None and self.state.outputHash(node) is None:
+					finish(node, "failed", "missing %s" % ", ".join(path for path in node.outputs if not os.path.exists(path)))
+				else:
+					finish(node, "source")
+				return
+			node.signature = self.state.signature(node)
+			if not self.force and self.state.check(node, node.signature) is None:
+				finish(node, "current")
+				return
+			if node.batch is not None:
+				batches.setdefault(node.batch, []).append(node)
+			else:
+				submit([node], node.action, node)
+
+		threads = [threading.Thread(target=work, name="Builder-%d" % i) for i in range(max(1, self.workers))]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		try:
+			while True:
+				while ready:
+					consider(ready.popleft())
+				# a batch goes once every node that could join it has
+				for batch, queued in batches.items():
+					if queued and outstanding[batch] == 0:
+						submit(list(queued), batch, list(queued))
+						del queued[:]
+				if not running[0]:
+					break
+				nodes, errors, seconds = results.get()
+				running[0] -= 1
+				for node in nodes:
+					if node.name in errors:
+						self.state.forget(node)
+						finish(node, "failed", errors[node.name])
+					else:
+						self.state.record(node, node.signature)
+						finish(node, "built", "%.1f s" % seconds)
+		finally:
+			for thread in threads:
+				tasks.put(None)
+			self.state.save()
+		# they are idle by now; let them see the None before the interpreter goes away
+		for thread in threads:
+			thread.join()
+		return self.status
+
+	def summary(self):
+		kinds = []
+		counts = {}
+		for node in self.nodes:
+			if node.kind not in counts:
+				kinds.append(node.kind)
+				counts[node.kind] = {}
+			status = self.status.get(node, "not run")
+			counts[node.kind][status] = counts[node.kind].get(status, 0) + 1
+		lines = []
+		for kind in kinds:
+			lines.append("%-8s %s" % (kind, "  ".join("%s %d" % (status, count) for status, count in sorted(counts[kind].items()))))
+		return "\n".join(lines)
+
+
+class SpeechPipeline(object):
+	# the nodes for each utterance and the actions that build them
+
+	def __init__(self, soundsDir, buildDir, voice, assetCache=None, speech=None, analyzer=facefx.FACEFX_STUDIO,
+			actor=facefx.ACTOR, scheduler=facefx.VISEME_SCHEDULER, shards=None):
+		self.soundsDir = soundsDir
+		self.buildDir = buildDir
+		self.voice = voice
+		# function returning a tts.SpeechBatch, called the first time a wav needs making; None
+		# when the wavs are sources
+		self.speech = speech
+		# cache entries are keyed by the utterance text, which says nothing about prerecorded audio
+		self.assetCache = assetCache if speech is not None else None
+		self.speechBatch = None
+		self.lock = threading.Lock()
+		self.analyzer = analyzer
+		self.actor = actor
+		# None writes the BMLs with bml.py
+		self.scheduler = scheduler
+		# FaceFX processes at once, None for one per core
+		self.shards = shards
+		# node -> (text, name, cache key)
+		self.utterances = {}
+		for directory in ("facefx", "xml", "bml", "work"):
+			cache.ensureDirectory(os.path.join(buildDir, directory))
+
+	def nodes(self, utterances):
+		nodes = []
+		for text, name in utterances:
+			key = cache.cacheKey(text, self.voice)
+			wavOutputs = [os.path.join(self.soundsDir, name + ".wav"), os.path.join(self.soundsDir, name + ".txt")]
+			if self.speech is not None:
+				textNode = Node("text:" + name, "text", value=key)
+				wav = Node("wav:" + name, "wav", [textNode], wavOutputs, action=self.makeWav)
+			else:
+				wav = Node("wav:" + name, "wav", outputs=wavOutputs)
+			analysis = Node("facefx:" + name, "facefx", [wav], [os.path.join(self.buildDir, "facefx", name + ".xml")],
+				batch=self.analyze)
+			xml = Node("xml:" + name, "xml", [analysis], [os.path.join(self.buildDir, "xml", name + ".xml")], action=self.makeXml)
+			bml = Node("bml:" + name, "bml", [xml], [os.path.join(self.soundsDir, name + ".bml")], action=self.makeBml)
+			for node in (wav, analysis, xml, bml):
+				self.utterances[node] = (text, name, key)
+			nodes.append(bml)
+		return nodes
+
+	def makeWav(self, node):
+		text, name, key = self.utterances[node]
+		with self.lock:
+			if self.speechBatch is None:
+				self.speechBatch = self.speech()
+		result = self.speechBatch.process(text, name)
+		if not result.ok:
+			raise BuildError(result.error)
+
+	def analyze(self, nodes):
+		# cached analyses are copied out, the rest are split over FaceFX processes running at once
+		pending = {}
+		for node in nodes:
+			text, name, key = self.utterances[node]
+			if self.assetCache is not None and self.assetCache.has(key, "facefx"):
+				shutil.copyfile(self.assetCache.path(key, "facefx"), node.outputs[0])
+			else:
+				pending[name] = node
+		if not pending:
+			return {}
+		workDir = tempfile.mkdtemp(dir=os.path.join(self.buildDir, "work"), prefix="facefx-")
+		items = [(name, node.inputs[0].outputs[0], node.inputs[0].outputs[1]) for name, node in sorted(pending.items())]
+		errors = {}
+		for shard in facefx.analyzeSharded(items, workDir, self.shards, self.analyzer, self.actor):
+			if shard.error is None:
+				self.collect(shard.exportPath, pending)
+			else:
+				for name, wavPath, txtPath in shard.items:
+					errors[pending[name].name] = shard.error
+		if not errors:
+			# a failed shard's directory stays, its log is named in the error
+			shutil.rmtree(workDir, ignore_errors=True)
+		for name, node in pending.items():
+			if node.name not in errors and not os.path.exists(node.outputs[0]):
+				errors[node.name] = "no animation for %s in the FaceFX export" % name
+		return errors
+
+	def collect(self, exportPath, pending):
+		# writes each wanted <animation> of an actorxml export to its node's output
+		for name, element in actorxml.iterAnimations(exportPath):
+			node = pending.get(name)
+			if node is None:
+				continue
+			fragment = actorxml.animationXml(element)
+			cache.writeAtomically(node.outputs[0], fragment)
+			if self.assetCache is not None:
+				text, name, key = self.utterances[node]
+				self.assetCache.storeData(key, "facefx", fragment, cache.utteranceMeta(text, self.voice, name))
+
+	def makeXml(self, node):
+		# the animation on its own in an actor file, which is what the VisemeScheduler reads
+		with open(node.inputs[0].outputs[0], "rb") as f:
+			fragment = f.read()
+		cache.writeAtomically(node.outputs[0], actorxml.actorDocument([fragment]))
+
+	def makeBml(self, node):
+		text, name, key = self.utterances[node]
+		if self.assetCache is not None and self.assetCache.has(key, "bml"):
+			with open(self.assetCache.path(key, "bml"), "rb") as f:
+				cache.writeAtomically(node.outputs[0], f.read())
+			return
+		workDir = tempfile.mkdtemp(dir=os.path.join(self.buildDir, "work"), prefix="bml-")
+		try:
+			output = os.path.join(workDir, name + ".bml.txt")
+			if self.scheduler is None:
+				bml.convert(node.inputs[0].outputs[0], only=name, outputPath=output)
+			else:
+				facefx.schedule(node.inputs[0].outputs[0], name, output, self.scheduler)
+			cache.replaceFile(output, node.outputs[0])
+		finally:
+			shutil.rmtree(workDir, ignore_errors=True)
+		if self.assetCache is not None:
+			self.assetCache.store(key, "bml", node.outputs[0], cache.utteranceMeta(text, self.voice, name))
+
+	def close(self):
+		if self.speechBatch is not None:
+			# SpeechBatch.run saves this itself, but the build only ever calls process
+			if self.speechBatch.manifest is not None:
+				self.speechBatch.manifest.save()
+			self.speechBatch.client.stop()
+
+
+def main():
+	from speechpipeline import tts
+	from vhmsgclient import backends, client
+
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--utterances", default="utterances.txt")
+	parser.add_option("--sounds", default=tts.SOUNDS_DIR)
+	parser.add_option("--build-dir", dest="buildDir", default=os.path.join(os.path.dirname(tts.SOUNDS_DIR), "speechbuild"),
+		help="intermediate files and the build state")
+	parser.add_option("--cache", default=tts.CACHE_DIR)
+	parser.add_option("--no-cache", dest="cache", action="store_const", const=None)
+	parser.add_option("--no-tts", dest="tts", action="store_false", default=True, help="use the .wav/.txt files already in the sounds directory")
+	parser.add_option("--voice", default=tts.VOICE)
+	parser.add_option("--workers", type="int", default=DEFAULT_WORKERS)
+	parser.add_option("--analyzer", default=facefx.FACEFX_STUDIO, help="FaceFX Studio, or a stand-in taking -exec <fxl>")
+	parser.add_option("--actor", default=facefx.ACTOR)
+	parser.add_option("--shards", type="int", default=None, help="FaceFX processes at once, default one per core")
+	parser.add_option("--scheduler", default=facefx.VISEME_SCHEDULER)
+	parser.add_option("--python-scheduler", dest="scheduler", action="store_const", const=None,
+		help="write the BMLs with speechpipeline/bml.py instead of the VisemeScheduler")
+	parser.add_option("--broker", default=None, help="host:port of a STOMP broker for the relay, default vhmsg_python")
+	parser.add_option("--dry-run", dest="dryRun", action="store_true", help="only report what would rebuild")
+	parser.add_option("--force", action="store_true", help="rebuild everything")
+	options, args = parser.parse_args()
+
+	try:
+		utterances = tts.readUtterances(options.utterances)
+	except (IOError, ValueError), e:
+		parser.error(str(e))
+	assetCache = None
+	if options.cache:
+		assetCache = cache.AssetCache(options.cache)
+
+	def speech():
+		if options.broker:
+			host, port = options.broker.rsplit(":", 1)
+			vh = client.VhmsgClient(backends.StompBackend(), host, port=port)
+		else:
+			vh = client.VhmsgClient()
+		return tts.SpeechBatch(vh.start(), options.sounds, voice=options.voice, assetCache=assetCache)
+
+	pipeline = SpeechPipeline(options.sounds, options.buildDir, options.voice, assetCache, speech if options.tts else None,
+		options.analyzer, options.actor, options.scheduler, options.shards)
+	state = BuildState(os.path.join(options.buildDir, STATE_NAME))
+
+	printLock = threading.Lock()
+	def report(node, status, detail):
+		if status in ("built", "failed", "skipped"):
+			with printLock:
+				print "%-8s %-30s %s" % (status, node.name, detail or "")
+
+	builder = Builder(pipeline.nodes(utterances), state, options.workers, options.force, report)
+	if options.dryRun:
+		plan = builder.plan()
+		for node, reason in plan:
+			print "%-30s %s" % (node.name, reason)
+		print "%d of %d steps would run" % (len(plan), len([node for node in builder.nodes if not node.isSource()]))
+		return
+	started = time.time()
+	try:
+		builder.run()
+	finally:
+		pipeline.close()
+	print builder.summary()
+	print "%.1f s" % (time.time() - started)
+	if builder.errors:
+		raise SystemExit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+from speechpipeline import actorxml
+
+# Content-addressed store for everything built from one utterance: the TTS audio, its
+# transcript, the FaceFX analysis (the <animation> element from the actorxml export) and the
+# BML. Entries are keyed by a hash of the text, the voice and PIPELINE_VERSION, so an utterance
+# is only rebuilt when its text or voice changes, wherever it sits in utterances.txt and
+# whatever its file name. Bump PIPELINE_VERSION when a build step changes its output.
+#
+#   <cache>/ab/ab12...ef/audio.wav transcript.txt facefx.xml speech.bml meta.json
+#
+# Entries never change once written. Copying them into the sounds directory goes through a
+# manifest (.speechcache.json there) recording which key each file came from, so files that
+# are already current are left alone, mtime included, and the steps after them see nothing new.
+#
+#   python -m speechpipeline.cache status --utterances utterances.txt
+#   python -m speechpipeline.cache collect --xml C:\...\sounds\robot.xml
+#   python -m speechpipeline.cache restore
+#   python -m speechpipeline.cache prune
+
+PIPELINE_VERSION = "1"
+MANIFEST_NAME = ".speechcache.json"
+
+# mkstemp files are private (0600); what we write is given the mode open() would have, read
+# once here because os.umask can only be read by setting it, which races with other threads
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+# asset -> (file name in the cache entry, extension in the sounds directory, None for assets
+# that only live in the cache)
+ASSETS = {
+	"wav": ("audio.wav", ".wav"),
+	"txt": ("transcript.txt", ".txt"),
+	"facefx": ("facefx.xml", None),
+	"bml": ("speech.bml", ".bml"),
+}
+
+
+def cacheKey(text, voice, version=PIPELINE_VERSION):
+	digest = hashlib.sha1()
+	for part in (version, voice, text.strip()):
+		if isinstance(part, unicode):
+			part = part.encode("utf-8")
+		digest.update(part)
+		digest.update("\0")
+	return digest.hexdigest()
+
+
+def writeAtomically(path, data):
+	# readers see the old file or the whole new one, never half of it
+	directory = os.path.dirname(path)
+	handle, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+	try:
+		with os.fdopen(handle, "wb") as f:
+			f.write(data)
+		replaceFile(temporary, path)
+	except Exception:
+		if os.path.exists(temporary):
+			os.remove(temporary)
+		raise
+
+
+def ensureDirectory(directory):
+	if not os.path.isdir(directory):
+		try:
+			os.makedirs(directory)
+		except OSError:
+			# another thread got there first
+			if not os.path.isdir(directory):
+				raise
+
+
+def replaceFile(source, destination):
+	# sources are mostly mkstemp files, give them the usual mode before they go in place
+	os.chmod(source, FILE_MODE)
+	# os.rename won't replace an existing file on Windows
+	if os.name == "nt" and os.path.exists(destination):
+		os.remove(destination)
+	os.rename(source, destination)
+
+
+class Manifest(object):
+	# which cache key each file in a sounds directory was installed from
+
+	def __init__(self, directory):
+		self.path = os.path.join(directory, MANIFEST_NAME)
+		self.entries = {}
+		self.changed = False
+		if os.path.exists(self.path):
+			with open(self.path) as f:
+				self.entries = json.load(f)
+
+	def current(self, fileName, key):
+		return self.entries.get(fileName) == key
+
+	def set(self, fileName, key):
+		if self.entries.get(fileName) != key:
+			self.entries[fileName] = key
+			self.changed = True
+
+	def save(self):
+		if self.changed:
+			writeAtomically(self.path, json.dumps(self.entries, indent=1, sort_keys=True))
+			self.changed = False
+
+
+class AssetCache(object):
+
+	def __init__(self, root):
+		self.root = root
+		self.hits = 0
+		self.misses = 0
+		self.stored = 0
+		self.installed = 0
+
+	def entry(self, key):
+		return os.path.join(self.root, key[:2], key)
+
+	def path(self, key, asset):
+		return os.path.join(self.entry(key), ASSETS[asset][0])
+
+	def has(self, key, asset):
+		return os.path.exists(self.path(key, asset))
+
+	def lookup(self, key, asset):
+		# path of the cached asset, None if there is none
+		path = self.path(key, asset)
+		if os.path.exists(path):
+			self.hits += 1
+			return path
+		self.misses += 1
+		return None
+
+	def prepare(self, key, meta):
+		directory = self.entry(key)
+		ensureDirectory(directory)
+		metaPath = os.path.join(directory, "meta.json")
+		if meta is not None and not os.path.exists(metaPath):
+			writeAtomically(metaPath, json.dumps(meta, indent=1, sort_keys=True))
+
+	def storeData(self, key, asset, data, meta=None):
+		self.prepare(key, meta)
+		path = self.path(key, asset)
+		if not os.path.exists(path):
+			writeAtomically(path, data)
+			self.stored += 1
+		return path
+
+	def store(self, key, asset, source, meta=None):
+		# copies source in; an asset already cached under key is kept as it is
+		self.prepare(key, meta)
+		path = self.path(key, asset)
+		if not os.path.exists(path):
+			handle, temporary = tempfile.mkstemp(dir=self.entry(key), prefix=".tmp-")
+			os.close(handle)
+			try:
+				shutil.copyfile(source, temporary)
+				replaceFile(temporary, path)
+			except Exception:
+				if os.path.exists(temporary):
+					os.remove(temporary)
+				raise
+			self.stored += 1
+		return path
+
+	def install(self, key, asset, directory, name, manifest):
+		# copies the cached asset to <directory>/<name><extension> unless the manifest says it
+		# is already there; returns True if the file was written
+		fileName = name + ASSETS[asset][1]
+		destination = os.path.join(directory, fileName)
+		if manifest.current(fileName, key) and os.path.exists(destination):
+			return False
+		handle, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+		os.close(handle)
+		try:
+			shutil.copyfile(self.path(key, asset), temporary)
+			replaceFile(temporary, destination)
+		except Exception:
+			if os.path.exists(temporary):
+				os.remove(temporary)
+			raise
+		manifest.set(fileName, key)
+		self.installed += 1
+		return True
+
+	def keys(self):
+		if not os.path.isdir(self.root):
+			return
+		for prefix in sorted(os.listdir(self.root)):
+			directory = os.path.join(self.root, prefix)
+			if len(prefix) == 2 and os.path.isdir(directory):
+				for key in sorted(os.listdir(directory)):
+					yield key
+
+	def prune(self, keep):
+		# removes every entry not in keep, returns how many went
+		removed = 0
+		for key in list(self.keys()):
+			if key not in keep:
+				shutil.rmtree(self.entry(key))
+				removed += 1
+		return removed
+
+	def summary(self):
+		return "hits: %d  misses: %d  stored: %d  installed: %d" % (self.hits, self.misses, self.stored, self.installed)
+
+
+def utteranceMeta(text, voice, name):
+	return {"text": text, "voice": voice, "version": PIPELINE_VERSION, "name": name, "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def main():
+	# imported here so the cache itself doesn't need the vhmsg layer
+	from speechpipeline import tts
+
+	parser = optparse.OptionParser(usage="%prog status|collect|restore|prune [options]")
+	parser.add_option("--utterances", default="utterances.txt")
+	parser.add_option("--sounds", default=tts.SOUNDS_DIR)
+	parser.add_option("--cache", default=tts.CACHE_DIR)
+	parser.add_option("--voice", default=tts.VOICE)
+	parser.add_option("--xml", default=None, help="actorxml export to collect the FaceFX analysis from, default <sounds>\\robot.xml")
+	options, args = parser.parse_args()
+	if len(args) != 1 or args[0] not in ("status", "collect", "restore", "prune"):
+		parser.error("expected one of status, collect, restore, prune")
+	command = args[0]
+
+	try:
+		utterances = tts.readUtterances(options.utterances)
+	except (IOError, ValueError), e:
+		parser.error(str(e))
+	cache = AssetCache(options.cache)
+	keys = dict((name, cacheKey(text, options.voice)) for text, name in utterances)
+
+	if command == "status":
+		complete = 0
+		for text, name in utterances:
+			missing = [asset for asset in sorted(ASSETS) if not cache.has(keys[name], asset)]
+			if missing:
+				print "%-30s %s  missing %s" % (name, keys[name][:12], ", ".join(missing))
+			else:
+				complete += 1
+		print "%d of %d utterances fully cached" % (complete, len(utterances))
+
+	elif command == "collect":
+		# after a FaceFX/VisemeScheduler run: keep each utterance's analysis and BML
+		texts = dict((name, text) for text, name in utterances)
+		xmlPath = options.xml or os.path.join(options.sounds, "robot.xml")
+		manifest = Manifest(options.sounds)
+		collected = 0
+		for name, element in actorxml.iterAnimations(xmlPath):
+			if name not in keys:
+				continue
+			meta = utteranceMeta(texts[name], options.voice, name)
+			cache.storeData(keys[name], "facefx", actorxml.animationXml(element), meta)
+			bmlPath = os.path.join(options.sounds, name + ".bml")
+			if os.path.exists(bmlPath):
+				cache.store(keys[name], "bml", bmlPath, meta)
+				manifest.set(name + ".bml", keys[name])
+			collected += 1
+		manifest.save()
+		print "collected %d animations from %s" % (collected, xmlPath)
+		print cache.summary()
+
+	elif command == "restore":
+		manifest = Manifest(options.sounds)
+		for text, name in utterances:
+			for asset in ("wav", "txt", "bml"):
+				if cache.has(keys[name], asset):
+					cache.install(keys[name], asset, options.sounds, name, manifest)
+		manifest.save()
+		print cache.summary()
+
+	elif command == "prune":
+		print "removed %d entries no longer in %s" % (cache.prune(set(keys.values())), options.utterances)
+
+
+if __name__ == "__main__":
+	main()
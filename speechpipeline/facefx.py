@@ -0,0 +1,213 @@
+import multiprocessing
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from speechpipeline import actorxml
+
+# Running FaceFX Studio's phoneme analysis and the VisemeScheduler from Python, the two tools
+# createbml.bat drives. Analysis goes through a generated .fxl batch script, as in
+# tools\VisemeSchedulerFacefx\example_batch.fxl: load the actor, analyze a directory of
+# .wav/.txt pairs, export everything as actorxml.
+#
+# One FaceFX process analyzes on one core, so the utterances are split into shards, each with
+# its own directory, .fxl and FaceFX process, all running at once; the shards' exports are then
+# merged into a single actorxml file. Shards are balanced by audio size. As a drop-in for the
+# first step of createbml.bat:
+#
+#   python -m speechpipeline.facefx C:\...\SmartBody\data\sounds --out C:\...\sounds\robot.xml --shards 8
+#
+# --analyzer takes a stand-in for FaceFX Studio (speechpipeline/stubanalyzer.py) to try this
+# without it.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS_DIR = os.path.join(REPO_DIR, "tools")
+FACEFX_STUDIO = os.path.join(TOOLS_DIR, "facefx", "facefx-studio.com")
+ACTOR = os.path.join(TOOLS_DIR, "VisemeSchedulerFacefx", "example.facefx")
+VISEME_SCHEDULER = os.path.join(TOOLS_DIR, "VisemeSchedulerFacefx", "VisemeSchedulerFacefxd.exe")
+
+FXL_TEMPLATE = """print -m "Starting Batch Process"
+loadActor -file "%(actor)s"
+analyze -dir "%(audio)s"
+actorxml -file "%(export)s"
+"""
+
+
+class AnalysisError(Exception):
+	pass
+
+
+def command(path):
+	# the command line that runs a tool; .py tools (stand-ins for testing) run under this python
+	if path.endswith(".py"):
+		return [sys.executable, path]
+	return [path]
+
+
+def toolPath(path):
+	# tools run with a work directory of their own, so a relative path to one has to be made
+	# absolute first; a bare name ("facefx-studio") is left for PATH to find
+	if os.path.dirname(path) or os.path.exists(path):
+		return os.path.abspath(path)
+	return path
+
+
+def writeFxl(path, actor, audioDir, exportPath):
+	with open(path, "w") as f:
+		f.write(FXL_TEMPLATE % {"actor": actor, "audio": audioDir, "export": exportPath})
+
+
+def stage(items, audioDir):
+	# copies each (name, wav, txt) into audioDir as name.wav/name.txt, the names FaceFX gives
+	# the animations
+	if not os.path.isdir(audioDir):
+		os.makedirs(audioDir)
+	for name, wavPath, txtPath in items:
+		shutil.copyfile(wavPath, os.path.join(audioDir, name + ".wav"))
+		shutil.copyfile(txtPath, os.path.join(audioDir, name + ".txt"))
+
+
+def soundItems(directory):
+	# (name, wav, txt) for every .wav in directory with a .txt next to it
+	items = []
+	for fileName in sorted(os.listdir(directory)):
+		name, extension = os.path.splitext(fileName)
+		txtPath = os.path.join(directory, name + ".txt")
+		if extension.lower() == ".wav" and os.path.exists(txtPath):
+			items.append((name, os.path.join(directory, fileName), txtPath))
+	return items
+
+
+def partition(items, count):
+	# splits items into at most count shards of about the same total audio size, largest first
+	# onto the lightest shard
+	count = max(1, min(count, len(items)))
+	shards = [[] for i in range(count)]
+	loads = [0] * count
+	for item in sorted(items, key=lambda item: -os.path.getsize(item[1])):
+		lightest = loads.index(min(loads))
+		shards[lightest].append(item)
+		loads[lightest] += os.path.getsize(item[1])
+	return [sorted(shard) for shard in shards if shard]
+
+
+class Shard(object):
+
+	def __init__(self, index, items, workDir):
+		self.index = index
+		self.items = items
+		# absolute: the analyzer runs in this directory
+		self.directory = os.path.join(os.path.abspath(workDir), "shard-%02d" % index)
+		self.audioDir = os.path.join(self.directory, "audio")
+		self.fxlPath = os.path.join(self.directory, "analyze.fxl")
+		self.exportPath = os.path.join(self.directory, "actor.xml")
+		self.logPath = os.path.join(self.directory, "analyze.log")
+		self.process = None
+		self.log = None
+		self.started = None
+		self.seconds = None
+		self.error = None
+
+	def start(self, analyzer, actor):
+		stage(self.items, self.audioDir)
+		writeFxl(self.fxlPath, actor, self.audioDir, self.exportPath)
+		self.log = open(self.logPath, "w")
+		self.started = time.time()
+		try:
+			self.process = subprocess.Popen(command(analyzer) + ["-exec", self.fxlPath], stdout=self.log, stderr=subprocess.STDOUT,
+				cwd=self.directory)
+		except OSError, e:
+			self.log.close()
+			self.error = "could not run %s: %s" % (analyzer, e)
+
+	def wait(self):
+		if self.process is not None:
+			status = self.process.wait()
+			self.seconds = time.time() - self.started
+			self.log.close()
+			if status != 0 or not os.path.exists(self.exportPath):
+				self.error = "analyzer exited with %d, see %s" % (status, self.logPath)
+		return self.error is None
+
+
+def analyzeSharded(items, workDir, shards=None, analyzer=FACEFX_STUDIO, actor=ACTOR):
+	# analyzes the (name, wav, txt) items with up to shards FaceFX processes at once (default
+	# one per core); returns the Shards, each with its exportPath or error
+	if shards is None:
+		shards = multiprocessing.cpu_count()
+	# every shard runs in its own directory, and the actor path goes into the FXL as it is
+	analyzer = toolPath(analyzer)
+	actor = os.path.abspath(actor)
+	running = [Shard(index, part, workDir) for index, part in enumerate(partition(items, shards))]
+	for shard in running:
+		shard.start(analyzer, actor)
+	for shard in running:
+		shard.wait()
+	return running
+
+
+def analyze(items, workDir, analyzer=FACEFX_STUDIO, actor=ACTOR):
+	# analyzes the (name, wav, txt) items in one FaceFX run, returns the actorxml export's path
+	shard = analyzeSharded(items, workDir, 1, analyzer, actor)[0]
+	if shard.error is not None:
+		raise AnalysisError(shard.error)
+	return shard.exportPath
+
+
+def schedule(xmlPath, name, outputPath, scheduler=VISEME_SCHEDULER):
+	# VisemeScheduler <facefx .xml> <animation> <.bml.txt>: the BML for one animation
+	scheduler = toolPath(scheduler)
+	outputPath = os.path.abspath(outputPath)
+	workDir = os.path.dirname(outputPath)
+	process = subprocess.Popen(command(scheduler) + [os.path.abspath(xmlPath), name, outputPath], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+		cwd=workDir)
+	output = process.communicate()[0]
+	if process.returncode != 0 or not os.path.exists(outputPath):
+		raise AnalysisError("%s failed for %s (%d): %s" % (scheduler, name, process.returncode, output.strip()[-300:]))
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options] <sounds directory>")
+	parser.add_option("--out", default=None, help="merged actorxml export, default <sounds directory>\\robot.xml")
+	parser.add_option("--shards", type="int", default=multiprocessing.cpu_count(), help="FaceFX processes at once, default one per core")
+	parser.add_option("--analyzer", default=FACEFX_STUDIO)
+	parser.add_option("--actor", default=ACTOR)
+	parser.add_option("--keep", action="store_true", help="keep the shard directories")
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("expected the sounds directory")
+	items = soundItems(args[0])
+	if not items:
+		parser.error("no .wav with a .txt next to it in %s" % args[0])
+	output = options.out or os.path.join(args[0], "robot.xml")
+
+	workDir = tempfile.mkdtemp(prefix="facefx-")
+	keep = True
+	started = time.time()
+	try:
+		shards = analyzeSharded(items, workDir, options.shards, options.analyzer, options.actor)
+		analyzed = time.time() - started
+		for shard in shards:
+			if shard.error is None:
+				print "shard %d: %d files in %.1f s" % (shard.index, len(shard.items), shard.seconds)
+			else:
+				print "shard %d: %s" % (shard.index, shard.error)
+		exports = [shard.exportPath for shard in shards if shard.error is None]
+		count = actorxml.mergeExports(exports, output) if exports else 0
+		# a failed shard's directory (and log) stays for a look
+		keep = options.keep or len(exports) < len(shards)
+	finally:
+		if not keep:
+			shutil.rmtree(workDir, ignore_errors=True)
+	print "%d animations from %d shards in %s (analysis %.1f s, total %.1f s)" % (count, len(shards), output, analyzed,
+		time.time() - started)
+	if len(exports) < len(shards):
+		raise SystemExit(1)
+
+
+if __name__ == "__main__":
+	main()
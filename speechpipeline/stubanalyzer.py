@@ -0,0 +1,111 @@
+import os
+import re
+import sys
+import wave
+from xml.sax.saxutils import escape, quoteattr
+
+# A stand-in for facefx-studio.com for trying the pipeline without FaceFX: takes the same
+# "-exec <script.fxl>" and understands the three lines speechpipeline/facefx.py writes
+# (loadActor, analyze -dir, actorxml -file). Every .wav/.txt pair in the analyzed directory gets
+# an <animation> with words spread evenly over the audio, a phoneme per letter and a couple of
+# curves; nothing in it is real lip sync.
+#
+# STUB_ANALYZER_DELAY (seconds, default 0) keeps a core busy for that long per file, the way
+# the real analysis does, to see what sharding buys:
+#
+#   set STUB_ANALYZER_DELAY=0.5
+#   python -m speechpipeline.facefx sounds --analyzer speechpipeline\stubanalyzer.py --shards 1
+
+# letters -> FaceFX phoneme names, close enough for made-up data
+PHONEMES = {
+	"a": "AA", "b": "B", "c": "K", "d": "D", "e": "EH", "f": "F", "g": "G", "h": "H", "i": "IY", "j": "JH",
+	"k": "K", "l": "L", "m": "M", "n": "N", "o": "OW", "p": "P", "q": "K", "r": "R", "s": "S", "t": "T",
+	"u": "UW", "v": "V", "w": "W", "x": "K", "y": "Y", "z": "Z",
+}
+CURVES = ("Blink", "Eyebrow Raise", "FF", "LL", "open")
+
+
+def cpuTime():
+	times = os.times()
+	return times[0] + times[1]
+
+
+def busy(seconds):
+	# burns that much cpu time rather than sleeping, so shards compete for cores like the real
+	# analyzer does
+	deadline = cpuTime() + seconds
+	count = 0
+	while cpuTime() < deadline:
+		for i in range(1000):
+			count += i * i
+	return count
+
+
+def duration(path):
+	try:
+		audio = wave.open(path, "rb")
+		try:
+			return audio.getnframes() / float(audio.getframerate() or 1)
+		finally:
+			audio.close()
+	except (wave.Error, EOFError, IOError):
+		return 1.0
+
+
+def animation(name, text, seconds):
+	words = text.split() or [""]
+	step = seconds / len(words)
+	phonemes = []
+	wordTags = []
+	for index, word in enumerate(words):
+		start = index * step
+		wordTags.append("<word start=\"%.4f\" end=\"%.4f\">%s</word>" % (start, start + step, escape(word)))
+		letters = [letter for letter in word.lower() if letter in PHONEMES] or ["SIL"]
+		for position, letter in enumerate(letters):
+			phoneme = PHONEMES.get(letter, letter)
+			phonemeStart = start + position * step / len(letters)
+			phonemes.append("<phoneme phoneme=\"%s\" start=\"%.4f\" end=\"%.4f\"/>" % (phoneme, phonemeStart,
+				phonemeStart + step / len(letters)))
+	curves = []
+	for curve in CURVES:
+		keys = " ".join("%.4f %.4f 0.0000 0.0000" % (seconds * i / 4.0, (i % 2) * 0.8) for i in range(5))
+		curves.append("<curve name=%s num_keys=\"5\" owner=\"analysis\">%s</curve>" % (quoteattr(curve), keys))
+	return "<animation name=%s>\n<phonemes>\n%s\n</phonemes>\n<words>\n%s\n</words>\n<curves>\n%s\n</curves>\n</animation>" % (
+		quoteattr(name), "\n".join(phonemes), "\n".join(wordTags), "\n".join(curves))
+
+
+def main():
+	if "-exec" not in sys.argv[1:-1]:
+		print "usage: stubanalyzer.py -exec <script.fxl>"
+		sys.exit(2)
+	with open(sys.argv[sys.argv.index("-exec") + 1]) as f:
+		script = f.read()
+	actor = re.search(r'loadActor -file "([^"]*)"', script)
+	audio = re.search(r'analyze -dir "([^"]*)"', script)
+	export = re.search(r'actorxml -file "([^"]*)"', script)
+	if not (audio and export):
+		print "the script needs analyze -dir and actorxml -file"
+		sys.exit(2)
+	delay = float(os.environ.get("STUB_ANALYZER_DELAY", "0"))
+	actorName = os.path.splitext(os.path.basename(actor.group(1)))[0] if actor else "actor"
+
+	animations = []
+	for fileName in sorted(os.listdir(audio.group(1))):
+		name, extension = os.path.splitext(fileName)
+		txtPath = os.path.join(audio.group(1), name + ".txt")
+		if extension.lower() != ".wav" or not os.path.exists(txtPath):
+			continue
+		with open(txtPath) as f:
+			text = f.read().strip()
+		busy(delay)
+		animations.append(animation(name, text, duration(os.path.join(audio.group(1), fileName))))
+		print "analyzed %s" % fileName
+
+	with open(export.group(1), "w") as f:
+		f.write("<actor name=%s>\n<face_graph>\n<bones>\n<bone name=\"root\">0 0 0</bone>\n</bones>\n</face_graph>\n" % quoteattr(actorName))
+		f.write("<animation_groups>\n<animation_group name=\"Default\">\n%s\n</animation_group>\n</animation_groups>\n</actor>\n" %
+			"\n".join(animations))
+
+
+if __name__ == "__main__":
+	main()
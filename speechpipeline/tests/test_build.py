@@ -0,0 +1,116 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import wave
+
+# Build tests: the whole DAG against a fake TTS relay on a FakeBroker, the stub analyzer and
+# the python BML scheduler, so nothing from the toolkit has to be installed.
+#
+#   python -m unittest discover -s speechpipeline\tests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from speechpipeline import build, cache, tts
+from vhmsgclient import backends, client
+
+STUB_ANALYZER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "stubanalyzer.py")
+UTTERANCES = [("hello there", "u00"), ("how are you today", "u01"), ("goodbye for now", "u02")]
+
+
+def writeWav(path, seconds=0.5, rate=16000):
+	audio = wave.open(path, "wb")
+	try:
+		audio.setnchannels(1)
+		audio.setsampwidth(2)
+		audio.setframerate(rate)
+		audio.writeframes(struct.pack("<h", 0) * int(seconds * rate))
+	finally:
+		audio.close()
+
+
+class FakeRelay(object):
+	# answers RemoteSpeechCmd the way TtsRelay does: the wav into its cache directory, then OK
+
+	def __init__(self, broker, cacheDir):
+		self.cacheDir = cacheDir
+		self.requests = 0
+		self.vh = client.VhmsgClient(broker.connection(), node="relay")
+		self.vh.subscribe("RemoteSpeechCmd", self.speak)
+		self.vh.start()
+
+	def speak(self, op, args):
+		# speak <character> <message id> <voice> <audio path> <xml>
+		command, character, msgId, voice, audioPath, xml = args.split(" ", 5)
+		self.requests += 1
+		name = os.path.splitext(os.path.basename(audioPath))[0]
+		writeWav(os.path.join(self.cacheDir, name + ".wav"))
+		self.vh.send("RemoteSpeechReply %s %s OK: <xml/>" % (character, msgId))
+
+	def stop(self):
+		self.vh.stop()
+
+
+class BuildTest(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp(prefix="buildtest-")
+		self.soundsDir = os.path.join(self.root, "sounds")
+		self.relayDir = os.path.join(self.root, "relay")
+		os.makedirs(self.relayDir)
+		self.broker = backends.FakeBroker()
+		self.relay = FakeRelay(self.broker, self.relayDir)
+		self.assetCache = cache.AssetCache(os.path.join(self.root, "cache"))
+
+	def tearDown(self):
+		self.relay.stop()
+		shutil.rmtree(self.root, ignore_errors=True)
+
+	def build(self, buildDir, force=False):
+		def speech():
+			vh = client.VhmsgClient(self.broker.connection(), node="build")
+			return tts.SpeechBatch(vh.start(), self.soundsDir, voice=tts.VOICE, relayCacheDir=self.relayDir,
+				timeout=5.0, fileWait=1.0, assetCache=self.assetCache)
+		pipeline = build.SpeechPipeline(self.soundsDir, os.path.join(self.root, buildDir), tts.VOICE, self.assetCache, speech,
+			STUB_ANALYZER, scheduler=None, shards=1)
+		builder = build.Builder(pipeline.nodes(UTTERANCES), build.BuildState(os.path.join(self.root, buildDir, build.STATE_NAME)),
+			force=force)
+		try:
+			builder.run()
+		finally:
+			pipeline.close()
+		self.assertEqual(builder.errors, {})
+		return builder
+
+	def mtimes(self):
+		return dict((name, os.path.getmtime(os.path.join(self.soundsDir, name))) for name in os.listdir(self.soundsDir))
+
+	def testSecondBuildHitsTheCache(self):
+		self.build("build")
+		self.assertEqual(self.relay.requests, len(UTTERANCES))
+		manifest = cache.Manifest(self.soundsDir)
+		for text, name in UTTERANCES:
+			self.assertTrue(manifest.current(name + ".wav", cache.cacheKey(text, tts.VOICE)), name)
+		before = self.mtimes()
+		# a fresh build directory knows nothing, so every wav step runs again and has to come
+		# from the cache, leaving the files in the sounds directory alone
+		self.assetCache.installed = 0
+		builder = self.build("rebuild")
+		self.assertEqual(self.relay.requests, len(UTTERANCES))
+		self.assertEqual(self.assetCache.installed, 0)
+		self.assertEqual([builder.status[node] for node in builder.nodes if node.kind == "wav"], ["built"] * len(UTTERANCES))
+		after = self.mtimes()
+		for text, name in UTTERANCES:
+			self.assertEqual(after[name + ".wav"], before[name + ".wav"], name)
+
+	def testForcedBuildKeepsCachedAudio(self):
+		self.build("build")
+		self.build("build", force=True)
+		self.assertEqual(self.relay.requests, len(UTTERANCES))
+		self.assertEqual(sorted(name for name in os.listdir(self.soundsDir) if name.endswith(".bml")),
+			[name + ".bml" for text, name in UTTERANCES])
+
+
+if __name__ == "__main__":
+	unittest.main()
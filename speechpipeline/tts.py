@@ -0,0 +1,262 @@
+import itertools
+import optparse
+import os
+import shutil
+import sys
+import threading
+import time
+from xml.sax.saxutils import escape
+
+# Batch text to speech through TtsRelay. Every line of utterances.txt ("utterance<tab>filename")
+# becomes a RemoteSpeechCmd with its own message id and output file, so several can be in flight
+# at once; a bounded pool of workers each sends one, waits for the matching RemoteSpeechReply
+# instead of a fixed sleep, then moves the relay's wav into the SmartBody sounds directory next
+# to a .txt with the utterance. Failed or timed out utterances are retried with a fresh id.
+#
+#   python TexttoAudioFile.py --workers 8
+#   python -m speechpipeline.tts --utterances utterances.txt --sounds C:\...\SmartBody\data\sounds
+#
+# How many workers pay off depends on the relay: the Microsoft voices synthesize in parallel,
+# a single-threaded relay just queues the requests (still without the idle waits).
+#
+# With a cache (speechpipeline/cache.py, on by default) lines whose text and voice were
+# generated before are copied from there instead, and unchanged files aren't touched at all.
+
+VHMSG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vhmsg", "vhmsg-py")
+if VHMSG_PATH not in sys.path:
+	sys.path.append(VHMSG_PATH)
+from vhmsgclient import backends, client
+from speechpipeline import cache
+
+CHARACTER = "ChrBrad"
+VOICE = "Microsoft|Zira|Desktop"
+# where TtsRelay writes its audio, and the same directory as RemoteSpeechCmd names it (relative
+# to the relay)
+RELAY_CACHE_DIR = r"C:\vhtoolkit\data\cache\audio"
+RELAY_CACHE_PATH = "../../data/cache/audio"
+SOUNDS_DIR = r"C:\Users\SENRYAKU\Documents\SmartBody\data\sounds"
+CACHE_DIR = os.path.join(os.path.dirname(SOUNDS_DIR), "speechcache")
+DEFAULT_WORKERS = 4
+# seconds to wait for a reply before the attempt counts as failed
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_RETRIES = 2
+# seconds to wait for the wav to appear after an OK reply
+FILE_WAIT = 5.0
+
+
+class SpeechError(Exception):
+	pass
+
+
+def readUtterances(path):
+	# [(text, name)], in file order
+	utterances = []
+	names = {}
+	with open(path) as f:
+		for number, line in enumerate(f, 1):
+			line = line.rstrip("\r\n")
+			if not line.strip():
+				continue
+			fields = line.split("\t")
+			if len(fields) < 2 or not fields[1].strip():
+				raise ValueError("%s:%d: expected 'utterance<tab>filename'" % (path, number))
+			name = fields[1].strip()
+			if name in names:
+				raise ValueError("%s:%d: %s is already used on line %d" % (path, number, name, names[name]))
+			names[name] = number
+			utterances.append((fields[0], name))
+	return utterances
+
+
+def speechCommand(character, msgId, voice, audioPath, text):
+	return ("RemoteSpeechCmd speak %s %s %s %s <?xml version=\"1.0\" encoding=\"utf-16\"?><speech id=\"sp1\" ref=\"Anybody-1\" "
+		"type=\"application/ssml+xml\"> %s </speech>") % (character, msgId, voice, audioPath, escape(text))
+
+
+class Result(object):
+	__slots__ = ("name", "text", "ok", "cached", "attempts", "seconds", "error")
+
+	def __init__(self, name, text):
+		self.name = name
+		self.text = text
+		self.ok = False
+		self.cached = False
+		self.attempts = 0
+		self.seconds = 0.0
+		self.error = None
+
+
+class SpeechBatch(object):
+
+	def __init__(self, vh, soundsDir=SOUNDS_DIR, character=CHARACTER, voice=VOICE, relayCacheDir=RELAY_CACHE_DIR,
+			relayCachePath=RELAY_CACHE_PATH, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+			fileWait=FILE_WAIT, runId=None, assetCache=None):
+		self.client = vh
+		self.soundsDir = soundsDir
+		self.character = character
+		self.voice = voice
+		self.relayCacheDir = relayCacheDir
+		self.relayCachePath = relayCachePath
+		self.workers = workers
+		self.timeout = timeout
+		self.retries = retries
+		self.fileWait = fileWait
+		self.runId = runId or time.strftime("%Y%m%d_%H%M%S")
+		self.lock = threading.Lock()
+		self.ids = itertools.count(1)
+		self.assetCache = assetCache
+		self.manifest = None
+		if assetCache is not None:
+			cache.ensureDirectory(soundsDir)
+			self.manifest = cache.Manifest(soundsDir)
+
+	def nextId(self):
+		with self.lock:
+			return next(self.ids)
+
+	def generate(self, text, name):
+		# one attempt: ask the relay, wait for its reply and collect the wav
+		number = self.nextId()
+		msgId = "%s_%d" % (self.runId, number)
+		audioName = "utt_%s_%s_%d" % (self.runId, self.character, number)
+		command = speechCommand(self.character, msgId, self.voice, "%s/%s.aiff" % (self.relayCachePath, audioName), text)
+		expected = [self.character, msgId]
+		reply = self.client.request(command, "RemoteSpeechReply", lambda args: args.split(None, 2)[:2] == expected,
+			self.timeout).result()
+		fields = reply.split(None, 2)
+		if len(fields) < 3 or not fields[2].startswith("OK"):
+			raise SpeechError("relay failed: %s" % reply[:200])
+
+		source = os.path.join(self.relayCacheDir, audioName + ".wav")
+		deadline = time.time() + self.fileWait
+		while not (os.path.exists(source) and os.path.getsize(source)):
+			if time.time() >= deadline:
+				raise SpeechError("the relay answered OK but %s never appeared" % source)
+			time.sleep(0.05)
+		cache.ensureDirectory(self.soundsDir)
+		shutil.move(source, os.path.join(self.soundsDir, name + ".wav"))
+		with open(os.path.join(self.soundsDir, name + ".txt"), "w") as f:
+			f.write(text)
+		if self.assetCache is not None:
+			key = cache.cacheKey(text, self.voice)
+			meta = cache.utteranceMeta(text, self.voice, name)
+			self.assetCache.store(key, "wav", os.path.join(self.soundsDir, name + ".wav"), meta)
+			self.assetCache.storeData(key, "txt", text)
+			self.manifest.set(name + ".wav", key)
+			self.manifest.set(name + ".txt", key)
+
+	def installCached(self, text, name):
+		# True if the audio came from the cache (or was already in place)
+		key = cache.cacheKey(text, self.voice)
+		if self.assetCache.lookup(key, "wav") is None:
+			return False
+		self.assetCache.storeData(key, "txt", text)
+		self.assetCache.install(key, "wav", self.soundsDir, name, self.manifest)
+		self.assetCache.install(key, "txt", self.soundsDir, name, self.manifest)
+		return True
+
+	def process(self, text, name):
+		result = Result(name, text)
+		started = time.time()
+		if self.assetCache is not None:
+			try:
+				result.cached = result.ok = self.installCached(text, name)
+			except EnvironmentError, e:
+				result.error = "cache: %s" % e
+			if result.ok:
+				return result
+		while result.attempts <= self.retries:
+			if result.attempts:
+				time.sleep(min(0.5 * 2 ** (result.attempts - 1), 5.0))
+			result.attempts += 1
+			try:
+				self.generate(text, name)
+			except (client.VhmsgError, SpeechError, EnvironmentError), e:
+				result.error = str(e) or e.__class__.__name__
+				continue
+			result.ok = True
+			result.error = None
+			break
+		result.seconds = time.time() - started
+		return result
+
+	def run(self, utterances, report=None):
+		# report(result) is called from the workers as each utterance finishes
+		jobs = list(enumerate(utterances))
+		jobs.reverse()
+		results = [None] * len(utterances)
+
+		def work():
+			while True:
+				with self.lock:
+					if not jobs:
+						return
+					index, (text, name) = jobs.pop()
+				results[index] = self.process(text, name)
+				if report is not None:
+					report(results[index])
+
+		threads = [threading.Thread(target=work, name="SpeechBatch-%d" % i) for i in range(max(1, min(self.workers, len(jobs))))]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		for thread in threads:
+			thread.join()
+		if self.manifest is not None:
+			self.manifest.save()
+		return results
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--utterances", default="utterances.txt", help="utterance<tab>filename per line")
+	parser.add_option("--sounds", default=SOUNDS_DIR, help="SmartBody sounds directory the .wav and .txt files go to")
+	parser.add_option("--relay-cache", dest="relayCache", default=RELAY_CACHE_DIR, help="directory TtsRelay writes its audio to")
+	parser.add_option("--character", default=CHARACTER)
+	parser.add_option("--voice", default=VOICE)
+	parser.add_option("--workers", type="int", default=DEFAULT_WORKERS, help="speech requests in flight at once")
+	parser.add_option("--timeout", type="float", default=DEFAULT_TIMEOUT, help="seconds to wait for each reply")
+	parser.add_option("--retries", type="int", default=DEFAULT_RETRIES)
+	parser.add_option("--cache", default=CACHE_DIR, help="content-addressed cache of generated audio (see speechpipeline/cache.py)")
+	parser.add_option("--no-cache", dest="cache", action="store_const", const=None, help="always ask the relay")
+	parser.add_option("--broker", default=None, help="host:port of a STOMP broker, default vhmsg_python on localhost")
+	options, args = parser.parse_args()
+
+	try:
+		utterances = readUtterances(options.utterances)
+	except (IOError, ValueError), e:
+		parser.error(str(e))
+	if options.broker:
+		host, port = options.broker.rsplit(":", 1)
+		vh = client.VhmsgClient(backends.StompBackend(), host, port=port)
+	else:
+		vh = client.VhmsgClient()
+	vh.start()
+
+	printLock = threading.Lock()
+	def report(result):
+		with printLock:
+			if result.cached:
+				print "%s.wav (cached)" % result.name
+			elif result.ok:
+				print "%s.wav (%.1f s, %d attempts)" % (result.name, result.seconds, result.attempts)
+			else:
+				print "%s failed after %d attempts: %s" % (result.name, result.attempts, result.error)
+
+	batch = SpeechBatch(vh, options.sounds, options.character, options.voice, options.relayCache, workers=options.workers,
+		timeout=options.timeout, retries=options.retries, assetCache=options.cache and cache.AssetCache(options.cache))
+	started = time.time()
+	try:
+		results = batch.run(utterances, report)
+	finally:
+		vh.stop()
+	failed = [result for result in results if not result.ok]
+	cached = len([result for result in results if result.cached])
+	print "%d of %d utterances generated in %.1f s, %d of them from the cache" % (len(results) - len(failed), len(results),
+		time.time() - started, cached)
+	if failed:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,123 @@
+import os
+import socket
+import struct
+import sys
+import time
+import unittest
+
+# Loopback broker tests over real sockets: a client that goes away halfway through a frame
+# must take its subscriptions with it without upsetting anyone else.
+#
+#   cd vhmsg\vhmsg-py
+#   python -m unittest discover -s tests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vhmsgclient import broker, stomp
+
+SCOPE = "DEFAULT_SCOPE"
+
+
+def waitFor(condition, timeout=2.0):
+	deadline = time.time() + timeout
+	while not condition():
+		if time.time() > deadline:
+			return False
+		time.sleep(0.01)
+	return True
+
+
+class RawClient(object):
+	# a STOMP client driven frame by frame
+
+	def __init__(self, address):
+		self.sock = socket.create_connection(address)
+		self.parser = stomp.FrameParser()
+		self.sock.sendall(stomp.encodeFrame("CONNECT", {"accept-version": "1.0"}))
+		self.expect("CONNECTED")
+
+	def subscribe(self, op):
+		self.sock.sendall(stomp.encodeFrame("SUBSCRIBE", {"destination": stomp.topicFor(SCOPE), "id": op,
+			"selector": stomp.selectorFor(op), "receipt": "sub-" + op}))
+		self.expect("RECEIPT")
+
+	def send(self, message):
+		self.sock.sendall(stomp.vhmsgFrame(SCOPE, message))
+
+	def expect(self, command, timeout=2.0):
+		self.sock.settimeout(timeout)
+		frames = []
+		while not frames:
+			frames = self.parser.feed(self.sock.recv(65536))
+		if frames[0][0] != command:
+			raise AssertionError("expected %s, got %r" % (command, frames[0]))
+		return frames[0]
+
+	def reset(self):
+		# close with a RST rather than a FIN, as a crashed process does
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+		self.sock.close()
+
+	def close(self):
+		self.sock.close()
+
+
+class DisconnectTest(unittest.TestCase):
+
+	def setUp(self):
+		self.logged = []
+		self.broker = broker.LoopbackBroker(port=0, log=self.logged.append).start()
+
+	def tearDown(self):
+		self.broker.stop()
+
+	def subscriptions(self):
+		return sum(len(subscribers) for subscribers in self.broker.topics.values())
+
+	def disconnectMidFrame(self, close):
+		listener = RawClient(self.broker.address)
+		listener.subscribe("vrSpeak")
+		leaving = RawClient(self.broker.address)
+		leaving.subscribe("vrSpeak")
+		leaving.subscribe("vrSpoke")
+		self.assertTrue(waitFor(lambda: self.subscriptions() == 3))
+		frame = stomp.vhmsgFrame(SCOPE, "vrSpeak Rachel all sp1 <xml/>")
+		leaving.sock.sendall(frame[:len(frame) // 2])
+		time.sleep(0.05)
+		close(leaving)
+		self.assertTrue(waitFor(lambda: len(self.broker.connections) == 1))
+		self.assertEqual(self.subscriptions(), 1)
+		self.assertEqual(self.broker.published, 0)
+		self.assertEqual(len(self.broker.errors), 1)
+		self.assertEqual(len(self.logged), 1)
+
+		# everyone else carries on
+		sender = RawClient(self.broker.address)
+		sender.send("vrSpeak Rachel all sp2 <xml/>")
+		command, headers, body = listener.expect("MESSAGE")
+		self.assertEqual(body, "vrSpeak Rachel all sp2 <xml/>")
+		self.assertEqual(self.broker.delivered, 1)
+		sender.close()
+		listener.close()
+		return self.broker.errors[0][2]
+
+	def testCloseMidFrame(self):
+		error = self.disconnectMidFrame(RawClient.close)
+		self.assertTrue(error.startswith("closed mid-frame"), error)
+
+	def testResetMidFrame(self):
+		error = self.disconnectMidFrame(RawClient.reset)
+		self.assertTrue("mid-frame" in error or "read failed" in error, error)
+
+	def testCleanDisconnectIsNotAnError(self):
+		client = RawClient(self.broker.address)
+		client.subscribe("vrSpeak")
+		client.sock.sendall(stomp.encodeFrame("DISCONNECT"))
+		client.close()
+		self.assertTrue(waitFor(lambda: not self.broker.connections))
+		self.assertEqual(self.subscriptions(), 0)
+		self.assertEqual(list(self.broker.errors), [])
+		self.assertEqual(self.logged, [])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import unittest
+
+# Tracing tests: one utterance through every hop of the pipeline, from speech recognition to
+# the TTS relay, has to come out as one trace with a latency for each stage.
+#
+#   cd vhmsg\vhmsg-py
+#   python -m unittest discover -s tests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vhmsgclient import backends, client, tracing
+
+# (seconds after the start, node, message) for one utterance, each hop under the id its
+# component gives it
+CHAIN = [
+	(0.000, "asr", "vrSpeech start 1 user"),
+	(0.400, "asr", "vrSpeech asr-complete 1 user"),
+	(0.650, "npceditor", "vrExpress Rachel user 7 <xml/>"),
+	(0.700, "nvbg", "vrSpeak Rachel user 7 <xml/>"),
+	(0.720, "smartbody", "RemoteSpeechCmd speak Rachel 1 voice sp.wav <speech/>"),
+	(1.100, "ttsrelay", "RemoteSpeechReply Rachel 1 OK: <xml/>"),
+	(1.150, "smartbody", "vrAgentBML Rachel 7 start"),
+	(3.000, "smartbody", "vrSpoke Rachel user 7 done"),
+]
+STAGES = ["vrSpeech -> vrExpress", "vrExpress -> vrSpeak", "vrSpeak -> RemoteSpeechCmd",
+	"RemoteSpeechCmd -> RemoteSpeechReply", "RemoteSpeechReply -> vrAgentBML", "vrAgentBML -> vrSpoke", "total"]
+
+
+def recordChain(tracer, start=100.0, chain=CHAIN):
+	for offset, node, message in chain:
+		tracer.record("send", message, node, start + offset)
+
+
+class ChainTest(unittest.TestCase):
+
+	def testEveryStageInTheHistograms(self):
+		tracer = tracing.Tracer()
+		recordChain(tracer)
+		self.assertEqual(tracer.traces().keys(), ["vrSpeech:1"])
+		histograms = tracer.histograms()
+		for stage in STAGES:
+			self.assertTrue(stage in histograms, stage)
+			self.assertEqual(histograms[stage].count, 1)
+		self.assertAlmostEqual(histograms["vrExpress -> vrSpeak"].total, 0.05)
+		self.assertAlmostEqual(histograms["vrSpeak -> RemoteSpeechCmd"].total, 0.02)
+		self.assertAlmostEqual(histograms["total"].total, 3.0)
+
+	def testSmallIdsStayApart(self):
+		# the next utterance reuses small numbers, and a character without a vrSpeak stays on its own
+		tracer = tracing.Tracer()
+		recordChain(tracer)
+		recordChain(tracer, start=200.0, chain=[(offset, node, message.replace(" 7 ", " 8 ").replace(" 1 ", " 2 "))
+			for offset, node, message in CHAIN])
+		tracer.record("send", "RemoteSpeechCmd speak Brad 5 voice b.wav <speech/>", "smartbody", 100.8)
+		traces = tracer.traces()
+		self.assertEqual(sorted(traces), ["RemoteSpeechCmd:5", "vrSpeech:1", "vrSpeech:2"])
+		self.assertEqual(len(traces["vrSpeech:1"]), len(CHAIN))
+		self.assertEqual(len(traces["vrSpeech:2"]), len(CHAIN))
+		self.assertEqual(tracer.histograms()["total"].count, 3)
+
+	def testStaleHandOffIsNotLinked(self):
+		tracer = tracing.Tracer()
+		tracer.record("send", "vrSpeech asr-complete 1 user", "asr", 100.0)
+		tracer.record("send", "vrExpress Rachel user 7 <xml/>", "npceditor", 100.0 + tracing.HANDOFF_TIMEOUT + 1)
+		self.assertEqual(sorted(tracer.traces()), ["vrSpeak:7", "vrSpeech:1"])
+
+	def testChainThroughBroker(self):
+		# the same hops sent by one client per component and seen by an observer, so every
+		# message is recorded twice and the transits show up as well
+		broker = backends.FakeBroker()
+		tracer = tracing.Tracer()
+		observer = client.VhmsgClient(broker.connection(), tracer=tracer, node="observer")
+		observer.subscribe("*", lambda op, args: None)
+		observer.start()
+		senders = {}
+		try:
+			for offset, node, message in CHAIN:
+				if node not in senders:
+					senders[node] = client.VhmsgClient(broker.connection(), tracer=tracer, node=node).start()
+				senders[node].send(message)
+				time.sleep(0.005)
+			deadline = time.time() + 2.0
+			while observer.received < len(CHAIN) and time.time() < deadline:
+				time.sleep(0.01)
+		finally:
+			for sender in senders.values():
+				sender.stop()
+			observer.stop()
+		self.assertEqual(tracer.traces().keys(), ["vrSpeech:1"])
+		histograms = tracer.histograms()
+		for stage in STAGES + ["vrExpress transit", "RemoteSpeechCmd transit"]:
+			self.assertTrue(stage in histograms, stage)
+
+
+if __name__ == "__main__":
+	unittest.main()
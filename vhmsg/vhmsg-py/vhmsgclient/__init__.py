@@ -0,0 +1 @@
+# python side of the vhmsg layer: a threaded client around vhmsg_python and local stand-ins for the broker
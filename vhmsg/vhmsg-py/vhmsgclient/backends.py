@@ -0,0 +1,274 @@
+import collections
+import select
+import socket
+import threading
+import time
+
+from vhmsgclient import stomp
+
+# Backends are what VhmsgClient drives: the vhmsg_python extension module talking to ActiveMQ,
+# StompBackend talking STOMP to ActiveMQ or the loopback broker (broker.py), or an in-process
+# FakeBroker for running scripts and tests without the toolkit. All of them expose the
+# vhmsg_python calls the client needs:
+#
+#   connect(server, scope, port)  subscribe(op)  setListener(fn)  send(message)
+#   wait(seconds)  poll()  close()
+#
+# and optionally sendBatch(messages), for backends that can put several messages on the wire
+# at once.
+#
+# Messages are "op args" strings; the listener is called with the whole string from inside
+# wait/poll, on the thread that called them. threadSafe says whether send may be called from
+# any thread (the native module may only be used from the client's pump thread).
+
+
+class BackendError(Exception):
+	pass
+
+
+class NativeBackend(object):
+	threadSafe = False
+
+	def __init__(self, module=None):
+		if module is None:
+			try:
+				import vhmsg_python as module
+			except ImportError, e:
+				raise BackendError("vhmsg_python is not available (%s); add vhmsg\\vhmsg-py to sys.path "
+					"or use a FakeBroker connection" % e)
+		self.module = module
+
+	def connect(self, server, scope, port):
+		result = self.module.connect(server, scope, str(port))
+		if result != 0:
+			raise BackendError("could not connect to %s:%s (%s), error %d" % (server, port, scope, result))
+		# queue incoming messages until wait/poll so callbacks only run on the pump thread
+		self.module.setPollingMode(1)
+		return result
+
+	def subscribe(self, op):
+		return self.module.subscribe(op)
+
+	def setListener(self, listener):
+		self.module.setListener(listener)
+
+	def send(self, message):
+		return self.module.send(message)
+
+	def wait(self, seconds):
+		return self.module.wait(seconds)
+
+	def poll(self):
+		return self.module.poll()
+
+	def close(self):
+		return self.module.close()
+
+
+class StompBackend(object):
+	# vhmsg over STOMP (see stomp.py). The port passed to connect is the STOMP port, 61613 on
+	# ActiveMQ and the loopback broker, not OpenWire's 61616. Sends are locked so any thread may
+	# send while the pump thread reads
+	threadSafe = True
+
+	def __init__(self, timeout=5.0):
+		self.timeout = timeout
+		self.sock = None
+		self.scope = None
+		self.listener = None
+		self.parser = stomp.FrameParser()
+		self.sendLock = threading.Lock()
+		# op -> subscription id; while "*" is subscribed the others are dropped so nothing
+		# arrives twice
+		self.subscriptions = {}
+		self.nextId = 0
+		self.received = 0
+
+	def connect(self, server, scope, port):
+		self.sock = socket.create_connection((server, int(port)), self.timeout)
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.scope = scope
+		self.transmit(stomp.encodeFrame("CONNECT", {"accept-version": "1.0"}))
+		deadline = time.time() + self.timeout
+		while True:
+			for command, headers, body in self.readFrames(max(0.0, deadline - time.time())):
+				if command == "CONNECTED":
+					return 0
+				if command == "ERROR":
+					raise BackendError("broker refused the connection: %s" % headers.get("message", body))
+			if time.time() >= deadline:
+				raise BackendError("no CONNECTED from %s:%s" % (server, port))
+
+	def transmit(self, data):
+		with self.sendLock:
+			self.sock.sendall(data)
+
+	def subscribe(self, op):
+		with self.sendLock:
+			if op in self.subscriptions or ("*" in self.subscriptions and op != "*"):
+				return 0
+			if op == "*":
+				for other in list(self.subscriptions):
+					self.sock.sendall(stomp.encodeFrame("UNSUBSCRIBE", {"id": self.subscriptions.pop(other)}))
+			self.nextId += 1
+			id = "sub-%d" % self.nextId
+			headers = {"destination": stomp.topicFor(self.scope), "id": id, "ack": "auto"}
+			selector = stomp.selectorFor(op)
+			if selector is not None:
+				headers["selector"] = selector
+			self.sock.sendall(stomp.encodeFrame("SUBSCRIBE", headers))
+			self.subscriptions[op] = id
+		return 0
+
+	def setListener(self, listener):
+		self.listener = listener
+
+	def send(self, message):
+		self.transmit(stomp.vhmsgFrame(self.scope, message))
+		return 0
+
+	def sendBatch(self, messages):
+		# one write for the lot
+		self.transmit("".join(stomp.vhmsgFrame(self.scope, message) for message in messages))
+		return 0
+
+	def readFrames(self, timeout):
+		if not select.select([self.sock], [], [], timeout)[0]:
+			return []
+		data = self.sock.recv(65536)
+		if not data:
+			raise BackendError("broker closed the connection")
+		return self.parser.feed(data)
+
+	def wait(self, seconds):
+		count = 0
+		timeout = seconds
+		while True:
+			frames = self.readFrames(timeout)
+			if not frames:
+				return count
+			for command, headers, body in frames:
+				if command == "MESSAGE":
+					count += 1
+					self.received += 1
+					if self.listener is not None:
+						self.listener(body)
+				elif command == "ERROR":
+					raise BackendError("broker error: %s" % headers.get("message", body))
+			# after the first batch, only take what is already waiting
+			timeout = 0
+
+	def poll(self):
+		return self.wait(0)
+
+	def close(self):
+		if self.sock is not None:
+			try:
+				self.transmit(stomp.encodeFrame("DISCONNECT"))
+			except socket.error:
+				pass
+			self.sock.close()
+			self.sock = None
+		return 0
+
+
+def matches(subscriptions, op):
+	return op in subscriptions or "*" in subscriptions
+
+
+class FakeBroker(object):
+	# in-process stand-in for ActiveMQ: every message goes to each connection in the same scope
+	# that subscribed to its op (or "*"), the sender included, as with vhmsg topics
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.connections = []
+		self.published = 0
+		self.delivered = 0
+
+	def connection(self):
+		return FakeConnection(self)
+
+	def attach(self, connection):
+		with self.lock:
+			self.connections.append(connection)
+
+	def detach(self, connection):
+		with self.lock:
+			if connection in self.connections:
+				self.connections.remove(connection)
+
+	def publish(self, scope, message):
+		op = message.split(" ", 1)[0]
+		with self.lock:
+			targets = [c for c in self.connections if c.scope == scope and matches(c.subscriptions, op)]
+			self.published += 1
+			self.delivered += len(targets)
+		for connection in targets:
+			connection.deliver(message)
+		return len(targets)
+
+
+class FakeConnection(object):
+	threadSafe = True
+
+	def __init__(self, broker):
+		self.broker = broker
+		self.scope = None
+		self.subscriptions = set()
+		self.listener = None
+		self.inbox = collections.deque()
+		self.arrived = threading.Condition(threading.Lock())
+		self.connected = False
+
+	def connect(self, server, scope, port):
+		self.scope = scope
+		self.connected = True
+		self.broker.attach(self)
+		return 0
+
+	def subscribe(self, op):
+		self.subscriptions.add(op)
+		return 0
+
+	def setListener(self, listener):
+		self.listener = listener
+
+	def send(self, message):
+		if not self.connected:
+			return -1
+		self.broker.publish(self.scope, message)
+		return 0
+
+	def deliver(self, message):
+		with self.arrived:
+			self.inbox.append(message)
+			self.arrived.notify()
+
+	def wait(self, seconds):
+		# like ttu_wait: sleep until a message arrives or the time is up, then process everything
+		deadline = time.time() + seconds
+		with self.arrived:
+			while not self.inbox:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self.arrived.wait(remaining)
+		return self.poll()
+
+	def poll(self):
+		count = 0
+		while True:
+			with self.arrived:
+				if not self.inbox:
+					break
+				message = self.inbox.popleft()
+			if self.listener is not None:
+				self.listener(message)
+			count += 1
+		return count
+
+	def close(self):
+		self.connected = False
+		self.broker.detach(self)
+		return 0
@@ -0,0 +1,179 @@
+import collections
+import threading
+import time
+
+# Batching publisher for high-rate vhmsg senders (robot telemetry, trackers). Messages are
+# queued and flushed together once maxMessages or maxBytes are pending, or the oldest has waited
+# maxDelay seconds. Messages of a state type (stateOps) coalesce: a newer one replaces the one
+# still pending, so only the latest value goes out per flush; everything else is sent in order.
+#
+# When maxPending messages are queued the publisher pushes back: with block=True publish waits
+# up to blockTimeout for a flush to make room, otherwise (or after the timeout) the new message
+# is refused and counted as dropped. publish returns False for a refused message.
+#
+#   publisher = BatchingPublisher(vh.send, vh.sendBatch, stateOps=["myrobot"]).start()
+#   publisher.publish("myrobot seq=12 ...")
+#
+# send(message) is all that's needed; sendBatch(messages), when given, puts a whole flush on the
+# wire at once (one socket write on STOMP).
+
+DEFAULT_MAX_MESSAGES = 64
+DEFAULT_MAX_BYTES = 64 * 1024
+DEFAULT_MAX_DELAY = 0.05
+DEFAULT_MAX_PENDING = 1024
+
+
+class BatchingPublisher(object):
+
+	def __init__(self, send, sendBatch=None, stateOps=(), maxMessages=DEFAULT_MAX_MESSAGES, maxBytes=DEFAULT_MAX_BYTES,
+			maxDelay=DEFAULT_MAX_DELAY, maxPending=DEFAULT_MAX_PENDING, block=False, blockTimeout=1.0, clock=time.time):
+		self.send = send
+		self.sendBatch = sendBatch
+		self.stateOps = set(stateOps)
+		self.maxMessages = maxMessages
+		self.maxBytes = maxBytes
+		self.maxDelay = maxDelay
+		self.maxPending = maxPending
+		self.block = block
+		self.blockTimeout = blockTimeout
+		self.clock = clock
+		self.lock = threading.Lock()
+		# signalled when messages are queued (for the flush thread) and after every flush
+		self.changed = threading.Condition(self.lock)
+		# held while a batch goes out so batches can't overtake each other
+		self.sending = threading.Lock()
+		# key -> message; state ops are keyed by op, other messages by a running number
+		self.pending = collections.OrderedDict()
+		self.pendingBytes = 0
+		self.oldest = None
+		self.counter = 0
+		self.thread = None
+		self.stopped = threading.Event()
+		self.started = clock()
+		self.messagesIn = 0
+		self.messagesOut = 0
+		self.coalesced = 0
+		self.dropped = 0
+		self.droppedBytes = 0
+		self.flushes = 0
+		self.bytesIn = 0
+		self.bytesOut = 0
+		self.errors = 0
+
+	def start(self):
+		# flush thread enforcing maxDelay; without it only the size thresholds and explicit
+		# flush() calls send anything
+		self.stopped.clear()
+		self.thread = threading.Thread(target=self.run, name="BatchingPublisher")
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self, timeout=1.0):
+		self.stopped.set()
+		with self.changed:
+			self.changed.notify_all()
+		if self.thread is not None:
+			self.thread.join(timeout)
+			self.thread = None
+		self.flush()
+
+	def run(self):
+		while not self.stopped.is_set():
+			with self.changed:
+				if self.oldest is None:
+					self.changed.wait(0.5)
+					continue
+				wait = self.oldest + self.maxDelay - self.clock()
+				if wait > 0:
+					self.changed.wait(wait)
+					continue
+			self.flush()
+
+	def publish(self, message):
+		op = message.split(" ", 1)[0]
+		full = False
+		with self.changed:
+			self.messagesIn += 1
+			self.bytesIn += len(message)
+			if op in self.stateOps:
+				key = op
+				replaced = self.pending.pop(key, None)
+				if replaced is not None:
+					self.coalesced += 1
+					self.pendingBytes -= len(replaced)
+			else:
+				self.counter += 1
+				key = self.counter
+				if len(self.pending) >= self.maxPending and not self.makeRoom():
+					self.dropped += 1
+					self.droppedBytes += len(message)
+					return False
+			self.pending[key] = message
+			self.pendingBytes += len(message)
+			if self.oldest is None:
+				self.oldest = self.clock()
+				self.changed.notify_all()
+			full = len(self.pending) >= self.maxMessages or self.pendingBytes >= self.maxBytes
+		if full:
+			self.flush()
+		return True
+
+	def makeRoom(self):
+		# called with the lock held
+		if not self.block:
+			return False
+		deadline = self.clock() + self.blockTimeout
+		while len(self.pending) >= self.maxPending:
+			remaining = deadline - self.clock()
+			if remaining <= 0 or self.stopped.is_set():
+				return False
+			self.changed.wait(remaining)
+		return True
+
+	def flush(self):
+		with self.sending:
+			with self.changed:
+				if not self.pending:
+					return 0
+				messages = self.pending.values()
+				self.pending.clear()
+				self.pendingBytes = 0
+				self.oldest = None
+				self.changed.notify_all()
+			try:
+				if self.sendBatch is not None:
+					self.sendBatch(messages)
+				else:
+					for message in messages:
+						self.send(message)
+			except Exception:
+				self.errors += 1
+				self.dropped += len(messages)
+				self.droppedBytes += sum(len(message) for message in messages)
+				return 0
+			self.flushes += 1
+			self.messagesOut += len(messages)
+			self.bytesOut += sum(len(message) for message in messages)
+			return len(messages)
+
+	def stats(self):
+		elapsed = max(self.clock() - self.started, 1e-9)
+		return {
+			"in": self.messagesIn,
+			"out": self.messagesOut,
+			"coalesced": self.coalesced,
+			"dropped": self.dropped,
+			"droppedBytes": self.droppedBytes,
+			"flushes": self.flushes,
+			"inRate": self.messagesIn / elapsed,
+			"outRate": self.messagesOut / elapsed,
+			# what coalescing kept off the wire; dropped messages were lost, not saved
+			"bytesSaved": self.bytesIn - self.bytesOut - self.pendingBytes - self.droppedBytes,
+			"averageBatch": float(self.messagesOut) / max(self.flushes, 1),
+		}
+
+	def summary(self):
+		stats = self.stats()
+		return ("in: %(in)d (%(inRate).1f/s)  out: %(out)d (%(outRate).1f/s)  coalesced: %(coalesced)d  dropped: %(dropped)d (%(droppedBytes)d bytes)  "
+			"flushes: %(flushes)d  average batch: %(averageBatch).1f  bytes saved: %(bytesSaved)d") % stats
@@ -0,0 +1,292 @@
+import collections
+import optparse
+import select
+import socket
+import threading
+import time
+
+from vhmsgclient import stomp
+
+# Loopback stand-in for the ActiveMQ broker, so vhmsg scripts can be run, tested and load tested
+# on a bare machine. It speaks the STOMP subset in stomp.py: CONNECT, SUBSCRIBE (with
+# MESSAGE_PREFIX selectors), UNSUBSCRIBE, SEND, DISCONNECT and receipts. Every SEND goes to each
+# subscription on the same topic (scope) whose selector takes its message type.
+#
+# Python clients reach it through backends.StompBackend. The toolkit's native programs
+# (SmartBody, NVBG, NPCEditor) use OpenWire and still need the real ActiveMQ.
+#
+#   python -m vhmsgclient.broker --port 61613
+#
+# One thread runs a select loop over every connection; output is buffered per connection and a
+# consumer that falls more than MAX_BACKLOG bytes behind is disconnected rather than allowed to
+# hold up the others.
+#
+# A connection that errors or goes away, mid-frame or not, is dropped with all its subscriptions
+# before anything else is read from it; why is kept in errors and passed to log(message) when
+# one is given (the command line prints it).
+
+DEFAULT_PORT = 61613
+MAX_BACKLOG = 8 * 1024 * 1024
+# drop reasons kept in LoopbackBroker.errors
+MAX_ERRORS = 100
+
+
+class Subscription(object):
+	__slots__ = ("connection", "id", "destination", "ops")
+
+	def __init__(self, connection, id, destination, ops):
+		self.connection = connection
+		self.id = id
+		self.destination = destination
+		# set of message types, None for all
+		self.ops = ops
+
+
+class Connection(object):
+
+	def __init__(self, sock, address):
+		self.sock = sock
+		self.address = address
+		self.parser = stomp.FrameParser()
+		self.outgoing = []
+		self.backlog = 0
+		# subscription id -> Subscription
+		self.subscriptions = {}
+		self.closing = False
+		self.dropped = False
+
+	def queue(self, data):
+		self.outgoing.append(data)
+		self.backlog += len(data)
+
+
+class LoopbackBroker(object):
+
+	def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, log=None):
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.listener.bind((host, port))
+		self.listener.listen(64)
+		self.listener.setblocking(False)
+		self.address = self.listener.getsockname()
+		self.connections = {}
+		# destination -> [Subscription]
+		self.topics = {}
+		self.stopped = threading.Event()
+		self.thread = None
+		self.published = 0
+		self.delivered = 0
+		self.slowConsumers = 0
+		self.bytesIn = 0
+		self.bytesOut = 0
+		# message type -> messages published
+		self.opCounts = {}
+		self.log = log
+		# (time, "host:port", reason) for the latest connections dropped on an error
+		self.errors = collections.deque(maxlen=MAX_ERRORS)
+		self.dropped = 0
+
+	def start(self):
+		self.thread = threading.Thread(target=self.serveForever, name="LoopbackBroker")
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self, timeout=1.0):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join(timeout)
+			self.thread = None
+
+	def serveForever(self, interval=0.05):
+		try:
+			while not self.stopped.is_set():
+				self.step(interval)
+		finally:
+			for connection in self.connections.values():
+				connection.sock.close()
+			self.connections.clear()
+			self.topics.clear()
+			self.listener.close()
+
+	def step(self, timeout):
+		socks = [connection.sock for connection in self.connections.values()]
+		writers = [connection.sock for connection in self.connections.values() if connection.outgoing]
+		readable, writable, failed = select.select([self.listener] + socks, writers, [], timeout)
+		for sock in readable:
+			if sock is self.listener:
+				self.accept()
+			else:
+				self.read(self.connections.get(sock))
+		for sock in writable:
+			self.write(self.connections.get(sock))
+
+	def accept(self):
+		try:
+			sock, address = self.listener.accept()
+		except socket.error:
+			return
+		sock.setblocking(False)
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.connections[sock] = Connection(sock, address)
+
+	def read(self, connection):
+		if connection is None:
+			return
+		try:
+			data = connection.sock.recv(65536)
+		except socket.error, e:
+			self.drop(connection, "read failed: %s" % e)
+			return
+		if not data:
+			if connection.parser.buffer:
+				self.drop(connection, "closed mid-frame, %d bytes unread" % len(connection.parser.buffer))
+			else:
+				self.drop(connection)
+			return
+		self.bytesIn += len(data)
+		try:
+			frames = connection.parser.feed(data)
+		except ValueError:
+			self.fail(connection, "malformed frame")
+			return
+		for command, headers, body in frames:
+			self.handle(connection, command, headers, body)
+			# dropped while publishing (its own backlog) or on its way out: the rest goes unread
+			if connection.closing or connection.dropped:
+				break
+		if not connection.dropped:
+			self.write(connection)
+
+	def write(self, connection):
+		if connection is None or not connection.outgoing:
+			return
+		data = "".join(connection.outgoing)
+		try:
+			sent = connection.sock.send(data)
+		except socket.error, e:
+			self.drop(connection, "write failed: %s" % e)
+			return
+		self.bytesOut += sent
+		remaining = data[sent:]
+		connection.outgoing = [remaining] if remaining else []
+		connection.backlog = len(remaining)
+		if connection.closing and not remaining:
+			self.drop(connection)
+
+	def handle(self, connection, command, headers, body):
+		if command in ("CONNECT", "STOMP"):
+			connection.queue(stomp.encodeFrame("CONNECTED", {"version": "1.0", "session": "%s:%d" % connection.address}))
+		elif command == "SUBSCRIBE":
+			destination = headers.get("destination")
+			if not destination:
+				self.fail(connection, "SUBSCRIBE without a destination")
+				return
+			try:
+				ops = stomp.parseSelector(headers.get("selector"))
+			except stomp.StompError, e:
+				self.fail(connection, str(e))
+				return
+			subscription = Subscription(connection, headers.get("id", destination), destination, ops)
+			self.unsubscribe(connection, subscription.id)
+			connection.subscriptions[subscription.id] = subscription
+			self.topics.setdefault(destination, []).append(subscription)
+		elif command == "UNSUBSCRIBE":
+			self.unsubscribe(connection, headers.get("id", headers.get("destination")))
+		elif command == "SEND":
+			self.publish(headers, body)
+		elif command == "DISCONNECT":
+			connection.closing = True
+		else:
+			self.fail(connection, "unsupported command %r" % command)
+			return
+		receipt = headers.get("receipt")
+		if receipt is not None:
+			connection.queue(stomp.encodeFrame("RECEIPT", {"receipt-id": receipt}))
+		if connection.closing and not connection.outgoing:
+			self.drop(connection)
+
+	def publish(self, headers, body):
+		destination = headers.get("destination")
+		op = headers.get("MESSAGE_PREFIX") or body.split(" ", 1)[0]
+		self.published += 1
+		self.opCounts[op] = self.opCounts.get(op, 0) + 1
+		subscribers = self.topics.get(destination)
+		if not subscribers:
+			return
+		# the frame is the same for every subscriber apart from its subscription id
+		messageHeaders = dict((key, value) for key, value in headers.items() if key not in ("receipt", "content-length"))
+		messageHeaders["message-id"] = "%d" % self.published
+		# a body sent with a length goes out with one, as ActiveMQ keeps bytes messages bytes
+		contentLength = "content-length" in headers
+		for subscription in list(subscribers):
+			if subscription.ops is not None and op not in subscription.ops:
+				continue
+			connection = subscription.connection
+			messageHeaders["subscription"] = subscription.id
+			connection.queue(stomp.encodeFrame("MESSAGE", messageHeaders, body, contentLength))
+			self.delivered += 1
+			if connection.backlog > MAX_BACKLOG:
+				self.slowConsumers += 1
+				self.drop(connection, "slow consumer, %d bytes behind" % connection.backlog)
+
+	def unsubscribe(self, connection, id):
+		subscription = connection.subscriptions.pop(id, None)
+		if subscription is not None:
+			subscribers = self.topics.get(subscription.destination, [])
+			if subscription in subscribers:
+				subscribers.remove(subscription)
+
+	def fail(self, connection, message):
+		connection.queue(stomp.encodeFrame("ERROR", {"message": message}))
+		connection.closing = True
+
+	def drop(self, connection, error=None):
+		if connection.dropped:
+			return
+		connection.dropped = True
+		if error is not None:
+			self.dropped += 1
+			address = "%s:%d" % connection.address
+			self.errors.append((time.time(), address, error))
+			if self.log is not None:
+				self.log("dropped %s: %s" % (address, error))
+		for id in list(connection.subscriptions):
+			self.unsubscribe(connection, id)
+		self.connections.pop(connection.sock, None)
+		try:
+			connection.sock.close()
+		except socket.error:
+			pass
+
+	def summary(self):
+		return ("connections: %d  published: %d  delivered: %d  slow consumers dropped: %d  dropped on errors: %d  in: %d bytes  "
+			"out: %d bytes") % (len(self.connections), self.published, self.delivered, self.slowConsumers, self.dropped, self.bytesIn,
+			self.bytesOut)
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--host", default="127.0.0.1")
+	parser.add_option("--port", type="int", default=DEFAULT_PORT)
+	parser.add_option("--report", type="float", default=5.0, help="seconds between status lines, 0 for none")
+	options, args = parser.parse_args()
+
+	def log(message):
+		print message
+
+	broker = LoopbackBroker(options.host, options.port, log).start()
+	print "vhmsg loopback broker on %s:%d" % broker.address
+	try:
+		while True:
+			time.sleep(options.report or 3600)
+			if options.report:
+				print broker.summary()
+	except KeyboardInterrupt:
+		pass
+	broker.stop()
+	print broker.summary()
+
+
+if __name__ == "__main__":
+	main()
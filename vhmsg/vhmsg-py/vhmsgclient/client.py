@@ -0,0 +1,343 @@
+import collections
+import threading
+import time
+import traceback
+
+from vhmsgclient import backends
+
+# Non-blocking vhmsg client. vhmsg_python only offers blocking connect/send/poll/wait and one
+# global listener, so scripts used to send and then wait(15) blindly. VhmsgClient runs a pump
+# thread that owns the backend: it sends queued messages, waits for incoming ones and dispatches
+# them to per-op subscribers, and resolves request futures when their reply arrives or times out.
+#
+#   client = VhmsgClient()                       # vhmsg_python against localhost:61616
+#   client = VhmsgClient(FakeBroker().connection())
+#   client.start()
+#   client.subscribe("vrSpeak", onSpeak)         # onSpeak(op, args), runs on the pump thread
+#   future = client.request("RemoteSpeechCmd speak ChrBrad 7 ...", "RemoteSpeechReply",
+#       lambda args: args.split()[:2] == ["ChrBrad", "7"], timeout=30)
+#   reply = future.result()                      # args of the matching reply
+#
+# Python 2 has no asyncio; the futures here are thread based, with result(timeout) and
+# completion callbacks. Passing a tracing.Tracer records every message sent and received for
+# latency tracing.
+
+DEFAULT_SERVER = "localhost"
+DEFAULT_SCOPE = "DEFAULT_SCOPE"
+DEFAULT_PORT = "61616"
+
+# seconds the pump blocks in the backend's wait before checking its queues and timeouts
+POLL_INTERVAL = 0.01
+
+
+class VhmsgError(Exception):
+	pass
+
+
+class RequestTimeout(VhmsgError):
+	pass
+
+
+class Future(object):
+
+	def __init__(self):
+		self.finished = threading.Event()
+		self.value = None
+		self.error = None
+		self.callbacks = []
+		self.lock = threading.Lock()
+
+	def done(self):
+		return self.finished.is_set()
+
+	def setResult(self, value):
+		self.complete(value, None)
+
+	def setException(self, error):
+		self.complete(None, error)
+
+	def complete(self, value, error):
+		with self.lock:
+			if self.finished.is_set():
+				return False
+			self.value = value
+			self.error = error
+			self.finished.set()
+			callbacks, self.callbacks = self.callbacks, []
+		for callback in callbacks:
+			callback(self)
+		return True
+
+	def addCallback(self, callback):
+		# called with the future once it completes, straight away if it already has
+		with self.lock:
+			if not self.finished.is_set():
+				self.callbacks.append(callback)
+				return
+		callback(self)
+
+	def exception(self, timeout=None):
+		if not self.finished.wait(timeout):
+			raise RequestTimeout("still waiting after %.1f s" % timeout)
+		return self.error
+
+	def result(self, timeout=None):
+		error = self.exception(timeout)
+		if error is not None:
+			raise error
+		return self.value
+
+
+def waitAll(futures, timeout=None):
+	# waits for every future, returns the ones still not done when the timeout ran out
+	deadline = None
+	if timeout is not None:
+		deadline = time.time() + timeout
+	pending = []
+	for future in futures:
+		remaining = None
+		if deadline is not None:
+			remaining = max(0.0, deadline - time.time())
+		if not future.finished.wait(remaining):
+			pending.append(future)
+	return pending
+
+
+class PendingRequest(object):
+	__slots__ = ("op", "match", "deadline", "future")
+
+	def __init__(self, op, match, deadline, future):
+		self.op = op
+		self.match = match
+		self.deadline = deadline
+		self.future = future
+
+
+def splitMessage(message):
+	op, separator, args = message.partition(" ")
+	return op, args
+
+
+class VhmsgClient(object):
+
+	def __init__(self, backend=None, server=DEFAULT_SERVER, scope=DEFAULT_SCOPE, port=DEFAULT_PORT, pollInterval=POLL_INTERVAL,
+			tracer=None, node="python"):
+		if backend is None:
+			backend = backends.NativeBackend()
+		self.backend = backend
+		self.server = server
+		self.scope = scope
+		self.port = port
+		self.pollInterval = pollInterval
+		# tracing.Tracer recording what this client sends and receives, as node
+		self.tracer = tracer
+		self.node = node
+		self.lock = threading.Lock()
+		# op -> callbacks, "*" gets every message
+		self.handlers = {}
+		self.subscribed = set()
+		# (backend method, argument, future) waiting for the pump when the backend can't be
+		# called from other threads
+		self.outgoing = collections.deque()
+		self.pending = []
+		self.thread = None
+		self.stopped = threading.Event()
+		self.sent = 0
+		self.received = 0
+		self.timeouts = 0
+		self.errors = 0
+		self.lastError = None
+
+	def start(self):
+		self.backend.connect(self.server, self.scope, self.port)
+		self.backend.setListener(self.dispatch)
+		for op in self.subscribed:
+			self.backend.subscribe(op)
+		self.stopped.clear()
+		self.thread = threading.Thread(target=self.run, name="VhmsgClient")
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self, timeout=1.0):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join(timeout)
+			self.thread = None
+		self.flush()
+		with self.lock:
+			pending, self.pending = self.pending, []
+		for request in pending:
+			request.future.setException(VhmsgError("client stopped before a %s arrived" % request.op))
+		self.backend.close()
+
+	def run(self):
+		while not self.stopped.is_set():
+			self.flush()
+			try:
+				self.backend.wait(self.pollInterval)
+			except Exception:
+				self.noteError()
+				time.sleep(self.pollInterval)
+			self.expire(time.time())
+
+	def noteError(self):
+		self.errors += 1
+		self.lastError = traceback.format_exc()
+
+	def ensureSubscribed(self, op):
+		with self.lock:
+			if op in self.subscribed:
+				return
+			self.subscribed.add(op)
+		if self.thread is not None:
+			self.call("subscribe", op)
+
+	def subscribe(self, op, callback):
+		# callback(op, args) for every message of type op, "*" for all of them
+		with self.lock:
+			self.handlers.setdefault(op, []).append(callback)
+		self.ensureSubscribed(op)
+
+	def unsubscribe(self, op, callback):
+		# vhmsg can't unregister, the op stays subscribed but nothing is called for it
+		with self.lock:
+			callbacks = self.handlers.get(op, [])
+			if callback in callbacks:
+				callbacks.remove(callback)
+
+	def send(self, message):
+		# returns a future for the backend's return code once the message is on its way
+		return self.call("send", message)
+
+	def sendBatch(self, messages):
+		# several messages in one go; backends with a sendBatch put them on the wire together
+		# (returns a future for the last send otherwise)
+		if hasattr(self.backend, "sendBatch"):
+			return self.call("sendBatch", list(messages))
+		future = None
+		for message in messages:
+			future = self.send(message)
+		return future
+
+	def call(self, method, argument):
+		future = Future()
+		if self.backend.threadSafe or self.onPumpThread():
+			self.invoke(method, argument, future)
+		else:
+			with self.lock:
+				self.outgoing.append((method, argument, future))
+		return future
+
+	def onPumpThread(self):
+		return self.thread is not None and threading.current_thread() is self.thread
+
+	def invoke(self, method, argument, future):
+		if self.tracer is not None:
+			if method == "send":
+				self.tracer.record("send", argument, self.node)
+			elif method == "sendBatch":
+				for message in argument:
+					self.tracer.record("send", message, self.node)
+		try:
+			result = getattr(self.backend, method)(argument)
+		except Exception, e:
+			self.noteError()
+			future.setException(e)
+			return
+		if method == "send":
+			self.sent += 1
+		elif method == "sendBatch":
+			self.sent += len(argument)
+		future.setResult(result)
+
+	def flush(self):
+		while True:
+			with self.lock:
+				if not self.outgoing:
+					return
+				method, argument, future = self.outgoing.popleft()
+			self.invoke(method, argument, future)
+
+	def request(self, message, replyOp, match=None, timeout=None):
+		# sends message (None to only wait) and returns a future for the args of the first
+		# replyOp message that match(args) accepts
+		future = Future()
+		deadline = None
+		if timeout is not None:
+			deadline = time.time() + timeout
+		request = PendingRequest(replyOp, match, deadline, future)
+		self.ensureSubscribed(replyOp)
+		with self.lock:
+			self.pending.append(request)
+		if message is not None:
+			def sendFailed(sent):
+				if sent.error is not None:
+					self.abandon(request, sent.error)
+			self.send(message).addCallback(sendFailed)
+		return future
+
+	def waitFor(self, op, match=None, timeout=None):
+		return self.request(None, op, match, timeout)
+
+	def abandon(self, request, error):
+		with self.lock:
+			if request in self.pending:
+				self.pending.remove(request)
+		request.future.setException(error)
+
+	def expire(self, now):
+		expired = []
+		with self.lock:
+			if not self.pending:
+				return
+			keep = []
+			for request in self.pending:
+				if request.deadline is not None and now >= request.deadline:
+					expired.append(request)
+				else:
+					keep.append(request)
+			self.pending = keep
+		for request in expired:
+			self.timeouts += 1
+			request.future.setException(RequestTimeout("no %s within the timeout" % request.op))
+
+	def dispatch(self, message):
+		# listener for the backend, runs on the pump thread
+		self.received += 1
+		if self.tracer is not None:
+			self.tracer.record("receive", message, self.node)
+		op, args = splitMessage(message)
+		with self.lock:
+			callbacks = self.handlers.get(op, []) + self.handlers.get("*", [])
+			answered = []
+			for request in self.pending:
+				if request.op == op and self.accepts(request, args):
+					answered.append(request)
+			for request in answered:
+				self.pending.remove(request)
+		for request in answered:
+			request.future.setResult(args)
+		for callback in callbacks:
+			try:
+				callback(op, args)
+			except Exception:
+				self.noteError()
+
+	def accepts(self, request, args):
+		if request.match is None:
+			return True
+		try:
+			return request.match(args)
+		except Exception:
+			self.noteError()
+			return False
+
+	def stats(self):
+		return {
+			"sent": self.sent,
+			"received": self.received,
+			"pending": len(self.pending),
+			"timeouts": self.timeouts,
+			"errors": self.errors,
+		}
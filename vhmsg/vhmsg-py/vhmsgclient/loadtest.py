@@ -0,0 +1,154 @@
+# Message rate load test for the vhmsg layer. Publishers send a mix of the project's messages
+# (RemoteSpeechCmd, vrSpeak, myrobot) through VhmsgClient over STOMP, subscribers measure what
+# arrives and how late. By default a loopback broker is started in-process; --broker points
+# the test at a running one (the loopback broker, or ActiveMQ's STOMP port):
+#
+#   python -m vhmsgclient.loadtest
+#   python -m vhmsgclient.loadtest --publishers 4 --subscribers 4 --rate 500 --seconds 10
+#   python -m vhmsgclient.loadtest --broker localhost:61613
+
+import optparse
+import threading
+import time
+
+from vhmsgclient import backends, broker, client
+
+# args after the load test's own "<publisher> <seq> <send time>" fields
+PAYLOADS = {
+	"RemoteSpeechCmd": "speak ChrBrad 1 Microsoft|Zira|Desktop ../../data/cache/audio/utt_1.aiff "
+		"<?xml version=\"1.0\" encoding=\"utf-16\"?><speech id=\"sp1\" ref=\"Anybody-1\" type=\"application/ssml+xml\"> "
+		"Hello, my name is Rachel </speech>",
+	"vrSpeak": "Rachel all sp1 <?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"no\" ?><act><bml>"
+		"<speech id=\"sp1\" ref=\"hello\" type=\"application/ssml+xml\">Hello, my name is Rachel</speech></bml></act>",
+	"myrobot": "seq=1200 t=40.000 eyebrow=25 eyebrow_knit=0 eyelid=12 eyeball_pan=127 eyeball_tilt=128 mouth=131 "
+		"mouth_corner=40 necktilt_left=255 necktilt_right=250 headturn=95",
+}
+
+
+def percentile(ordered, fraction):
+	if not ordered:
+		return 0.0
+	return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Subscriber(object):
+
+	def __init__(self, vh, ops):
+		self.client = vh
+		self.lock = threading.Lock()
+		# op -> [latency]
+		self.latencies = dict((op, []) for op in ops)
+		for op in ops:
+			vh.subscribe(op, self.received)
+
+	def received(self, op, args):
+		now = time.time()
+		fields = args.split(" ", 3)
+		with self.lock:
+			self.latencies[op].append(now - float(fields[2]))
+
+
+def publish(vh, index, ops, rate, seconds, counts):
+	interval = 0.0
+	if rate:
+		interval = 1.0 / rate
+	started = time.time()
+	due = started
+	seq = 0
+	while True:
+		now = time.time()
+		if now - started >= seconds:
+			break
+		if interval:
+			if now < due:
+				time.sleep(due - now)
+			due += interval
+		op = ops[seq % len(ops)]
+		vh.send("%s %d %d %.6f %s" % (op, index, seq, time.time(), PAYLOADS[op]))
+		counts[op] = counts.get(op, 0) + 1
+		seq += 1
+
+
+def connect(host, port):
+	return client.VhmsgClient(backends.StompBackend(), host, client.DEFAULT_SCOPE, port).start()
+
+
+def run(host, port, publishers=2, subscribers=2, rate=0.0, seconds=5.0, ops=sorted(PAYLOADS), drain=2.0):
+	listeners = [Subscriber(connect(host, port), ops) for i in range(subscribers)]
+	# let the subscriptions reach the broker before publishing
+	time.sleep(0.2)
+	senders = [connect(host, port) for i in range(publishers)]
+	counts = [{} for i in range(publishers)]
+	threads = [threading.Thread(target=publish, args=(senders[i], i, ops, rate, seconds, counts[i])) for i in range(publishers)]
+	started = time.time()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.time() - started
+
+	published = {}
+	for count in counts:
+		for op, n in count.items():
+			published[op] = published.get(op, 0) + n
+	expected = sum(published.values()) * subscribers
+	deadline = time.time() + drain
+	while time.time() < deadline:
+		if sum(len(values) for listener in listeners for values in listener.latencies.values()) >= expected:
+			break
+		time.sleep(0.05)
+	for vh in senders:
+		vh.stop()
+	for listener in listeners:
+		listener.client.stop()
+
+	results = []
+	for op in ops:
+		latencies = sorted(latency for listener in listeners for latency in listener.latencies[op])
+		results.append({
+			"op": op,
+			"published": published.get(op, 0),
+			"received": len(latencies),
+			"expected": published.get(op, 0) * subscribers,
+			"rate": published.get(op, 0) / elapsed,
+			"p50": percentile(latencies, .50),
+			"p90": percentile(latencies, .90),
+			"p99": percentile(latencies, .99),
+		})
+	return results, elapsed
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--broker", default=None, help="host:port of a running STOMP broker, default an in-process loopback broker")
+	parser.add_option("--publishers", type="int", default=2)
+	parser.add_option("--subscribers", type="int", default=2)
+	parser.add_option("--rate", type="float", default=0.0, help="messages per second per publisher, 0 for as fast as possible")
+	parser.add_option("--seconds", type="float", default=5.0)
+	parser.add_option("--ops", default=",".join(sorted(PAYLOADS)), help="comma separated message types to publish")
+	options, args = parser.parse_args()
+	ops = options.ops.split(",")
+	for op in ops:
+		if op not in PAYLOADS:
+			parser.error("no payload for %r, expected some of %s" % (op, ", ".join(sorted(PAYLOADS))))
+
+	local = None
+	if options.broker:
+		host, port = options.broker.rsplit(":", 1)
+		port = int(port)
+	else:
+		local = broker.LoopbackBroker(port=0).start()
+		host, port = local.address
+
+	results, elapsed = run(host, port, options.publishers, options.subscribers, options.rate, options.seconds, ops)
+	print "%-16s %10s %10s %10s %10s %9s %9s %9s" % ("", "published", "msgs/s", "received", "expected", "p50 ms", "p90 ms", "p99 ms")
+	for result in results:
+		print "%-16s %10d %10.0f %10d %10d %9.2f %9.2f %9.2f" % (result["op"], result["published"], result["rate"],
+			result["received"], result["expected"], result["p50"] * 1000, result["p90"] * 1000, result["p99"] * 1000)
+	if local is not None:
+		print local.summary()
+		local.stop()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,109 @@
+import re
+
+# The STOMP subset shared by the loopback broker and StompBackend. ActiveMQ speaks STOMP on
+# 61613 next to OpenWire on 61616, so the same frames work against the real broker.
+#
+# A vhmsg message maps onto STOMP the way vhmsg does it over JMS: the scope is the topic, the
+# message type goes in a MESSAGE_PREFIX header that subscriptions select on, and the body is
+# the whole "op args" string.
+#
+#   SEND
+#   destination:/topic/DEFAULT_SCOPE
+#   MESSAGE_PREFIX:vrSpeak
+#   ELVISH_SCOPE:DEFAULT_SCOPE
+#
+#   vrSpeak Rachel all sp1 <xml .../>^@
+#
+# SEND frames carry no content-length: ActiveMQ turns a STOMP message with one into a
+# BytesMessage, and the toolkit's JMS listeners only read TextMessages. The body ends at the NUL
+# instead, which a vhmsg string never contains. encodeFrame adds the header when asked to, or
+# when the body holds a NUL and could not be framed otherwise.
+
+TOPIC_PREFIX = "/topic/"
+# selectors understood by the broker: MESSAGE_PREFIX = 'op' [OR MESSAGE_PREFIX = 'op' ...]
+SELECTOR_TERM = re.compile(r"\s*MESSAGE_PREFIX\s*=\s*'([^']*)'\s*(?:OR\s*|$)", re.IGNORECASE)
+
+
+class StompError(Exception):
+	pass
+
+
+def topicFor(scope):
+	return TOPIC_PREFIX + scope
+
+
+def selectorFor(op):
+	# None for "*", which takes everything in the scope
+	if op == "*":
+		return None
+	return "MESSAGE_PREFIX = '%s'" % op
+
+
+def parseSelector(selector):
+	# returns the set of ops a selector accepts, None for all
+	if not selector:
+		return None
+	ops = set()
+	position = 0
+	while position < len(selector):
+		match = SELECTOR_TERM.match(selector, position)
+		if match is None:
+			raise StompError("unsupported selector %r" % selector)
+		ops.add(match.group(1))
+		position = match.end()
+	return ops
+
+
+def encodeFrame(command, headers=None, body="", contentLength=False):
+	lines = [command]
+	for key, value in (headers or {}).items():
+		lines.append("%s:%s" % (key, value))
+	if body and (contentLength or "\0" in body):
+		lines.append("content-length:%d" % len(body))
+	return "\n".join(lines) + "\n\n" + body + "\0"
+
+
+def vhmsgFrame(scope, message):
+	op = message.split(" ", 1)[0]
+	return encodeFrame("SEND", {"destination": topicFor(scope), "MESSAGE_PREFIX": op, "ELVISH_SCOPE": scope}, message)
+
+
+class FrameParser(object):
+	# incremental parser: feed it bytes as they arrive, get back whole frames
+
+	def __init__(self):
+		self.buffer = ""
+
+	def feed(self, data):
+		# returns [(command, headers, body)]
+		buffer = self.buffer + data
+		size = len(buffer)
+		frames = []
+		position = 0
+		while True:
+			# heartbeats and stray line ends between frames
+			while position < size and buffer[position] in "\r\n":
+				position += 1
+			end = buffer.find("\n\n", position)
+			if end < 0:
+				break
+			lines = buffer[position:end].split("\n")
+			headers = {}
+			for line in lines[1:]:
+				key, separator, value = line.rstrip("\r").partition(":")
+				# the first occurrence of a repeated header wins
+				headers.setdefault(key, value)
+			start = end + 2
+			length = headers.get("content-length")
+			if length is not None:
+				stop = start + int(length)
+				if size < stop + 1:
+					break
+			else:
+				stop = buffer.find("\0", start)
+				if stop < 0:
+					break
+			frames.append((lines[0].rstrip("\r"), headers, buffer[start:stop]))
+			position = stop + 1
+		self.buffer = buffer[position:]
+		return frames
@@ -0,0 +1,460 @@
+import json
+import optparse
+import threading
+import time
+
+from vhmsgclient import backends, client
+
+# Tracing for the utterance pipeline: speech recognition (vrSpeech), the NPC Editor (vrExpress),
+# NVBG (vrSpeak), SmartBody and the TTS relay (RemoteSpeechCmd/Reply, vrAgentBML) and on to the
+# robot. Every message a traced VhmsgClient sends or receives is recorded with its timestamp and
+# the node that saw it, under a correlation id taken from the message itself (CORRELATION_KEYS)
+# or given with tag().
+#
+# Ids are only unique within the messages that pass them on, and components number from 1, so
+# a trace id is namespaced: "vrSpeak:sp1" covers the vrExpress NVBG answered with that id, the
+# vrSpeak and the vrSpoke/vrAgentBML replies to it, "RemoteSpeechCmd:12" a TTS request and its
+# reply. traceId(op, id) builds one.
+#
+# Where a component hands an utterance on under an id of its own, the new trace is linked to
+# the one it came from (HANDOFFS): a vrExpress to the last recognized vrSpeech, a
+# RemoteSpeechCmd to the character's last vrSpeak. link() joins any other pair by hand.
+#
+#   tracer = Tracer()
+#   vh = VhmsgClient(tracer=tracer, node="observer").start()
+#   vh.subscribe("*", lambda op, args: None)
+#   ...
+#   print tracer.report()                  # latency histograms per stage
+#   print tracer.formatTimeline("vrSpeak:sp1")     # one utterance, hop by hop
+#   tracer.save("trace.json")
+#
+# A stage is the gap between one message type and the next within a trace (vrExpress -> vrSpeak
+# is NVBG's share); transit is the gap between a message being sent and received where both ends
+# were traced. Saved traces can be replayed against a FakeBroker with the original timing:
+#
+#   python -m vhmsgclient.tracing record --seconds 60 --out trace.json
+#   python -m vhmsgclient.tracing report trace.json
+#   python -m vhmsgclient.tracing replay trace.json --speed 2
+
+
+def fieldAt(index):
+	def key(args):
+		fields = args.split(None, index + 1)
+		if len(fields) > index:
+			return fields[index]
+		return None
+	return key
+
+# message type -> (id namespace, function(args) returning its correlation id, None when it has
+# none). Replies share the namespace of the request they answer
+CORRELATION_KEYS = {
+	# vrSpeech start|partial|interp|asr-complete <asr id> ...
+	"vrSpeech": ("vrSpeech", fieldAt(1)),
+	# vrExpress <character> <addressee> <utterance id> <xml>, NVBG reuses the id on vrSpeak
+	"vrExpress": ("vrSpeak", fieldAt(2)),
+	# vrSpeak <character> <addressee> <message id> <xml>
+	"vrSpeak": ("vrSpeak", fieldAt(2)),
+	# vrSpoke <character> <addressee> <message id> ...
+	"vrSpoke": ("vrSpeak", fieldAt(2)),
+	# vrAgentBML <character> <message id> start|end ...
+	"vrAgentBML": ("vrSpeak", fieldAt(1)),
+	# RemoteSpeechCmd speak <character> <message id> <voice> <file> <xml>
+	"RemoteSpeechCmd": ("RemoteSpeechCmd", fieldAt(2)),
+	# RemoteSpeechReply <character> <message id> OK: ...
+	"RemoteSpeechReply": ("RemoteSpeechCmd", fieldAt(1)),
+}
+
+
+# message type -> (message type it continues, function(args) returning the character for the
+# message, the same for the one it continues). None matches any character
+HANDOFFS = {
+	# the NPC Editor answers what speech recognition heard
+	"vrExpress": ("vrSpeech", None, None),
+	# SmartBody asks the TTS relay for the speech of the character's vrSpeak
+	"RemoteSpeechCmd": ("vrSpeak", fieldAt(1), fieldAt(0)),
+}
+# seconds a hand-off may follow the message it continues
+HANDOFF_TIMEOUT = 10.0
+
+
+def traceId(op, id, keys=CORRELATION_KEYS):
+	# the trace id for a message id as op carries it, "vrSpeak:sp1"
+	namespace = keys[op][0] if op in keys else op
+	return "%s:%s" % (namespace, id)
+
+# seconds
+HISTOGRAM_BOUNDS = [0.0005 * 2 ** i for i in range(16)]
+TRACE_VERSION = 1
+
+
+class Histogram(object):
+
+	def __init__(self, bounds=HISTOGRAM_BOUNDS):
+		self.bounds = bounds
+		# one more bucket for everything past the last bound
+		self.counts = [0] * (len(bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.low = None
+		self.high = None
+
+	def add(self, value):
+		index = 0
+		while index < len(self.bounds) and value > self.bounds[index]:
+			index += 1
+		self.counts[index] += 1
+		self.count += 1
+		self.total += value
+		if self.low is None or value < self.low:
+			self.low = value
+		if self.high is None or value > self.high:
+			self.high = value
+
+	def mean(self):
+		return self.total / max(self.count, 1)
+
+	def percentile(self, fraction):
+		# interpolated within the bucket holding the percentile, which is narrowed to the
+		# smallest and largest values seen
+		if not self.count:
+			return 0.0
+		rank = fraction * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			if count and seen + count >= rank:
+				lower = max(self.bounds[index - 1] if index else 0.0, self.low)
+				upper = min(self.bounds[index] if index < len(self.bounds) else self.high, self.high)
+				return lower + (upper - lower) * (rank - seen) / count
+			seen += count
+		return self.high
+
+	def summary(self):
+		return "n=%d  mean %.1f  p50 %.1f  p90 %.1f  p99 %.1f  max %.1f ms" % (self.count, self.mean() * 1000,
+			self.percentile(.50) * 1000, self.percentile(.90) * 1000, self.percentile(.99) * 1000, (self.high or 0.0) * 1000)
+
+	def bars(self, width=40):
+		lines = []
+		largest = max(self.counts) or 1
+		low = 0.0
+		for index, count in enumerate(self.counts):
+			if index < len(self.bounds):
+				label = "%8.1f - %-8.1f" % (low * 1000, self.bounds[index] * 1000)
+				low = self.bounds[index]
+			else:
+				label = "%8.1f +        " % (low * 1000)
+			if count:
+				lines.append("  %s ms %6d %s" % (label, count, "#" * max(1, count * width // largest)))
+		return "\n".join(lines)
+
+
+class Event(object):
+	__slots__ = ("time", "trace", "op", "kind", "node", "message")
+
+	def __init__(self, time, trace, op, kind, node, message):
+		self.time = time
+		self.trace = trace
+		self.op = op
+		# "send" or "receive"
+		self.kind = kind
+		self.node = node
+		self.message = message
+
+	def toJson(self):
+		return {"time": self.time, "trace": self.trace, "op": self.op, "kind": self.kind, "node": self.node, "message": self.message}
+
+
+def eventFromJson(record):
+	return Event(record["time"], record["trace"], record["op"], record["kind"], record["node"], record["message"])
+
+
+class Tracer(object):
+
+	def __init__(self, keys=CORRELATION_KEYS, handoffs=HANDOFFS, clock=time.time, maxEvents=100000):
+		self.keys = keys
+		self.handoffs = handoffs
+		# message type a hand-off continues -> its character key
+		self.handoffSources = dict((sourceOp, sourceKey) for sourceOp, key, sourceKey in handoffs.values())
+		# (message type, character) -> (trace id, time) of the last message a hand-off continues
+		self.latest = {}
+		self.clock = clock
+		self.maxEvents = maxEvents
+		self.lock = threading.Lock()
+		self.events = []
+		# message text -> trace id given with tag()
+		self.tags = {}
+		# trace id -> the trace id it was linked to
+		self.aliases = {}
+		self.dropped = 0
+
+	def tag(self, message, traceId):
+		# sends and receives of exactly this message go into traceId
+		with self.lock:
+			self.tags[message] = traceId
+
+	def link(self, id, traceId):
+		# messages carrying id belong to traceId's trace, including those already recorded
+		with self.lock:
+			if self.resolve(traceId) != id:
+				self.aliases[id] = traceId
+
+	def resolve(self, id):
+		# called with the lock held
+		seen = 0
+		while id in self.aliases and seen < 16:
+			id = self.aliases[id]
+			seen += 1
+		return id
+
+	def correlate(self, op, args, message):
+		# called with the lock held
+		if message in self.tags:
+			return self.tags[message]
+		if op not in self.keys:
+			return None
+		namespace, key = self.keys[op]
+		try:
+			id = key(args)
+		except Exception:
+			return None
+		if id is None:
+			return None
+		return "%s:%s" % (namespace, id)
+
+	def character(self, key, args):
+		if key is None:
+			return None
+		try:
+			return key(args)
+		except Exception:
+			return None
+
+	def handOff(self, op, args, trace, timestamp):
+		# called with the lock held: remembers messages a hand-off continues, links hand-offs
+		if op in self.handoffSources:
+			self.latest[(op, self.character(self.handoffSources[op], args))] = (trace, timestamp)
+		if op not in self.handoffs or trace in self.aliases:
+			return
+		sourceOp, key, sourceKey = self.handoffs[op]
+		source = self.latest.get((sourceOp, self.character(key, args)))
+		if source is None or timestamp - source[1] > HANDOFF_TIMEOUT:
+			return
+		if self.resolve(source[0]) != trace:
+			self.aliases[trace] = source[0]
+
+	def record(self, kind, message, node, timestamp=None):
+		if timestamp is None:
+			timestamp = self.clock()
+		op, args = client.splitMessage(message)
+		with self.lock:
+			trace = self.correlate(op, args, message)
+			if trace is not None:
+				self.handOff(op, args, trace, timestamp)
+			if len(self.events) >= self.maxEvents:
+				self.dropped += 1
+				return None
+			self.events.append(Event(timestamp, trace, op, kind, node, message))
+		return trace
+
+	def snapshot(self):
+		with self.lock:
+			return list(self.events)
+
+	def traces(self):
+		# trace id -> events in time order; uncorrelated messages are left out
+		with self.lock:
+			events = list(self.events)
+			resolved = dict((id, self.resolve(id)) for id in self.aliases)
+		traces = {}
+		for event in sorted(events, key=lambda event: event.time):
+			if event.trace is not None:
+				traces.setdefault(resolved.get(event.trace, event.trace), []).append(event)
+		return traces
+
+	def timeline(self, traceId):
+		return self.traces().get(traceId, [])
+
+	def stages(self, events):
+		# [(stage name, seconds)] for one trace: from the first sighting of each message type to
+		# the first sighting of the next, and send -> receive transit per message
+		firstSeen = []
+		ops = set()
+		sends = {}
+		transits = []
+		for event in events:
+			if event.op not in ops:
+				ops.add(event.op)
+				firstSeen.append(event)
+			if event.kind == "send":
+				sends.setdefault(event.message, event.time)
+			elif event.message in sends:
+				transits.append(("%s transit" % event.op, event.time - sends.pop(event.message)))
+		stages = []
+		for previous, event in zip(firstSeen, firstSeen[1:]):
+			stages.append(("%s -> %s" % (previous.op, event.op), event.time - previous.time))
+		first = firstSeen[0].time if firstSeen else 0.0
+		stages.append(("total", events[-1].time - first if events else 0.0))
+		return stages + transits
+
+	def histograms(self):
+		# stage name -> Histogram over every trace
+		histograms = {}
+		for events in self.traces().values():
+			for stage, seconds in self.stages(events):
+				histograms.setdefault(stage, Histogram()).add(seconds)
+		return histograms
+
+	def report(self, bars=False):
+		histograms = self.histograms()
+		lines = ["%d events, %d traces" % (len(self.events), len(self.traces()))]
+		if self.dropped:
+			lines[0] += ", %d events past maxEvents not recorded" % self.dropped
+		for stage in sorted(histograms, key=lambda stage: (stage == "total", stage)):
+			lines.append("%-40s %s" % (stage, histograms[stage].summary()))
+			if bars:
+				lines.append(histograms[stage].bars())
+		return "\n".join(lines)
+
+	def formatTimeline(self, traceId):
+		events = self.timeline(traceId)
+		if not events:
+			return "no trace %r" % traceId
+		lines = ["trace %s" % traceId]
+		start = events[0].time
+		for event in events:
+			lines.append("  %+9.1f ms  %-7s %-18s %-20s %s" % ((event.time - start) * 1000, event.kind, event.op, event.node,
+				event.message[len(event.op) + 1:][:60]))
+		return "\n".join(lines)
+
+	def toJson(self):
+		# events are exported under their linked trace ids, so a loaded trace needs no aliases
+		events = []
+		traces = {}
+		for traceId, trace in self.traces().items():
+			traces[traceId] = [{"stage": stage, "seconds": seconds} for stage, seconds in self.stages(trace)]
+			for event in trace:
+				record = event.toJson()
+				record["trace"] = traceId
+				events.append(record)
+		events.extend(event.toJson() for event in self.snapshot() if event.trace is None)
+		events.sort(key=lambda record: record["time"])
+		return {"version": TRACE_VERSION, "events": events, "traces": traces}
+
+	def save(self, path):
+		with open(path, "w") as f:
+			json.dump(self.toJson(), f, indent=1)
+
+
+def load(path):
+	with open(path) as f:
+		data = json.load(f)
+	if data.get("version") != TRACE_VERSION:
+		raise ValueError("%s: unsupported trace version %r" % (path, data.get("version")))
+	tracer = Tracer()
+	tracer.events = [eventFromJson(record) for record in data["events"]]
+	return tracer
+
+
+def replaySends(events):
+	# what a replay sends: the recorded sends, or for messages only seen arriving (a passive
+	# observer's trace) their first arrival, sent from a "replay" node
+	sent = set(event.message for event in events if event.kind == "send")
+	replayed = []
+	for event in sorted(events, key=lambda event: event.time):
+		if event.kind == "send":
+			replayed.append(event)
+		elif event.message not in sent:
+			sent.add(event.message)
+			replayed.append(Event(event.time, event.trace, event.op, "send", "replay", event.message))
+	return replayed
+
+
+def replay(events, broker=None, speed=1.0, drain=1.0, scope=client.DEFAULT_SCOPE):
+	# resends a recorded trace through a FakeBroker, one client per sending node, keeping the
+	# original gaps (divided by speed). returns a Tracer with what the replay saw
+	if broker is None:
+		broker = backends.FakeBroker()
+	tracer = Tracer()
+	sends = replaySends(events)
+	observer = client.VhmsgClient(broker.connection(), scope=scope, tracer=tracer, node="observer")
+	observer.subscribe("*", lambda op, args: None)
+	observer.start()
+	senders = {}
+	try:
+		if sends:
+			origin = sends[0].time
+			started = time.time()
+			for event in sends:
+				due = started + (event.time - origin) / speed
+				delay = due - time.time()
+				if delay > 0:
+					time.sleep(delay)
+				sender = senders.get(event.node)
+				if sender is None:
+					sender = senders[event.node] = client.VhmsgClient(broker.connection(), scope=scope, tracer=tracer,
+						node=event.node).start()
+				if event.trace is not None:
+					tracer.tag(event.message, event.trace)
+				sender.send(event.message)
+		deadline = time.time() + drain
+		while time.time() < deadline and observer.received < len(sends):
+			time.sleep(0.01)
+	finally:
+		for sender in senders.values():
+			sender.stop()
+		observer.stop()
+	return tracer
+
+
+def main():
+	parser = optparse.OptionParser(usage="%prog record [--seconds N] [--out trace.json]\n"
+		"       %prog report trace.json [--trace id] [--bars]\n"
+		"       %prog replay trace.json [--speed X]")
+	parser.add_option("--broker", default=None, help="host:port of a STOMP broker to record from, default vhmsg_python")
+	parser.add_option("--server", default=client.DEFAULT_SERVER)
+	parser.add_option("--scope", default=client.DEFAULT_SCOPE)
+	parser.add_option("--seconds", type="float", default=60.0, help="how long to record")
+	parser.add_option("--out", default="trace.json")
+	parser.add_option("--trace", default=None, help="print the timeline of this trace id")
+	parser.add_option("--bars", action="store_true", help="print the histogram buckets")
+	parser.add_option("--speed", type="float", default=1.0, help="replay speed, 2 replays twice as fast")
+	options, args = parser.parse_args()
+	if not args or args[0] not in ("record", "report", "replay"):
+		parser.error("expected record, report or replay")
+	command = args[0]
+
+	if command == "record":
+		if options.broker:
+			host, port = options.broker.rsplit(":", 1)
+			backend = backends.StompBackend()
+		else:
+			host, port = options.server, client.DEFAULT_PORT
+			backend = backends.NativeBackend()
+		tracer = Tracer()
+		vh = client.VhmsgClient(backend, host, options.scope, port, tracer=tracer, node="observer")
+		vh.subscribe("*", lambda op, args: None)
+		vh.start()
+		try:
+			time.sleep(options.seconds)
+		except KeyboardInterrupt:
+			pass
+		vh.stop()
+		tracer.save(options.out)
+		print tracer.report(options.bars)
+		print "saved to %s" % options.out
+		return
+
+	if len(args) != 2:
+		parser.error("%s needs a trace file" % command)
+	tracer = load(args[1])
+	if command == "replay":
+		print "recorded:"
+		print tracer.report(options.bars)
+		tracer = replay(tracer.events, speed=options.speed, scope=options.scope)
+		print "replayed:"
+	print tracer.report(options.bars)
+	if options.trace:
+		print tracer.formatTimeline(options.trace)
+
+
+if __name__ == "__main__":
+	main()